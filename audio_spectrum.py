@@ -0,0 +1,220 @@
+import array
+import math
+import sys
+import time
+
+try:
+    from ulab import numpy as np  # CircuitPython
+except ImportError:
+    import numpy as np
+
+# Streaming spectrum for the audio visualizer. A source fills fixed-size blocks of
+# 16-bit samples (a microphone on an ADC pin on the board, a WAV file on a
+# desktop); SpectrumAnalyzer windows each block, runs one vectorized FFT and
+# folds the bins into log-spaced bands, smoothed with separate attack and decay
+# so bars jump up and fall back gently. Blocks are sample_rate / fps samples, so
+# one block is one display frame, and the analysis of a block has to finish
+# within that frame for the visualizer to keep up; the per-block read and
+# processing times are tracked for exactly that check.
+
+SAMPLE_RATE = 10240  # Hz
+FPS = 20  # Blocks, and so display frames, per second
+BANDS = 12
+FULL_SCALE = 32768
+
+_FLOAT = np.float64 if hasattr(np, 'float64') else np.float
+
+def _clock():
+    return time.perf_counter() if hasattr(time, 'perf_counter') else time.monotonic()
+
+class ADCSource:
+    # An analog microphone (e.g. a MAX4466 breakout) on `pin`. Uses
+    # analogbufio.BufferedIn, which samples in the background at an exact rate,
+    # where the port has it; otherwise AnalogIn reads paced by monotonic_ns.
+    # read() blocks for one block's worth of audio either way.
+    typecode = 'H'  # The ADC reads unsigned, centred on mid-scale
+
+    def __init__(self, pin, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        try:
+            import analogbufio
+            self.buffered = analogbufio.BufferedIn(pin, sample_rate=sample_rate)
+            self.analog = None
+        except ImportError:
+            import analogio
+            self.buffered = None
+            self.analog = analogio.AnalogIn(pin)
+        self.period_ns = 1000000000 // sample_rate
+
+    def read(self, buffer):
+        # Fills buffer (array of 'H') and returns the number of samples read
+        if self.buffered is not None:
+            return self.buffered.readinto(buffer)
+        analog = self.analog
+        deadline = time.monotonic_ns()
+        for i in range(len(buffer)):
+            while time.monotonic_ns() < deadline:
+                pass
+            buffer[i] = analog.value
+            deadline += self.period_ns
+        return len(buffer)
+
+class WavSource:
+    # 16-bit PCM WAV file, mixed down to mono; loops when `loop` is set, otherwise
+    # pads the last block with silence and then returns 0
+    typecode = 'h'
+
+    def __init__(self, path, loop=False):
+        import wave
+        with wave.open(path, 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                raise ValueError(f"{path}: only 16-bit PCM is supported")
+            self.sample_rate = wav.getframerate()
+            channels = wav.getnchannels()
+            frames = wav.readframes(wav.getnframes())
+        samples = np.frombuffer(frames, dtype=np.int16).reshape(-1, channels)
+        self.samples = samples.mean(axis=1).astype(np.int16)
+        self.loop = loop
+        self.position = 0
+
+    def read(self, buffer):
+        count = len(buffer)
+        if self.position >= len(self.samples):
+            if not self.loop or not len(self.samples):
+                return 0
+            self.position = 0
+        block = np.zeros(count, dtype=np.int16)
+        chunk = self.samples[self.position:self.position + count]
+        block[:len(chunk)] = chunk
+        memoryview(buffer).cast('B')[:] = block.tobytes()
+        self.position += count
+        return count
+
+class SyntheticSource:
+    # A tone sweeping up through the bands every `seconds`, for host checks
+    # without a WAV file
+    typecode = 'h'
+
+    def __init__(self, sample_rate=SAMPLE_RATE, seconds=4.0, low=60.0, high=4000.0, loop=False):
+        self.sample_rate = sample_rate
+        self.loop = loop
+        self.total = int(seconds * sample_rate)
+        self.low = low
+        self.ratio = high / low
+        self.phase = 0.0
+        self.position = 0
+
+    def read(self, buffer):
+        if self.position >= self.total and not self.loop:
+            return 0
+        for i in range(len(buffer)):
+            frequency = self.low * self.ratio ** ((self.position % self.total) / self.total)
+            self.phase += 2 * math.pi * frequency / self.sample_rate
+            buffer[i] = int(16000 * math.sin(self.phase))
+            self.position += 1
+        return len(buffer)
+
+class SpectrumAnalyzer:
+    # typecode: of the sources' sample buffers, 'h' or 'H' (DC is removed either way)
+    def __init__(self, sample_rate=SAMPLE_RATE, fps=FPS, bands=BANDS, low=60.0, high=None,
+                 attack=0.6, decay=0.15, floor_db=-60.0, ceiling_db=0.0, typecode='h'):
+        self.sample_rate = sample_rate
+        self.block_size = sample_rate // fps
+        # FFT length: the block, zero-padded up to a power of two
+        self.fft_size = 1
+        while self.fft_size < self.block_size:
+            self.fft_size *= 2
+        self.window = np.array([0.5 - 0.5 * math.cos(2 * math.pi * i / (self.block_size - 1))
+                                for i in range(self.block_size)], dtype=_FLOAT)
+        self.padded = np.zeros(self.fft_size, dtype=_FLOAT)
+        # A full-scale sine reads as 0 dB: Hann coherent gain 0.5, half the energy per side
+        self.reference = FULL_SCALE * sum(0.5 - 0.5 * math.cos(2 * math.pi * i / (self.block_size - 1))
+                                          for i in range(self.block_size)) / 2
+        self.band_starts, self.band_ends = self.band_bins(bands, low, high or sample_rate / 2)
+        self.attack = attack
+        self.decay = decay
+        self.floor_db = floor_db
+        self.span_db = ceiling_db - floor_db
+        self.levels = [0.0] * bands  # Smoothed band levels, 0..1
+        self.buffer = array.array(typecode, [0] * self.block_size)
+        self.blocks = 0
+        self.read_time = 0.0
+        self.process_time = 0.0
+        self.process_max = 0.0
+
+    def band_bins(self, bands, low, high):
+        # [start, end) FFT bins of `bands` log-spaced bands from low to high Hz,
+        # each at least one bin wide and none overlapping
+        hz_per_bin = self.sample_rate / self.fft_size
+        last = self.fft_size // 2
+        starts = []
+        ends = []
+        previous = 1  # Bin 0 is DC
+        for band in range(bands):
+            start = max(previous, int(low * (high / low) ** (band / bands) / hz_per_bin))
+            end = max(start + 1, int(low * (high / low) ** ((band + 1) / bands) / hz_per_bin))
+            start, end = min(start, last - 1), min(end, last)
+            starts.append(start)
+            ends.append(end)
+            previous = end
+        return starts, ends
+
+    def process(self, samples):
+        # One block of raw samples -> updated self.levels
+        x = np.array(samples, dtype=_FLOAT)
+        x = (x - np.mean(x)) * self.window  # DC offset of the ADC out, then window
+        self.padded[:self.block_size] = x
+        spectrum = np.fft.fft(self.padded)
+        half = self.fft_size // 2
+        if isinstance(spectrum, tuple):  # ulab builds without complex numbers
+            real, imaginary = spectrum
+            magnitude = np.sqrt(real[:half] * real[:half] + imaginary[:half] * imaginary[:half])
+        else:
+            magnitude = abs(spectrum[:half])
+        for band in range(len(self.levels)):
+            # A band reads as its strongest bin, so a tone in a wide band is not diluted
+            peak = float(np.max(magnitude[self.band_starts[band]:self.band_ends[band]])) / self.reference
+            level = (20 * math.log10(peak + 1e-9) - self.floor_db) / self.span_db
+            level = 0.0 if level < 0 else 1.0 if level > 1 else level
+            previous = self.levels[band]
+            self.levels[band] = previous + (self.attack if level > previous else self.decay) * (level - previous)
+        return self.levels
+
+    def update(self, source):
+        # Reads and analyzes one block; False once the source has run dry
+        started = _clock()
+        count = source.read(self.buffer)
+        read = _clock()
+        if not count:
+            return False
+        self.process(self.buffer)
+        finished = _clock()
+        self.blocks += 1
+        self.read_time += read - started
+        self.process_time += finished - read
+        if finished - read > self.process_max:
+            self.process_max = finished - read
+        return True
+
+    def report(self):
+        blocks = self.blocks or 1
+        budget = 1000 * self.block_size / self.sample_rate
+        mean = 1000 * self.process_time / blocks
+        return (f"{self.blocks} blocks of {self.block_size} samples ({budget:.1f} ms each), "
+                f"read {1000 * self.read_time / blocks:.2f} ms, process {mean:.2f}/{1000 * self.process_max:.2f} ms "
+                f"(mean/max), {'keeps up' if 1000 * self.process_max < budget else 'FALLS BEHIND'}")
+
+def main(argv=None):
+    # Host benchmark: analyze a WAV file (or a synthetic sweep) block by block as
+    # fast as possible and print the band levels and per-block timing
+    argv = sys.argv[1:] if argv is None else argv
+    source = WavSource(argv[0]) if argv else SyntheticSource()
+    analyzer = SpectrumAnalyzer(source.sample_rate, typecode=source.typecode)
+    while analyzer.update(source):
+        if analyzer.blocks % FPS == 0:
+            print(' '.join(f"{level:4.2f}" for level in analyzer.levels))
+    print(analyzer.report())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
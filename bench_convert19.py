@@ -0,0 +1,246 @@
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import convert19
+
+# Per-stage benchmark for the convert19 pipeline. Every stage is timed on its own
+# against deterministic synthetic images (plus the bundled input.webp), reported as
+# min / median / p95 wall time and peak traced memory, and optionally compared
+# against a stored baseline JSON so time or memory regressions fail the run.
+SIZES = {
+    '512': (512, 512),
+    '1k': (1024, 1024),
+    '2k': (2048, 2048),
+    '4k': (3840, 2160),
+    '8k': (7680, 4320),
+}
+BUNDLED_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input.webp')
+TOLERANCE = 0.25
+NOISE_FLOOR_MS = 2.0
+NOISE_FRACTION = 0.03  # Of the input's whole pipeline time
+MEMORY_TOLERANCE = 0.10
+MEMORY_FLOOR_BYTES = 1 << 20
+
+def synthetic_image(width, height, seed=0):
+    # Gradient background with filled shapes and light noise, so Canny and the
+    # contour fill have realistic work to do. Same seed, same pixels.
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[..., 0] = x * 0.6 + y * 0.2
+    img[..., 1] = y * 0.5
+    img[..., 2] = 255 - x * 0.4
+    scale = min(width, height)
+    for _ in range(12 + scale // 64):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        if rng.random() < 0.5:
+            cv2.circle(img, center, int(rng.integers(scale // 40, scale // 6)), color, -1)
+        else:
+            size = rng.integers(scale // 40, scale // 5, 2)
+            cv2.rectangle(img, center, (center[0] + int(size[0]), center[1] + int(size[1])), color, -1)
+    noise = rng.integers(-6, 7, img.shape, dtype=np.int16)
+    return np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+def encode_png(img_array):
+    buffer = io.BytesIO()
+    Image.fromarray(img_array).save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+def benchmark_inputs(sizes):
+    inputs = {}
+    for name in sizes:
+        width, height = SIZES[name]
+        inputs[name] = encode_png(synthetic_image(width, height))
+    if os.path.exists(BUNDLED_IMAGE):
+        with open(BUNDLED_IMAGE, 'rb') as file:
+            inputs['input.webp'] = file.read()
+    return inputs
+
+def pipeline_stages(encoded, output_directory, color_lookup):
+    # Ordered (name, callable) pairs. Each stage consumes the previous stages' results
+    # through `state`, which is filled once untimed so every stage can run in isolation.
+    quantizer = convert19.get_quantizer(color_lookup)
+    paths = convert19.output_paths(output_directory, 'bench')
+    state = {}
+
+    def decode():
+        state['img_array'] = np.array(Image.open(io.BytesIO(encoded)).convert('RGB'))
+
+    def mask():
+        state['img_masked'], _, state['edges'] = convert19.apply_edge_detection_and_masking(state['img_array'])
+
+    def blocks():
+        state['img_blocks'] = convert19.convert_to_blocks_and_dominate_color(state['img_masked'])
+
+    def quantize():
+        state['indices'] = quantizer.indices(state['img_blocks'])
+
+    def save_masked():
+        Image.fromarray(state['img_masked']).save(paths['masked'])
+
+    def save_edges():
+        Image.fromarray(state['edges']).save(paths['edges'])
+
+    def save_blocks():
+        convert19.save_upscaled_png(paths['blocks'], state['img_blocks'], convert19.BLOCK_SIZE)
+
+    def save_blocks_txt():
+        convert19.save_color_data_to_txt(state['img_blocks'], paths['blocks_txt'])
+
+    def write_litebrite(artifact):
+        # From the quantize stage's indices, so quantizing is not timed again here
+        for _, write in convert19.litebrite_writers(state['indices'], paths, convert19.BLOCK_SIZE, color_lookup,
+                                                    quantizer, (artifact,)):
+            write()
+
+    def save_litebrite():
+        write_litebrite('litebrite')
+
+    def save_litebrite_txt():
+        write_litebrite('litebrite_txt')
+
+    def save_litebrite_bin():
+        write_litebrite('litebrite_bin')
+
+    stages = [decode, mask, blocks, quantize, save_masked, save_edges, save_blocks, save_blocks_txt,
+              save_litebrite, save_litebrite_txt, save_litebrite_bin]
+    for stage in stages[:4]:
+        stage()
+    return [(stage.__name__, stage) for stage in stages]
+
+def measure(stages, repeat):
+    # Times every stage once per round rather than each stage `repeat` times in a
+    # row, so a burst of load on the machine slows one run of several stages
+    # instead of every run of one stage
+    timings = {stage_name: [] for stage_name, _ in stages}
+    for _, stage in stages:
+        stage()  # warm-up
+    for _ in range(repeat):
+        for stage_name, stage in stages:
+            start = time.perf_counter()
+            stage()
+            timings[stage_name].append((time.perf_counter() - start) * 1000)
+    results = {}
+    for stage_name, stage in stages:
+        tracemalloc.start()
+        stage()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[stage_name] = {
+            'min_ms': round(float(np.min(timings[stage_name])), 3),
+            'median_ms': round(float(np.median(timings[stage_name])), 3),
+            'p95_ms': round(float(np.percentile(timings[stage_name], 95)), 3),
+            'peak_bytes': int(peak),
+            'runs': repeat,
+        }
+    return results
+
+def run_benchmarks(sizes, repeat, color_lookup):
+    results = {}
+    with tempfile.TemporaryDirectory() as output_directory:
+        for name, encoded in benchmark_inputs(sizes).items():
+            results[name] = measure(pipeline_stages(encoded, output_directory, color_lookup), repeat)
+            for stage_name, stats in results[name].items():
+                print(f"{name:>10} {stage_name:<20} min {stats['min_ms']:9.2f} ms  median {stats['median_ms']:9.2f} ms  "
+                      f"p95 {stats['p95_ms']:9.2f} ms  peak {stats['peak_bytes'] / 1048576:8.1f} MiB", flush=True)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+def compare(report, baseline, tolerance=TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    # Returns (input, stage, what, before, after) for every regression.
+    # Time compares the fastest run of each stage, which noise can only push up,
+    # after scaling the baseline by how much slower this whole run is: the median
+    # slowdown over all stages, so a busier or throttled machine does not fail
+    # every stage at once. A stage then regresses when it is `tolerance` slower
+    # than that and the difference is also bigger than the noise: the run-to-run
+    # spread (p95 - min) of either report, and at least NOISE_FRACTION of the
+    # input's whole pipeline (or NOISE_FLOOR_MS), since short stages vary by more
+    # between processes than within one.
+    # Peak memory is deterministic enough to compare directly: it regresses when it
+    # grows by more than memory_tolerance and MEMORY_FLOOR_BYTES.
+    pairs = []
+    for name, stages in report['results'].items():
+        for stage_name, stats in stages.items():
+            reference = baseline.get('results', {}).get(name, {}).get(stage_name)
+            if reference is not None:
+                pairs.append((name, stage_name, reference, stats))
+
+    def fastest(stats):
+        return stats.get('min_ms', stats['median_ms'])  # Reports from before min_ms
+
+    ratios = [fastest(stats) / fastest(reference) for _, _, reference, stats in pairs
+              if fastest(reference) >= NOISE_FLOOR_MS]
+    machine = max(1.0, float(np.median(ratios))) if ratios else 1.0
+    totals = {}
+    for name, _, reference, _ in pairs:
+        totals[name] = totals.get(name, 0.0) + fastest(reference)
+    regressions = []
+    for name, stage_name, reference, stats in pairs:
+        before, after = fastest(reference), fastest(stats)
+        expected = before * machine
+        noise = max(NOISE_FLOOR_MS, NOISE_FRACTION * totals[name],
+                    reference['p95_ms'] - before, stats['p95_ms'] - after)
+        if after > expected * (1 + tolerance) and after - expected > noise:
+            regressions.append((name, stage_name, 'time', before, after))
+        before, after = reference['peak_bytes'], stats['peak_bytes']
+        if after > before * (1 + memory_tolerance) and after - before > MEMORY_FLOOR_BYTES:
+            regressions.append((name, stage_name, 'memory', before, after))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-stage benchmark for the convert19 pipeline.')
+    parser.add_argument('--sizes', default=','.join(SIZES), help=f"comma-separated subset of {', '.join(SIZES)}")
+    parser.add_argument('--repeat', type=int, default=7, help='timed runs per stage')
+    parser.add_argument('--output', default=None, help='write the JSON report here')
+    parser.add_argument('--baseline', default=None, help='fail if slower than this stored report')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed slowdown vs baseline (0.25 = 25%%)')
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE, help='allowed peak memory growth vs baseline')
+    args = parser.parse_args(argv)
+
+    sizes = [size for size in args.sizes.split(',') if size]
+    unknown = set(sizes) - set(SIZES)
+    if unknown:
+        parser.error(f"unknown sizes {sorted(unknown)}")
+    report = run_benchmarks(sizes, args.repeat, convert19.color_lookup)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, args.tolerance, args.memory_tolerance)
+        for name, stage_name, what, before, after in regressions:
+            if what == 'time':
+                change = f"{before:.2f} ms -> {after:.2f} ms"
+            else:
+                change = f"peak {before / 1048576:.1f} MiB -> {after / 1048576:.1f} MiB"
+            print(f"REGRESSION {name} {stage_name}: {change}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,43 @@
-import cv2
+import argparse
+import hashlib
+import json
+import litegrid
 import numpy as np
 import os
-from PIL import Image
+import shutil
+import struct
+import sys
+import time
+import zlib
+
+# OpenCV and Pillow are imported inside the functions that use them, so importing
+# this module, or running the grid-only CLI commands, does not pay for them.
+
+BLOCK_SIZE = 32
+TRIM_FRACTION = 0.1
+BLUR_KERNEL = 5
+CANNY_THRESHOLDS = (50, 150)
+TILE_HALO = 256
+FAST_MASK_SAMPLES = 8
+PNG_COMPRESS_LEVEL = 6
+ARTIFACTS = ('masked', 'edges', 'blocks', 'blocks_txt', 'litebrite', 'litebrite_txt', 'litebrite_bin')
+DEFAULT_OUTPUTS = ARTIFACTS[:6]
+PALETTE_OUTPUTS = ('litebrite', 'litebrite_txt', 'litebrite_bin')
+TILED_SKIPPED_OUTPUTS = ('masked', 'edges')  # Full-resolution images the tiled path never builds
+CACHE_VERSION = 1
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_OPTIONS = {
+    'block_size': BLOCK_SIZE,
+    'reducer': 'median',
+    'keep_partial': False,
+    'metric': 'l1',
+    'lut_bits': None,
+    'blur_kernel': BLUR_KERNEL,
+    'canny_thresholds': CANNY_THRESHOLDS,
+    'tile_size': None,
+    'fast_mask': False,
+    'fast_mask_samples': FAST_MASK_SAMPLES,
+}
 
 def closest_color(pixel, color_lookup):
     lite_brite_colors = np.array(list(color_lookup.values()))
@@ -9,72 +45,1143 @@ def closest_color(pixel, color_lookup):
     total_diff = abs_diff.sum(axis=1)
     return list(color_lookup.keys())[np.argmin(total_diff)]
 
-def apply_edge_detection_and_masking(img_array):
+def rgb_to_lab(rgb):
+    # sRGB (D65) -> CIELAB, for perceptual palette matching
+    srgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(srgb > 0.04045, ((srgb + 0.055) / 1.055) ** 2.4, srgb / 12.92)
+    xyz = linear @ np.array([[0.4124564, 0.2126729, 0.0193339],
+                             [0.3575761, 0.7151522, 0.1191920],
+                             [0.1804375, 0.0721750, 0.9503041]])
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+class PaletteQuantizer:
+    # Maps RGB arrays to indices into color_lookup. Built once per palette; metric is
+    # 'l1' (same choice as closest_color), 'l2' or 'lab' (Euclidean distance in CIELAB).
+    METRICS = ('l1', 'l2', 'lab')
+    CHUNK = 1 << 16
+
+    def __init__(self, color_lookup, metric='l1', lut_bits=None):
+        if metric not in self.METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {self.METRICS}")
+        self.keys = list(color_lookup.keys())
+        self.key_array = np.array(self.keys)
+        self.colors = np.array(list(color_lookup.values()), dtype=np.uint8)
+        self.metric = metric
+        self._palette = self._to_metric_space(self.colors)
+        self.lut_bits = None
+        self.lut = None
+        if lut_bits:
+            self.build_lut(lut_bits)
+
+    def _to_metric_space(self, rgb):
+        if self.metric == 'lab':
+            return rgb_to_lab(rgb)
+        return rgb.astype(np.int32)
+
+    def _nearest(self, pixels):
+        indices = np.empty(len(pixels), dtype=np.uint8)
+        for start in range(0, len(pixels), self.CHUNK):
+            diff = self._to_metric_space(pixels[start:start + self.CHUNK])[:, None, :] - self._palette[None, :, :]
+            if self.metric == 'l1':
+                distance = np.abs(diff).sum(axis=2)
+            else:
+                distance = (diff * diff).sum(axis=2)
+            indices[start:start + self.CHUNK] = np.argmin(distance, axis=1)
+        return indices
+
+    def build_lut(self, bits=5):
+        # Precompute the nearest palette entry for the centre of every cell of a
+        # 2**bits per channel RGB cube. Lookups are then a single gather, at the cost
+        # of matching against the cell centre rather than the exact colour.
+        shift = 8 - bits
+        levels = (np.arange(1 << bits, dtype=np.int32) << shift) + ((1 << shift) >> 1)
+        r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+        cube = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1).astype(np.uint8)
+        self.lut_bits = bits
+        self.lut = self._nearest(cube)
+        return self.lut
+
+    def indices(self, img_blocks):
+        img_blocks = np.asarray(img_blocks, dtype=np.uint8)
+        pixels = img_blocks.reshape(-1, 3)
+        if self.lut is not None:
+            shift = 8 - self.lut_bits
+            channels = (pixels >> shift).astype(np.int32)
+            cells = (channels[:, 0] << (2 * self.lut_bits)) | (channels[:, 1] << self.lut_bits) | channels[:, 2]
+            indices = self.lut[cells]
+        else:
+            indices = self._nearest(pixels)
+        return indices.reshape(img_blocks.shape[:-1])
+
+    def quantize(self, img_blocks):
+        return self.colors[self.indices(img_blocks)]
+
+    def characters(self, img_blocks):
+        return self.key_array[self.indices(img_blocks)]
+
+_quantizers = {}
+
+def get_quantizer(color_lookup, metric='l1', lut_bits=None):
+    key = (tuple((name, tuple(color)) for name, color in color_lookup.items()), metric, lut_bits)
+    if key not in _quantizers:
+        _quantizers[key] = PaletteQuantizer(color_lookup, metric, lut_bits)
+    return _quantizers[key]
+
+def detect_edges(img_array, blur_kernel=BLUR_KERNEL, canny_thresholds=CANNY_THRESHOLDS):
+    import cv2
     gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    edges = cv2.Canny(blurred, 50, 150)
+    blurred = cv2.GaussianBlur(gray, (blur_kernel, blur_kernel), 0)
+    edges = cv2.Canny(blurred, *canny_thresholds)
     dilated_edges = cv2.dilate(edges, np.ones((3, 3), np.uint8), iterations=1)
+    return edges, dilated_edges
+
+def apply_edge_detection_and_masking(img_array, blur_kernel=BLUR_KERNEL, canny_thresholds=CANNY_THRESHOLDS, counters=None):
+    import cv2
+    edges, dilated_edges = detect_edges(img_array, blur_kernel, canny_thresholds)
     contours, _ = cv2.findContours(dilated_edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    mask = np.zeros_like(gray)
+    mask = np.zeros(img_array.shape[:2], dtype=np.uint8)
     cv2.fillPoly(mask, contours, 255)
+    if counters is not None:
+        counters['contours'] = len(contours)
+        counters['mask_coverage'] = round(np.count_nonzero(mask) / mask.size, 6)
     img_masked = img_array.copy()
     img_masked[mask == 0] = [0, 0, 0]
     return img_masked, mask * 255, edges
 
-def convert_to_blocks_and_dominate_color(img_array):
-    block_size = 32
-    img_blocks = np.zeros((img_array.shape[0] // block_size, img_array.shape[1] // block_size, 3), dtype=np.uint8)
-    for y in range(img_blocks.shape[0]):
-        for x in range(img_blocks.shape[1]):
-            block = img_array[y*block_size:(y+1)*block_size, x*block_size:(x+1)*block_size]
-            dominant_color = np.median(block, axis=(0, 1)).astype(np.uint8)
-            img_blocks[y, x] = dominant_color
+def _reduce_median(pixels):
+    return np.median(pixels, axis=-1).astype(np.uint8)
+
+def _reduce_mean(pixels):
+    return pixels.mean(axis=-1).astype(np.uint8)
+
+def _reduce_trimmed_mean(pixels, trim=TRIM_FRACTION):
+    # Drop the darkest and brightest `trim` share of each channel before averaging
+    count = pixels.shape[-1]
+    cut = min(int(count * trim), (count - 1) // 2)
+    ordered = np.sort(pixels, axis=-1)
+    return ordered[..., cut:count - cut].mean(axis=-1).astype(np.uint8)
+
+def _reduce_mode(pixels):
+    # Most frequent RGB triple per block; ties go to the lowest packed value
+    packed = (pixels[..., 0, :].astype(np.int32) << 16) | (pixels[..., 1, :].astype(np.int32) << 8) | pixels[..., 2, :]
+    packed = np.sort(packed, axis=-1)
+    positions = np.arange(packed.shape[-1])
+    starts = np.ones(packed.shape, dtype=bool)
+    starts[..., 1:] = packed[..., 1:] != packed[..., :-1]
+    run_start = np.maximum.accumulate(np.where(starts, positions, 0), axis=-1)
+    best = np.argmax(positions - run_start, axis=-1)
+    mode = np.take_along_axis(packed, best[..., None], axis=-1)[..., 0]
+    return np.stack([(mode >> 16) & 255, (mode >> 8) & 255, mode & 255], axis=-1).astype(np.uint8)
+
+REDUCERS = {
+    'median': _reduce_median,
+    'mean': _reduce_mean,
+    'trimmed_mean': _reduce_trimmed_mean,
+    'mode': _reduce_mode,
+}
+
+def _reduce_region(region, block_height, block_width, reduce):
+    # (rows*bh, cols*bw, 3) -> (rows, cols, 3, bh*bw) so one reducer call covers every block
+    rows, cols = region.shape[0] // block_height, region.shape[1] // block_width
+    pixels = region.reshape(rows, block_height, cols, block_width, 3).transpose(0, 2, 4, 1, 3)
+    return reduce(pixels.reshape(rows, cols, 3, block_height * block_width))
+
+def convert_to_blocks_and_dominate_color(img_array, block_size=BLOCK_SIZE, reducer='median', keep_partial=False):
+    reduce = REDUCERS[reducer] if isinstance(reducer, str) else reducer
+    height, width = img_array.shape[:2]
+    full_rows, full_cols = height // block_size, width // block_size
+
+    # Each span is (first block, last block + 1, block extent); partial edge blocks get their own span
+    row_spans = [(0, full_rows, block_size)]
+    col_spans = [(0, full_cols, block_size)]
+    if keep_partial and height % block_size:
+        row_spans.append((full_rows, full_rows + 1, height % block_size))
+    if keep_partial and width % block_size:
+        col_spans.append((full_cols, full_cols + 1, width % block_size))
+
+    img_blocks = np.zeros((row_spans[-1][1], col_spans[-1][1], 3), dtype=np.uint8)
+    for row_start, row_stop, block_height in row_spans:
+        for col_start, col_stop, block_width in col_spans:
+            if row_stop == row_start or col_stop == col_start:
+                continue
+            y, x = row_start * block_size, col_start * block_size
+            region = img_array[y:y + (row_stop - row_start) * block_height, x:x + (col_stop - col_start) * block_width]
+            img_blocks[row_start:row_stop, col_start:col_stop] = _reduce_region(region, block_height, block_width, reduce)
+    return img_blocks
+
+def _read_tile(source, left, top, right, bottom):
+    if isinstance(source, np.ndarray):
+        return source[top:bottom, left:right]
+    return np.asarray(source.crop((left, top, right, bottom)).convert('RGB'))
+
+def _tile_edges(source, box, size, halo, blur_kernel, canny_thresholds):
+    # Dilated edges for one tile core, computed over the core plus a halo so blur,
+    # Canny and dilate see the same neighbourhood as on the whole image
+    left, top, right, bottom = box
+    width, height = size
+    outer_left, outer_top = max(0, left - halo), max(0, top - halo)
+    window = _read_tile(source, outer_left, outer_top, min(width, right + halo), min(height, bottom + halo))
+    _, dilated_edges = detect_edges(window, blur_kernel, canny_thresholds)
+    core = (slice(top - outer_top, bottom - outer_top), slice(left - outer_left, right - outer_left))
+    return dilated_edges[core] != 0
+
+def _background_components(edges):
+    # The 4-connected background (non-edge) components of a tile: (count, labels)
+    import cv2
+    return cv2.connectedComponents((~edges).astype(np.uint8), connectivity=4)
+
+def convert_tiled(source, tile_size, block_size=BLOCK_SIZE, reducer='median', keep_partial=False,
+                  blur_kernel=BLUR_KERNEL, canny_thresholds=CANNY_THRESHOLDS, halo=TILE_HALO):
+    # Memory-bounded equivalent of apply_edge_detection_and_masking followed by
+    # convert_to_blocks_and_dominate_color. `source` is a PIL image (cropped lazily
+    # per tile, so no full-size RGB array is made) or an RGB array.
+    #
+    # Filling the external contours keeps exactly the pixels whose background
+    # component does not reach the image border, so the mask is rebuilt in two
+    # passes: the first finds each tile's edges, labels its background components
+    # and joins them across tile edges with a union-find; the second relabels each
+    # tile from its stored edges, drops the components that connect to the border
+    # and reduces the tile's blocks. Edge detection runs once per tile: its result
+    # is kept between the passes packed to one bit per pixel.
+    # Peak working memory is a few tiles, plus that bit per pixel and one label
+    # per background component. A PIL source is still decoded whole by PIL on the
+    # first crop (its decoders cannot read a region), so the image itself is held
+    # once in its own compact mode; only the arrays derived from it are bounded.
+    # Seams: Canny's hysteresis only follows weak edge chains within `halo` pixels
+    # of a tile, so an edge that is only reachable through a longer weak chain from
+    # another tile can be missing (or kept) near tile boundaries.
+    if isinstance(source, np.ndarray):
+        size = source.shape[1], source.shape[0]
+    else:
+        size = source.size
+    width, height = size
+    tile_size = max(block_size, tile_size // block_size * block_size)
+    rows = -(-height // block_size) if keep_partial else height // block_size
+    cols = -(-width // block_size) if keep_partial else width // block_size
+    boxes = [(left, top, min(left + tile_size, width), min(top + tile_size, height))
+             for top in range(0, height, tile_size) for left in range(0, width, tile_size)]
+
+    parent = []
+    touches_border = []
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def join(ids_a, ids_b):
+        both = (ids_a >= 0) & (ids_b >= 0)
+        for a, b in np.unique(np.stack([ids_a[both], ids_b[both]], axis=1), axis=0):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[root_b] = root_a
+
+    offsets = []
+    bottom_edges = {}
+    right_edge = None
+    packed_edges = []
+    for left, top, right, bottom in boxes:
+        edges = _tile_edges(source, (left, top, right, bottom), size, halo, blur_kernel, canny_thresholds)
+        packed_edges.append(np.packbits(edges, axis=None))
+        count, labels = _background_components(edges)
+        offset = len(parent)
+        offsets.append(offset)
+        parent.extend(range(offset, offset + count))
+        ids = np.where(labels > 0, labels.astype(np.int64) + offset, -1)
+        for on_border, strip in ((top == 0, ids[0]), (bottom == height, ids[-1]),
+                                 (left == 0, ids[:, 0]), (right == width, ids[:, -1])):
+            if on_border:
+                touches_border.extend(np.unique(strip[strip >= 0]).tolist())
+        if top > 0:
+            join(bottom_edges[left], ids[0])
+        if left > 0:
+            join(right_edge, ids[:, 0])
+        bottom_edges[left] = ids[-1]
+        right_edge = ids[:, -1]
+
+    roots = np.array(parent, dtype=np.int64)
+    while True:
+        compressed = roots[roots]
+        if np.array_equal(compressed, roots):
+            break
+        roots = compressed
+    outside = np.zeros(len(roots), dtype=bool)
+    outside[roots[np.array(touches_border, dtype=np.int64)]] = True
+    outside = outside[roots]
+
+    img_blocks = np.zeros((rows, cols, 3), dtype=np.uint8)
+    for (left, top, right, bottom), offset, packed in zip(boxes, offsets, packed_edges):
+        if top >= rows * block_size or left >= cols * block_size:
+            continue
+        shape = (bottom - top, right - left)
+        edges = np.unpackbits(packed, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+        _, labels = _background_components(edges)
+        core = _read_tile(source, left, top, right, bottom)
+        core_masked = core.copy()
+        core_masked[(labels > 0) & outside[labels + offset]] = 0
+        tile_blocks = convert_to_blocks_and_dominate_color(core_masked, block_size, reducer, keep_partial)
+        row, col = top // block_size, left // block_size
+        img_blocks[row:row + tile_blocks.shape[0], col:col + tile_blocks.shape[1]] = tile_blocks
     return img_blocks
 
-def save_color_data_to_txt(img_blocks, filename, is_litebrite=False, color_lookup=None):
+def convert_fast(img_array, block_size=BLOCK_SIZE, reducer='median', keep_partial=False,
+                 blur_kernel=BLUR_KERNEL, canny_thresholds=CANNY_THRESHOLDS, samples=FAST_MASK_SAMPLES, counters=None):
+    # Approximate masking + block reduction. The mask is derived from a working image
+    # downscaled to `samples` x `samples` pixels per block (blur_kernel applies at
+    # that scale). Blocks entirely outside the low-res mask become black without
+    # touching their pixels; blocks entirely inside are reduced from the source as
+    # is; only blocks straddling the mask edge get the low-res mask upsampled
+    # (nearest neighbour) over their pixels. Returns the blocks plus the low-res mask
+    # and edges. compare_fast_mask() measures how far this drifts from the full path.
+    import cv2
+    reduce = REDUCERS[reducer] if isinstance(reducer, str) else reducer
+    height, width = img_array.shape[:2]
+    total_rows, total_cols = -(-height // block_size), -(-width // block_size)
+    small = cv2.resize(img_array, (total_cols * samples, total_rows * samples), interpolation=cv2.INTER_AREA)
+    _, small_mask, small_edges = apply_edge_detection_and_masking(small, blur_kernel, canny_thresholds, counters)
+    small_height, small_width = small_mask.shape
+    row_map = np.minimum((np.arange(height) * 2 + 1) * small_height // (2 * height), small_height - 1)
+    col_map = np.minimum((np.arange(width) * 2 + 1) * small_width // (2 * width), small_width - 1)
+
+    rows = total_rows if keep_partial else height // block_size
+    cols = total_cols if keep_partial else width // block_size
+    cells = small_mask[:rows * samples, :cols * samples].reshape(rows, samples, cols, samples) != 0
+    inside, outside = cells.all(axis=(1, 3)), ~cells.any(axis=(1, 3))
+    img_blocks = np.zeros((rows, cols, 3), dtype=np.uint8)
+
+    full_rows, full_cols = height // block_size, width // block_size
+    ys, xs = np.nonzero(~outside[:full_rows, :full_cols])
+    if len(ys):
+        region = img_array[:full_rows * block_size, :full_cols * block_size]
+        pixels = region.reshape(full_rows, block_size, full_cols, block_size, 3)[ys, :, xs]
+        straddling = ~inside[ys, xs]
+        if straddling.any():
+            offsets = np.arange(block_size)
+            block_rows = row_map[ys[straddling, None] * block_size + offsets]
+            block_cols = col_map[xs[straddling, None] * block_size + offsets]
+            block_masks = small_mask[block_rows[:, :, None], block_cols[:, None, :]]
+            edge_pixels = pixels[straddling]
+            edge_pixels[block_masks == 0] = 0
+            pixels[straddling] = edge_pixels
+        pixels = pixels.transpose(0, 3, 1, 2).reshape(len(ys), 1, 3, block_size * block_size)
+        img_blocks[ys, xs] = reduce(pixels)[:, 0]
+
+    # Partial edge blocks (keep_partial only) are few; mask and reduce them one by one
+    for y, x in zip(*np.nonzero(~outside)):
+        if y < full_rows and x < full_cols:
+            continue
+        top, left = y * block_size, x * block_size
+        block = img_array[top:top + block_size, left:left + block_size].copy()
+        block[small_mask[row_map[top:top + block_size]][:, col_map[left:left + block_size]] == 0] = 0
+        img_blocks[y, x] = convert_to_blocks_and_dominate_color(block, block_size, reduce, True)[0, 0]
+    return img_blocks, small_mask, small_edges
+
+def save_color_data_to_txt(img_blocks, filename, is_litebrite=False, color_lookup=None, quantizer=None, characters=None):
+    # characters: precomputed palette keys per block, skips re-quantizing img_blocks
     with open(filename, 'w') as file:
         if is_litebrite:
             file.write('# Lite Brite Color Lookup:\n')
             for key, value in color_lookup.items():
                 file.write(f'{key}: {value}\n')
             file.write('\n# Grid:\n')
-            processed_grid = [[closest_color(color, color_lookup) for color in row] for row in img_blocks]
+            if characters is None:
+                quantizer = quantizer or get_quantizer(color_lookup)
+                characters = quantizer.characters(img_blocks)
+            processed_grid = characters
         else:
-            unique_colors = np.unique(img_blocks.reshape(-1, 3), axis=0)
-            color_key = {tuple(color): chr(65 + i) for i, color in enumerate(unique_colors)}
+            unique_colors, inverse = np.unique(img_blocks.reshape(-1, 3), axis=0, return_inverse=True)
+            letters = np.array([chr(65 + i) for i in range(len(unique_colors))])
             file.write('# Blocks Color Lookup:\n')
-            for key, value in color_key.items():
-                file.write(f'{value}: {key}\n')
+            for i, color in enumerate(unique_colors):
+                file.write(f'{letters[i]}: {tuple(color)}\n')
             file.write('\n# Grid:\n')
-            processed_grid = [[color_key[tuple(color)] for color in row] for row in img_blocks]
-        
+            processed_grid = letters[inverse.reshape(img_blocks.shape[:2])]
+
         for row in processed_grid:
             file.write(''.join(row) + '\n')
 
-def process_image(input_path, output_directory, color_lookup):
-    img = Image.open(input_path).convert('RGB')
-    img_array = np.array(img)
+class BuildCache:
+    # Incremental build cache. Each entry lives in its own directory, keyed by the
+    # input's content hash plus every parameter that shapes the mask and blocks (and
+    # the PNG compression level of the cached outputs), and
+    # holds the block array, copies of the palette-independent outputs and an
+    # entry.json manifest recording which palettes were rendered to which files.
+    # Entries are evicted least-recently-used (manifest mtime) once the cache
+    # exceeds max_bytes. Every entry is written separately, so pool workers can
+    # share one cache directory.
+    MANIFEST = 'entry.json'
+    GEOMETRY_OUTPUTS = ('masked', 'edges', 'blocks', 'blocks_txt')
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _digest(value):
+        return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def file_digest(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def geometry_key(self, input_path, params):
+        return self._digest({'version': CACHE_VERSION, 'input': self.file_digest(input_path), 'params': params})
+
+    def palette_key(self, color_lookup, metric, lut_bits, compress_level=PNG_COMPRESS_LEVEL):
+        return self._digest({'palette': [[key, list(value)] for key, value in color_lookup.items()], 'metric': metric,
+                             'lut_bits': lut_bits, 'compress_level': compress_level})
+
+    def _entry_path(self, key, name=MANIFEST):
+        return os.path.join(self.directory, key, name)
+
+    def lookup(self, key):
+        try:
+            with open(self._entry_path(key)) as file:
+                entry = json.load(file)
+            os.utime(self._entry_path(key))
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def load_blocks(self, key):
+        return np.load(self._entry_path(key, 'blocks.npy'))
+
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def is_rendered(self, entry, palette_key, paths):
+        rendered = entry['palettes'].get(palette_key)
+        if not rendered:
+            return False
+        try:
+            return all(self._stamp(path) == rendered.get(path) for path in paths)
+        except OSError:
+            return False
+
+    def restore_outputs(self, key, entry, paths):
+        # Put back palette-independent outputs that have gone missing from the output
+        # directory. False when the entry was built without one of them.
+        if not set(paths) <= set(entry.get('outputs', ())):
+            return False
+        for artifact, path in paths.items():
+            if not os.path.exists(path):
+                shutil.copyfile(self._entry_path(key, artifact), path)
+        return True
+
+    def store(self, key, img_blocks, paths):
+        entry_directory = os.path.join(self.directory, key)
+        os.makedirs(entry_directory, exist_ok=True)
+        np.save(os.path.join(entry_directory, 'blocks.npy'), img_blocks)
+        for artifact, path in paths.items():
+            shutil.copyfile(path, os.path.join(entry_directory, artifact))
+        size = sum(os.path.getsize(os.path.join(entry_directory, name)) for name in os.listdir(entry_directory))
+        entry = {'size': size, 'outputs': sorted(paths), 'palettes': {}}
+        self._write_entry(key, entry)
+        self.evict(keep=key)
+        return entry
+
+    def mark_rendered(self, key, entry, palette_key, paths):
+        entry['palettes'][palette_key] = {path: self._stamp(path) for path in paths}
+        try:
+            self._write_entry(key, entry)
+        except OSError:
+            pass  # evicted by another worker in the meantime; the next run rebuilds it
+
+    def _write_entry(self, key, entry):
+        temporary = self._entry_path(key, f'{self.MANIFEST}.{os.getpid()}.tmp')
+        with open(temporary, 'w') as file:
+            json.dump(entry, file)
+        os.replace(temporary, self._entry_path(key))
+
+    def evict(self, keep=None):
+        entries = []
+        for key in os.listdir(self.directory):
+            try:
+                with open(self._entry_path(key)) as file:
+                    size = json.load(file)['size']
+                entries.append((os.path.getmtime(self._entry_path(key)), size, key))
+            except (OSError, ValueError, KeyError):
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+                total -= size
+
+def _png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+def save_upscaled_png(path, img_blocks, block_size, compress_level=PNG_COMPRESS_LEVEL, palette=None):
+    # Nearest-neighbour block_size x upscale streamed straight into a PNG. Only one
+    # output row exists at a time; repeated rows use the PNG "Up" filter, which
+    # encodes them as zeros. With `palette` (an (n, 3) array, n <= 256), img_blocks
+    # holds indices into it and a palette-mode PNG is written.
+    height, width = img_blocks.shape[0] * block_size, img_blocks.shape[1] * block_size
+    if palette is None:
+        color_type, channels = 2, 3
+    else:
+        color_type, channels = 3, 1
+        img_blocks = img_blocks.astype(np.uint8)[..., None]
+    compressor = zlib.compressobj(compress_level)
+    repeat_line = b'\x02' + bytes(width * channels)
+    with open(path, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)))
+        if palette is not None:
+            file.write(_png_chunk(b'PLTE', np.asarray(palette, dtype=np.uint8).tobytes()))
+        pending = []
+        for row in img_blocks:
+            pending.append(compressor.compress(b'\x00' + np.repeat(row, block_size, axis=0).tobytes()))
+            for _ in range(block_size - 1):
+                pending.append(compressor.compress(repeat_line))
+            if sum(len(data) for data in pending) >= 1 << 20:
+                file.write(_png_chunk(b'IDAT', b''.join(pending)))
+                pending = []
+        pending.append(compressor.flush())
+        file.write(_png_chunk(b'IDAT', b''.join(pending)))
+        file.write(_png_chunk(b'IEND', b''))
 
-    img_masked, mask, edges = apply_edge_detection_and_masking(img_array)
-    img_blocks = convert_to_blocks_and_dominate_color(img_masked)
+def output_paths(output_directory, base_name):
+    return {
+        'masked': os.path.join(output_directory, f"{base_name}_masked.png"),
+        'edges': os.path.join(output_directory, f"{base_name}_edges.png"),
+        'blocks': os.path.join(output_directory, f"{base_name}_blocks.png"),
+        'blocks_txt': os.path.join(output_directory, f"{base_name}_blocks.txt"),
+        'litebrite': os.path.join(output_directory, f"{base_name}_litebrite.png"),
+        'litebrite_txt': os.path.join(output_directory, f"{base_name}_litebrite.txt"),
+        'litebrite_bin': os.path.join(output_directory, f"{base_name}_litebrite{litegrid.EXTENSION}"),
+    }
+
+def litebrite_writers(indices, paths, block_size, color_lookup, quantizer, outputs=PALETTE_OUTPUTS,
+                      compress_level=PNG_COMPRESS_LEVEL):
+    writers = []
+    if 'litebrite' in outputs:
+        writers.append(('litebrite', lambda: save_upscaled_png(paths['litebrite'], indices, block_size, compress_level,
+                                                               palette=quantizer.colors)))
+    if 'litebrite_txt' in outputs:
+        writers.append(('litebrite_txt', lambda: save_color_data_to_txt(None, paths['litebrite_txt'], is_litebrite=True,
+                                                                        color_lookup=color_lookup,
+                                                                        characters=quantizer.key_array[indices])))
+    if 'litebrite_bin' in outputs:
+        writers.append(('litebrite_bin', lambda: litegrid.write_grid(paths['litebrite_bin'], indices, color_lookup)))
+    return writers
+
+def save_litebrite_outputs(img_blocks, paths, block_size, color_lookup, quantizer, outputs=PALETTE_OUTPUTS,
+                           compress_level=PNG_COMPRESS_LEVEL):
+    indices = quantizer.indices(img_blocks)
+    for _, write in litebrite_writers(indices, paths, block_size, color_lookup, quantizer, outputs, compress_level):
+        write()
+
+def new_metrics(input_path):
+    # Per-image record: stages maps stage name -> {'ms', 'alloc_bytes'}, where
+    # alloc_bytes estimates the stage's allocations from the arrays it produced.
+    # Stages and counters only appear when the path taken produces them.
+    return {'image': input_path, 'status': None, 'stages': {}, 'counters': {}}
+
+def _record_stage(metrics, stage, started, *arrays):
+    metrics['stages'][stage] = {'ms': round((time.perf_counter() - started) * 1000, 3),
+                                'alloc_bytes': int(sum(array.nbytes for array in arrays))}
+
+class MetricsLog:
+    # JSON-lines sink for new_metrics() records, one line per image; close() appends
+    # a {"run": ...} line aggregating stage times and counters over the run.
+    def __init__(self, path):
+        self.file = sys.stdout if path == '-' else open(path, 'w')
+        self.images = 0
+        self.statuses = {}
+        self.stages = {}
+        self.counters = {}
+
+    def write(self, metrics):
+        self.file.write(json.dumps(metrics) + '\n')
+        self.images += 1
+        self.statuses[metrics['status']] = self.statuses.get(metrics['status'], 0) + 1
+        for stage, stats in metrics['stages'].items():
+            total = self.stages.setdefault(stage, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'alloc_bytes': 0})
+            total['count'] += 1
+            total['total_ms'] += stats['ms']
+            total['max_ms'] = max(total['max_ms'], stats['ms'])
+            total['alloc_bytes'] += stats['alloc_bytes']
+        for name, value in metrics['counters'].items():
+            total = self.counters.setdefault(name, {'count': 0, 'total': 0, 'min': value, 'max': value})
+            total['count'] += 1
+            total['total'] += value
+            total['min'] = min(total['min'], value)
+            total['max'] = max(total['max'], value)
+
+    def summary(self):
+        stages = {stage: dict(total, total_ms=round(total['total_ms'], 3), mean_ms=round(total['total_ms'] / total['count'], 3))
+                  for stage, total in self.stages.items()}
+        counters = {name: dict(total, total=round(total['total'], 6), mean=round(total['total'] / total['count'], 6))
+                    for name, total in self.counters.items()}
+        return {'images': self.images, 'statuses': self.statuses, 'stages': stages, 'counters': counters}
+
+    def close(self):
+        summary = self.summary()
+        self.file.write(json.dumps({'run': summary}) + '\n')
+        if self.file is sys.stdout:
+            self.file.flush()
+        else:
+            self.file.close()
+        return summary
+
+def plan_image(input_path, output_directory, color_lookup, block_size=BLOCK_SIZE, reducer='median', keep_partial=False,
+               metric='l1', lut_bits=None, blur_kernel=BLUR_KERNEL, canny_thresholds=CANNY_THRESHOLDS, cache=None,
+               tile_size=None, fast_mask=False, outputs=None, compress_level=PNG_COMPRESS_LEVEL, metrics=None,
+               fast_mask_samples=FAST_MASK_SAMPLES):
+    # Everything process_image decides before touching pixels, as a dict shared by
+    # the decode, compute and write stages (see process_image and run_pipeline).
+    # metrics: None, or a new_metrics() record the stages fill in as they run.
+    requested = outputs
+    outputs = DEFAULT_OUTPUTS if outputs is None else tuple(outputs)
+    unknown = set(outputs) - set(ARTIFACTS)
+    if unknown:
+        raise ValueError(f"Unknown outputs {sorted(unknown)}, expected a subset of {ARTIFACTS}")
+    if tile_size:
+        # The tiled path never has the full-resolution images: left out of the
+        # defaults, an error when asked for
+        skipped = [artifact for artifact in TILED_SKIPPED_OUTPUTS if artifact in outputs]
+        if skipped and requested is not None:
+            raise ValueError(f"The tiled path cannot write {', '.join(skipped)}")
+        outputs = tuple(artifact for artifact in outputs if artifact not in TILED_SKIPPED_OUTPUTS)
+    palette_outputs = tuple(artifact for artifact in PALETTE_OUTPUTS if artifact in outputs)
+    need_blocks = bool(palette_outputs) or 'blocks' in outputs or 'blocks_txt' in outputs
 
     base_name = os.path.splitext(os.path.basename(input_path))[0]
+    paths = output_paths(output_directory, base_name)
+    job = {
+        'input_path': input_path,
+        'color_lookup': color_lookup,
+        'block_size': block_size,
+        'reducer': reducer,
+        'keep_partial': keep_partial,
+        'blur_kernel': blur_kernel,
+        'canny_thresholds': canny_thresholds,
+        'tile_size': tile_size,
+        'fast_mask': fast_mask,
+        'fast_mask_samples': fast_mask_samples,
+        'compress_level': compress_level,
+        'outputs': outputs,
+        'palette_outputs': palette_outputs,
+        'need_blocks': need_blocks,
+        'need_mask': need_blocks or 'masked' in outputs,
+        'paths': paths,
+        'geometry_paths': {artifact: paths[artifact] for artifact in BuildCache.GEOMETRY_OUTPUTS if artifact in outputs},
+        'palette_paths': [paths[artifact] for artifact in palette_outputs],
+        'quantizer': get_quantizer(color_lookup, metric, lut_bits),
+        'cache': cache if need_blocks else None,
+        'metrics': metrics,
+    }
+    if job['cache'] is not None:
+        params = {'block_size': block_size, 'reducer': reducer, 'keep_partial': keep_partial,
+                  'blur_kernel': blur_kernel, 'canny_thresholds': list(canny_thresholds), 'tile_size': tile_size,
+                  'fast_mask': fast_mask, 'compress_level': compress_level}  # The cached outputs include PNGs
+        if fast_mask:
+            params['fast_mask_samples'] = fast_mask_samples
+        job['geometry_key'] = cache.geometry_key(input_path, params)
+        job['palette_key'] = cache.palette_key(color_lookup, metric, lut_bits, compress_level)
+    return job
+
+def restore_cached(job):
+    # Returns 'skipped' or 'requantized' when the cache covers this image, else None
+    cache = job['cache']
+    if cache is None:
+        return None
+    metrics = job['metrics']
+    started = time.perf_counter()
+    geometry_key = job['geometry_key']
+    entry = cache.lookup(geometry_key)
+    status = None
+    if entry is not None and cache.restore_outputs(geometry_key, entry, job['geometry_paths']):
+        if not job['palette_paths'] or cache.is_rendered(entry, job['palette_key'], job['palette_paths']):
+            status = 'skipped'
+        else:
+            # Only the palette changed: re-quantize the cached blocks
+            save_litebrite_outputs(cache.load_blocks(geometry_key), job['paths'], job['block_size'], job['color_lookup'],
+                                   job['quantizer'], job['palette_outputs'], job['compress_level'])
+            cache.mark_rendered(geometry_key, entry, job['palette_key'], job['palette_paths'])
+            status = 'requantized'
+    if metrics is not None:
+        _record_stage(metrics, 'cache', started)
+    return status
+
+def decode_image(job):
+    # The tiled path reads tiles itself, so it only gets the lazily opened image
+    from PIL import Image
+    metrics = job['metrics']
+    started = time.perf_counter()
+    if job['tile_size']:
+        source = Image.open(job['input_path'])
+        if metrics is not None:
+            _record_stage(metrics, 'decode', started)
+            metrics['counters'].update(width=source.width, height=source.height)
+        return source
+    with Image.open(job['input_path']) as img:
+        img_array = np.array(img.convert('RGB'))
+    if metrics is not None:
+        _record_stage(metrics, 'decode', started, img_array)
+        metrics['counters'].update(width=img_array.shape[1], height=img_array.shape[0])
+    return img_array
+
+def compute_image(job, source):
+    # Mask, blocks and quantize; returns the arrays the writers need
+    block_options = {key: job[key] for key in ('block_size', 'reducer', 'keep_partial')}
+    edge_options = {key: job[key] for key in ('blur_kernel', 'canny_thresholds')}
+    outputs = job['outputs']
+    metrics = job['metrics']
+    counters = None if metrics is None else metrics['counters']
+    artifacts = {}
+    started = time.perf_counter()
+    if job['tile_size']:
+        with source:
+            artifacts['img_blocks'] = convert_tiled(source, job['tile_size'], **block_options, **edge_options)
+        if metrics is not None:
+            _record_stage(metrics, 'tiled', started, artifacts['img_blocks'])
+    elif job['fast_mask']:
+        import cv2
+        img_blocks, small_mask, small_edges = convert_fast(source, **block_options, **edge_options,
+                                                           samples=job['fast_mask_samples'], counters=counters)
+        artifacts['img_blocks'] = img_blocks
+        if metrics is not None:
+            _record_stage(metrics, 'fast_mask', started, img_blocks, small_mask, small_edges)
+        started = time.perf_counter()
+        full_size = (source.shape[1], source.shape[0])
+        if 'masked' in outputs:
+            source[cv2.resize(small_mask, full_size, interpolation=cv2.INTER_NEAREST) == 0] = 0
+            artifacts['img_masked'] = source
+        if 'edges' in outputs:
+            artifacts['edges'] = cv2.resize(small_edges, full_size, interpolation=cv2.INTER_NEAREST)
+        if metrics is not None and ('masked' in outputs or 'edges' in outputs):
+            _record_stage(metrics, 'upsample', started, *([artifacts['edges']] if 'edges' in artifacts else []))
+    else:
+        if job['need_mask']:
+            img_masked, mask, artifacts['edges'] = apply_edge_detection_and_masking(source, **edge_options, counters=counters)
+            artifacts['img_masked'] = img_masked
+            if metrics is not None:
+                _record_stage(metrics, 'mask', started, img_masked, mask, artifacts['edges'])
+        else:
+            artifacts['edges'], dilated_edges = detect_edges(source, **edge_options)
+            if metrics is not None:
+                _record_stage(metrics, 'edges', started, artifacts['edges'], dilated_edges)
+        if job['need_blocks']:
+            started = time.perf_counter()
+            artifacts['img_blocks'] = convert_to_blocks_and_dominate_color(artifacts['img_masked'], **block_options)
+            if metrics is not None:
+                _record_stage(metrics, 'blocks', started, artifacts['img_blocks'])
+    if job['palette_outputs']:
+        started = time.perf_counter()
+        artifacts['indices'] = job['quantizer'].indices(artifacts['img_blocks'])
+        if metrics is not None:
+            _record_stage(metrics, 'quantize', started, artifacts['indices'])
+    if metrics is not None and 'img_blocks' in artifacts:
+        img_blocks = artifacts['img_blocks']
+        packed = img_blocks.reshape(-1, 3).astype(np.uint32) @ np.array([65536, 256, 1], dtype=np.uint32)
+        counters.update(grid_rows=img_blocks.shape[0], grid_cols=img_blocks.shape[1],
+                        unique_block_colors=len(np.unique(packed)))
+        if 'indices' in artifacts:
+            counters['palette_colors_used'] = len(np.unique(artifacts['indices']))
+    return artifacts
+
+def image_writers(job, artifacts):
+    # One (artifact, callable) per requested output; the callables are independent
+    # of each other, so they can run in any order or concurrently.
+    from PIL import Image
+    outputs, paths, compress_level = job['outputs'], job['paths'], job['compress_level']
+    writers = []
+    if 'masked' in outputs:
+        writers.append(('masked', lambda: Image.fromarray(artifacts['img_masked']).save(paths['masked'], compress_level=compress_level)))
+    if 'edges' in outputs:
+        writers.append(('edges', lambda: Image.fromarray(artifacts['edges']).save(paths['edges'], compress_level=compress_level)))
+    if 'blocks' in outputs:
+        writers.append(('blocks', lambda: save_upscaled_png(paths['blocks'], artifacts['img_blocks'], job['block_size'], compress_level)))
+    if 'blocks_txt' in outputs:
+        writers.append(('blocks_txt', lambda: save_color_data_to_txt(artifacts['img_blocks'], paths['blocks_txt'])))
+    if job['palette_outputs']:
+        writers.extend(litebrite_writers(artifacts['indices'], paths, job['block_size'], job['color_lookup'],
+                                         job['quantizer'], job['palette_outputs'], compress_level))
+    if job['metrics'] is not None:
+        writers = [(artifact, _timed_writer(job['metrics'], artifact, paths[artifact], write)) for artifact, write in writers]
+    return writers
+
+def _timed_writer(metrics, artifact, path, write):
+    def timed():
+        started = time.perf_counter()
+        write()
+        # The encoded size stands in for the encoder's allocations
+        _record_stage(metrics, f'write_{artifact}', started)
+        metrics['stages'][f'write_{artifact}']['alloc_bytes'] = os.path.getsize(path)
+    return timed
+
+def finish_image(job, artifacts):
+    # Record a converted image in the cache once all of its outputs are on disk
+    cache = job['cache']
+    if cache is not None:
+        started = time.perf_counter()
+        entry = cache.store(job['geometry_key'], artifacts['img_blocks'], job['geometry_paths'])
+        cache.mark_rendered(job['geometry_key'], entry, job['palette_key'], job['palette_paths'])
+        if job['metrics'] is not None:
+            _record_stage(job['metrics'], 'cache_store', started)
+
+def process_image(input_path, output_directory, color_lookup, block_size=BLOCK_SIZE, reducer='median', keep_partial=False,
+                  metric='l1', lut_bits=None, blur_kernel=BLUR_KERNEL, canny_thresholds=CANNY_THRESHOLDS, cache=None,
+                  tile_size=None, fast_mask=False, outputs=None, compress_level=PNG_COMPRESS_LEVEL, metrics=None,
+                  fast_mask_samples=FAST_MASK_SAMPLES):
+    # outputs: subset of ARTIFACTS to write (default DEFAULT_OUTPUTS); stages that only feed
+    # unrequested artifacts are skipped. tile_size switches to the memory-bounded
+    # tiled path (see convert_tiled), which cannot write the full-resolution masked
+    # and edges images: they are left out of the default outputs and are an error
+    # when asked for. fast_mask derives the mask at reduced resolution (see
+    # convert_fast) from fast_mask_samples x fast_mask_samples pixels per block, fewer
+    # being faster and less exact; its masked and edges images are upsampled from
+    # that mask.
+    # metrics: optional new_metrics() record to fill with stage timings and counters.
+    job = plan_image(input_path, output_directory, color_lookup, block_size, reducer, keep_partial, metric, lut_bits,
+                     blur_kernel, canny_thresholds, cache, tile_size, fast_mask, outputs, compress_level, metrics,
+                     fast_mask_samples)
+    status = restore_cached(job)
+    if not status:
+        artifacts = compute_image(job, decode_image(job))
+        for _, write in image_writers(job, artifacts):
+            write()
+        finish_image(job, artifacts)
+        status = 'converted'
+    if metrics is not None:
+        metrics['status'] = status
+    return status
+
+def resolve_options(options=None):
+    resolved = dict(DEFAULT_OPTIONS)
+    if options:
+        unknown = set(options) - set(DEFAULT_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown options {sorted(unknown)}, expected keys of {sorted(DEFAULT_OPTIONS)}")
+        resolved.update(options)
+    if resolved['tile_size'] and resolved['fast_mask']:
+        raise ValueError("tile_size and fast_mask cannot be combined")
+    if resolved['fast_mask_samples'] < 1:
+        raise ValueError("fast_mask_samples must be at least 1")
+    if resolved['reducer'] not in REDUCERS and not callable(resolved['reducer']):
+        raise ValueError(f"Unknown reducer {resolved['reducer']!r}, expected one of {sorted(REDUCERS)}")
+    return resolved
+
+def convert(image_or_array, palette=None, options=None):
+    # Library entry point: runs the pipeline in memory and writes nothing.
+    # image_or_array is a path, a PIL image or an (h, w, 3) uint8 RGB array; palette
+    # defaults to color_lookup and options overrides DEFAULT_OPTIONS. The result
+    # dict holds the block colours, palette indices, quantized colours and keys, and
+    # (except on the tiled and fast_mask paths) the full-resolution masked, mask and
+    # edges arrays.
+    palette = color_lookup if palette is None else palette
+    options = resolve_options(options)
+    quantizer = get_quantizer(palette, options['metric'], options['lut_bits'])
+    block_options = {key: options[key] for key in ('block_size', 'reducer', 'keep_partial')}
+    edge_options = {key: options[key] for key in ('blur_kernel', 'canny_thresholds')}
+    result = {'masked': None, 'mask': None, 'edges': None}
+
+    opened = None
+    if isinstance(image_or_array, np.ndarray):
+        if image_or_array.ndim != 3 or image_or_array.shape[2] != 3:
+            raise ValueError(f"Expected an (h, w, 3) RGB array, got shape {image_or_array.shape}")
+        source = image_or_array.astype(np.uint8, copy=False)
+    elif isinstance(image_or_array, (str, os.PathLike)):
+        from PIL import Image
+        source = opened = Image.open(image_or_array)
+    else:
+        source = image_or_array
+
+    try:
+        if options['tile_size']:
+            img_blocks = convert_tiled(source, options['tile_size'], **block_options, **edge_options)
+        elif options['fast_mask']:
+            img_array = source if isinstance(source, np.ndarray) else np.array(source.convert('RGB'))
+            img_blocks, _, _ = convert_fast(img_array, **block_options, **edge_options, samples=options['fast_mask_samples'])
+        else:
+            img_array = source if isinstance(source, np.ndarray) else np.array(source.convert('RGB'))
+            result['masked'], result['mask'], result['edges'] = apply_edge_detection_and_masking(img_array, **edge_options)
+            img_blocks = convert_to_blocks_and_dominate_color(result['masked'], **block_options)
+    finally:
+        if opened is not None:
+            opened.close()
+
+    indices = quantizer.indices(img_blocks)
+    result.update({
+        'blocks': img_blocks,
+        'indices': indices,
+        'litebrite': quantizer.colors[indices],
+        'characters': quantizer.key_array[indices],
+        'palette': dict(palette),
+    })
+    return result
+
+def compare_fast_mask(image_or_array, palette=None, options=None):
+    # Quality check for fast_mask: runs the full-resolution and fast paths on the
+    # same image and reports how many blocks and litebrite cells differ.
+    options = dict(options or {}, tile_size=None)
+    if not isinstance(image_or_array, np.ndarray):
+        from PIL import Image
+        with Image.open(image_or_array) as img:
+            image_or_array = np.array(img.convert('RGB'))
+    start = time.perf_counter()
+    full = convert(image_or_array, palette, dict(options, fast_mask=False))
+    full_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    fast = convert(image_or_array, palette, dict(options, fast_mask=True))
+    fast_seconds = time.perf_counter() - start
+    blocks = full['indices'].size
+    return {
+        'blocks': blocks,
+        'blocks_differ': int((full['blocks'] != fast['blocks']).any(axis=-1).sum()),
+        'cells_differ': int((full['indices'] != fast['indices']).sum()),
+        'full_seconds': full_seconds,
+        'fast_seconds': fast_seconds,
+        'speedup': full_seconds / fast_seconds if fast_seconds > 0 else float('inf'),
+    }
+
+def load_palette(path):
+    # JSON object mapping single-character keys to [r, g, b]
+    with open(path) as file:
+        return {key: tuple(int(channel) for channel in value) for key, value in json.load(file).items()}
+
+def read_any_grid(path):
+    if path.endswith(litegrid.EXTENSION):
+        grid = litegrid.GridFile(path)
+        return grid.indices(), grid.color_lookup
+    return litegrid.read_litebrite_txt(path)
+
+def write_any_grid(path, indices, palette):
+    if path.endswith(litegrid.EXTENSION):
+        litegrid.write_grid(path, indices, palette)
+        return
+    if indices.ndim == 3:
+        if len(indices) != 1:
+            raise ValueError(f"{path}: the text format holds a single grid, got {len(indices)} frames")
+        indices = indices[0]
+    litegrid.write_litebrite_txt(path, indices, palette)
 
-    # Save all images and generate text output
-    Image.fromarray(img_masked).save(os.path.join(output_directory, f"{base_name}_masked.png"))    
-    Image.fromarray(edges).save(os.path.join(output_directory, f"{base_name}_edges.png"))
+def requantize_grid(source, destination, palette, metric='l1'):
+    # Map an existing grid (.txt or .lbg) onto another palette without the source image
+    indices, source_palette = read_any_grid(source)
+    colors = np.array(list(source_palette.values()), dtype=np.uint8)[indices]
+    write_any_grid(destination, get_quantizer(palette, metric).indices(colors), palette)
 
-    blocks_img = Image.fromarray(np.repeat(np.repeat(img_blocks, 32, axis=0), 32, axis=1))
-    blocks_img.save(os.path.join(output_directory, f"{base_name}_blocks.png"))
-    save_color_data_to_txt(img_blocks, os.path.join(output_directory, f"{base_name}_blocks.txt"))
+IMAGE_EXTENSIONS = ('.webp', '.jpg', '.jpeg', '.png')
 
-    lite_brite_blocks = np.array([[color_lookup[closest_color(block, color_lookup)] for block in row] for row in img_blocks], dtype=np.uint8)
-    lite_brite_img = Image.fromarray(np.repeat(np.repeat(lite_brite_blocks, 32, axis=0), 32, axis=1))
-    lite_brite_img.save(os.path.join(output_directory, f"{base_name}_litebrite.png"))
-    save_color_data_to_txt(lite_brite_blocks, os.path.join(output_directory, f"{base_name}_litebrite.txt"), is_litebrite=True, color_lookup=color_lookup)
+def list_input_images(input_directory):
+    return [os.path.join(input_directory, filename) for filename in sorted(os.listdir(input_directory))
+            if filename.lower().endswith(IMAGE_EXTENSIONS)]
+
+def _init_worker():
+    # Each worker owns one core; stop OpenCV from spawning its own thread pool on top
+    import cv2
+    cv2.setNumThreads(1)
+
+def _process_image_task(input_path, output_directory, color_lookup, options, collect_metrics=False):
+    metrics = new_metrics(input_path) if collect_metrics else None
+    return process_image(input_path, output_directory, color_lookup, metrics=metrics, **options), metrics
+
+def _failed_metrics(input_path, error):
+    metrics = new_metrics(input_path)
+    metrics.update(status='failed', error=f"{type(error).__name__}: {error}")
+    return metrics
+
+def _summarize(statuses, failures, elapsed):
+    completed = sum(statuses.values())
+    rate = completed / elapsed if elapsed > 0 else 0.0
+    breakdown = ', '.join(f"{count} {status}" for status, count in sorted(statuses.items()))
+    print(f"Processed {completed} image(s) ({breakdown or 'none'}), {len(failures)} failed, "
+          f"in {elapsed:.2f}s ({rate:.2f} images/sec)", file=sys.stderr)
+    return {'completed': completed, 'statuses': statuses, 'failures': failures, 'elapsed': elapsed, 'images_per_sec': rate}
+
+def run_batch(input_paths, output_directory, color_lookup, workers=None, max_in_flight=None, metrics_path=None,
+              **options):
+    # Spread files over a process pool. At most max_in_flight files are submitted at
+    # once so decoded images never pile up in the pool's queue; a failing file is
+    # reported and the rest of the batch carries on. metrics_path ('-' for stdout)
+    # receives one JSON line per image plus the run aggregate (see MetricsLog); the
+    # summary goes to stderr so stdout stays valid JSON lines.
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    failures = []
+    statuses = {}
+    metrics_log = MetricsLog(metrics_path) if metrics_path else None
+    task_args = (output_directory, color_lookup, options, metrics_log is not None)
+    start = time.perf_counter()
+
+    def report(input_path, error):
+        failures.append((input_path, error))
+        print(f"Failed {input_path}: {type(error).__name__}: {error}", file=sys.stderr)
+        if metrics_log is not None:
+            metrics_log.write(_failed_metrics(input_path, error))
+
+    def record(status, metrics):
+        statuses[status] = statuses.get(status, 0) + 1
+        if metrics_log is not None:
+            metrics_log.write(metrics)
+
+    if workers == 1:
+        for input_path in input_paths:
+            try:
+                record(*_process_image_task(input_path, *task_args))
+            except Exception as error:
+                report(input_path, error)
+    else:
+        paths = iter(input_paths)
+        in_flight = {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            while True:
+                while len(in_flight) < max_in_flight:
+                    input_path = next(paths, None)
+                    if input_path is None:
+                        break
+                    future = pool.submit(_process_image_task, input_path, *task_args)
+                    in_flight[future] = input_path
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    input_path = in_flight.pop(future)
+                    try:
+                        record(*future.result())
+                    except Exception as error:
+                        report(input_path, error)
+
+    result = _summarize(statuses, failures, time.perf_counter() - start)
+    if metrics_log is not None:
+        result['metrics'] = metrics_log.close()
+    return result
+
+def run_pipeline(input_paths, output_directory, color_lookup, writers=None, prefetch=2, metrics_path=None, **options):
+    # Single-process alternative to run_batch that overlaps the stages of consecutive
+    # images: a reader thread plans, checks the cache and decodes up to `prefetch`
+    # images ahead, this thread computes, and a pool of `writers` threads encodes and
+    # saves the outputs. The stage functions are the ones process_image runs, so the
+    # files are byte-identical. Decoding, OpenCV and zlib release the GIL, which is
+    # what lets the stages overlap. busy reports the fraction of the wall time each
+    # stage spent working (the writers' share is averaged over the pool). metrics_path
+    # works as in run_batch.
+    import queue
+    import threading
+    from concurrent.futures import ThreadPoolExecutor, wait
+    writers = writers or min(4, os.cpu_count() or 1)
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    failures = []
+    statuses = {}
+    busy = {'read': 0.0, 'compute': 0.0, 'write': 0.0}
+    lock = threading.Lock()
+    decoded = queue.Queue(maxsize=max(1, prefetch))
+    done_reading = object()
+    metrics_log = MetricsLog(metrics_path) if metrics_path else None
+
+    def report(input_path, error):
+        failures.append((input_path, error))
+        print(f"Failed {input_path}: {type(error).__name__}: {error}", file=sys.stderr)
+        if metrics_log is not None:
+            metrics_log.write(_failed_metrics(input_path, error))
+
+    def record(job, status):
+        statuses[status] = statuses.get(status, 0) + 1
+        if metrics_log is not None:
+            job['metrics']['status'] = status
+            metrics_log.write(job['metrics'])
+
+    def read():
+        for input_path in input_paths:
+            started = time.perf_counter()
+            try:
+                metrics = new_metrics(input_path) if metrics_log is not None else None
+                job = plan_image(input_path, output_directory, color_lookup, metrics=metrics, **options)
+                status = restore_cached(job)
+                item = (input_path, job, status, None if status else decode_image(job))
+            except Exception as error:
+                item = (input_path, error, None, None)
+            busy['read'] += time.perf_counter() - started
+            decoded.put(item)
+        decoded.put(done_reading)
+
+    def timed(write):
+        started = time.perf_counter()
+        try:
+            write()
+        finally:
+            with lock:
+                busy['write'] += time.perf_counter() - started
+
+    def finish(input_path, job, artifacts, futures):
+        # Waits for one image's writes, then records it
+        wait(futures)
+        try:
+            for future in futures:
+                future.result()
+            finish_image(job, artifacts)
+            record(job, 'converted')
+        except Exception as error:
+            report(input_path, error)
+
+    start = time.perf_counter()
+    reader = threading.Thread(target=read, name='convert19-reader', daemon=True)
+    reader.start()
+    pending = []
+    with ThreadPoolExecutor(max_workers=writers, thread_name_prefix='convert19-writer') as pool:
+        while True:
+            item = decoded.get()
+            if item is done_reading:
+                break
+            input_path, job, status, source = item
+            if isinstance(job, Exception):
+                report(input_path, job)
+                continue
+            if status:
+                record(job, status)
+                continue
+            started = time.perf_counter()
+            try:
+                artifacts = compute_image(job, source)
+            except Exception as error:
+                report(input_path, error)
+                continue
+            finally:
+                busy['compute'] += time.perf_counter() - started
+            pending.append((input_path, job, artifacts,
+                            [pool.submit(timed, write) for _, write in image_writers(job, artifacts)]))
+            # Bound the images held in memory while their outputs are still being written
+            while len(pending) > writers:
+                finish(*pending.pop(0))
+        for entry in pending:
+            finish(*entry)
+    reader.join()
+
+    result = _summarize(statuses, failures, time.perf_counter() - start)
+    if metrics_log is not None:
+        result['metrics'] = metrics_log.close()
+    elapsed = result['elapsed']
+    result['busy'] = {
+        'read': busy['read'] / elapsed if elapsed > 0 else 0.0,
+        'compute': busy['compute'] / elapsed if elapsed > 0 else 0.0,
+        'write': busy['write'] / (elapsed * writers) if elapsed > 0 else 0.0,
+    }
+    print('Stage busy: ' + ', '.join(f"{stage} {share:.0%}" for stage, share in result['busy'].items()), file=sys.stderr)
+    return result
 
 input_directory = 'input'
 output_directory = 'output/convert'
+cache_directory = 'output/.convert19-cache'
 color_lookup = {
     'W': (255, 255, 255),  # White
     'B': (1, 1, 230),      # Blue
@@ -85,9 +1192,117 @@ color_lookup = {
     'K': (0, 0, 0)         # Black
 }
 
-if not os.path.exists(output_directory):
-    os.makedirs(output_directory)
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    commands = ('convert', 'requantize', 'txt2bin', 'bin2txt', 'pack', 'check-fast')
+    if not argv or (argv[0] not in commands and argv[0] not in ('-h', '--help')):
+        argv = ['convert'] + argv  # bare `python convert19.py [options]` keeps converting input/
+
+    parser = argparse.ArgumentParser(description='Convert images into Lite-Brite grids.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert_parser = subparsers.add_parser('convert', help='convert images (the default command)')
+    convert_parser.add_argument('paths', nargs='*', help=f'image files or directories (default: {input_directory})')
+    convert_parser.add_argument('--input', default=input_directory, help='directory of source images')
+    convert_parser.add_argument('--output', default=output_directory, help='directory for converted outputs')
+    convert_parser.add_argument('--palette', default=None, help='JSON palette file (default: built-in color_lookup)')
+    convert_parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    convert_parser.add_argument('--max-in-flight', type=int, default=None, help='files submitted at once (default: 2x workers)')
+    convert_parser.add_argument('--pipeline', action='store_true', help='one process with overlapped decode/compute/write threads')
+    convert_parser.add_argument('--writers', type=int, default=None, help='writer threads for --pipeline (default: up to 4)')
+    convert_parser.add_argument('--metrics', default=None, help="write per-image stage timings and counters as JSON lines ('-': stdout)")
+    convert_parser.add_argument('--cache-dir', default=cache_directory, help='incremental build cache directory')
+    convert_parser.add_argument('--cache-size-mb', type=int, default=CACHE_MAX_BYTES // (1024 * 1024), help='cache size before eviction')
+    convert_parser.add_argument('--no-cache', action='store_true', help='always reprocess every file')
+    convert_parser.add_argument('--tile-size', type=int, default=None, help='process in tiles of this many pixels to bound working memory '
+                                '(the decoded image is still held once; masked and edges are not written)')
+    convert_parser.add_argument('--outputs', default=None, help=f"comma-separated subset of {', '.join(ARTIFACTS)} "
+                                f"(default: {','.join(DEFAULT_OUTPUTS)}, less masked and edges with --tile-size)")
+    convert_parser.add_argument('--compress-level', type=int, default=PNG_COMPRESS_LEVEL, help='PNG zlib level, 0-9')
+    convert_parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help='source pixels per peg')
+    convert_parser.add_argument('--reducer', choices=sorted(REDUCERS), default='median', help='block colour reducer')
+    convert_parser.add_argument('--keep-partial', action='store_true', help='keep the partial blocks at the right and bottom edges')
+    convert_parser.add_argument('--metric', choices=PaletteQuantizer.METRICS, default='l1', help='palette distance')
+    convert_parser.add_argument('--lut-bits', type=int, default=None, help='quantize through a 2**bits per channel lookup cube')
+    convert_parser.add_argument('--fast-mask', action='store_true', help='derive the mask from a downscaled image (approximate)')
+    convert_parser.add_argument('--fast-mask-samples', type=int, default=FAST_MASK_SAMPLES,
+                                help='pixels per block side the --fast-mask image keeps (fewer: faster, less exact)')
+
+    requantize_parser = subparsers.add_parser('requantize', help='map an existing .txt/.lbg grid onto a palette')
+    requantize_parser.add_argument('source')
+    requantize_parser.add_argument('destination')
+    requantize_parser.add_argument('--palette', default=None, help='JSON palette file (default: built-in color_lookup)')
+    requantize_parser.add_argument('--metric', choices=PaletteQuantizer.METRICS, default='l1', help='palette distance')
+
+    for command, help_text in (('txt2bin', 'convert a litebrite .txt grid to .lbg'), ('bin2txt', 'convert a .lbg grid to .txt')):
+        grid_parser = subparsers.add_parser(command, help=help_text)
+        grid_parser.add_argument('source')
+        grid_parser.add_argument('destination')
+
+    pack_parser = subparsers.add_parser('pack', help='pack a directory of converted grids into one .lbg for litebrite_player.py')
+    pack_parser.add_argument('source', help='directory of converted grids (default output of convert)')
+    pack_parser.add_argument('destination')
+    pack_parser.add_argument('--width', type=int, default=32, help='matrix width in pegs')
+    pack_parser.add_argument('--height', type=int, default=32, help='matrix height in pegs')
+    pack_parser.add_argument('--hold', type=int, default=2000, help='ms each still grid is shown')
+    pack_parser.add_argument('--keyframe-interval', type=int, default=0, help='full frame every this many frames (0: first only)')
+
+    check_parser = subparsers.add_parser('check-fast', help='report how far --fast-mask drifts from the full path')
+    check_parser.add_argument('paths', nargs='+', help='image files')
+    check_parser.add_argument('--palette', default=None, help='JSON palette file (default: built-in color_lookup)')
+    check_parser.add_argument('--fast-mask-samples', type=int, default=FAST_MASK_SAMPLES,
+                              help='pixels per block side of the fast path\'s image')
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'fast_mask_samples', 1) < 1:
+        parser.error("--fast-mask-samples must be at least 1")
+    palette = load_palette(args.palette) if getattr(args, 'palette', None) else color_lookup
+
+    if args.command == 'txt2bin':
+        litegrid.txt_to_grid(args.source, args.destination)
+        return 0
+    if args.command == 'bin2txt':
+        litegrid.grid_to_txt(args.source, args.destination)
+        return 0
+    if args.command == 'pack':
+        frames = litegrid.pack_directory(args.source, args.destination, args.width, args.height, args.hold,
+                                         args.keyframe_interval)
+        print(f"Packed {frames} frames from {args.source} into {args.destination}")
+        return 0
+    if args.command == 'requantize':
+        requantize_grid(args.source, args.destination, palette, args.metric)
+        return 0
+    if args.command == 'check-fast':
+        for path in args.paths:
+            report = compare_fast_mask(path, palette, {'fast_mask_samples': args.fast_mask_samples})
+            print(f"{path}: {report['blocks_differ']}/{report['blocks']} blocks and {report['cells_differ']} litebrite cells "
+                  f"differ, {report['full_seconds']:.3f}s -> {report['fast_seconds']:.3f}s ({report['speedup']:.1f}x)")
+        return 0
+
+    input_paths = []
+    for path in args.paths or [args.input]:
+        input_paths.extend(list_input_images(path) if os.path.isdir(path) else [path])
+    options = {
+        'block_size': args.block_size,
+        'reducer': args.reducer,
+        'keep_partial': args.keep_partial,
+        'metric': args.metric,
+        'lut_bits': args.lut_bits,
+        'tile_size': args.tile_size,
+        'fast_mask': args.fast_mask,
+        'fast_mask_samples': args.fast_mask_samples,
+    }
+    cache = None if args.no_cache else BuildCache(args.cache_dir, args.cache_size_mb * 1024 * 1024)
+    outputs = args.outputs.split(',') if args.outputs else None
+    if args.tile_size and outputs and set(outputs) & set(TILED_SKIPPED_OUTPUTS):
+        parser.error(f"--tile-size cannot write {' or '.join(TILED_SKIPPED_OUTPUTS)}")
+    options.update(cache=cache, outputs=outputs, compress_level=args.compress_level,
+                   metrics_path=args.metrics)
+    if args.pipeline:
+        result = run_pipeline(input_paths, args.output, palette, args.writers, **options)
+    else:
+        result = run_batch(input_paths, args.output, palette, args.workers, args.max_in_flight, **options)
+    return 1 if result['failures'] else 0
 
-for filename in os.listdir(input_directory):
-    if filename.lower().endswith(('.webp', '.jpg', '.jpeg', '.png')):
-        process_image(os.path.join(input_directory, filename), output_directory, color_lookup)
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main())
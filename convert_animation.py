@@ -0,0 +1,161 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+import convert19
+import litegrid
+
+# Animated WebP/GIF and short video clips -> delta-encoded sequence of Lite-Brite
+# grids (.lbg with litegrid.FLAG_DELTA). Frames are decoded and converted one at a
+# time, so memory does not grow with clip length.
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.m4v', '.webm')
+DEFAULT_FRAME_MS = 100
+
+def iter_frames(path, max_frames=None):
+    # Yields (RGB array, duration in ms) per decoded frame
+    if path.lower().endswith(VIDEO_EXTENSIONS):
+        import cv2
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise ValueError(f"Cannot open video {path}")
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        duration_ms = 1000 / fps if fps > 0 else DEFAULT_FRAME_MS
+        try:
+            count = 0
+            while max_frames is None or count < max_frames:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), duration_ms
+                count += 1
+        finally:
+            capture.release()
+    else:
+        from PIL import Image, ImageSequence
+        with Image.open(path) as img:
+            for count, frame in enumerate(ImageSequence.Iterator(img)):
+                if max_frames is not None and count >= max_frames:
+                    break
+                yield np.array(frame.convert('RGB')), frame.info.get('duration') or DEFAULT_FRAME_MS
+
+class IncrementalBlockConverter:
+    # Converts a stream of frames, re-reducing and re-quantizing only the blocks whose
+    # masked pixels changed since the previous frame. The mask itself is recomputed
+    # every frame (edges anywhere can change which pixels survive), unless the frame
+    # is byte-identical to the previous one.
+    def __init__(self, palette=None, options=None):
+        self.options = convert19.resolve_options(options)
+        if self.options['tile_size']:
+            raise ValueError("Frame streams do not support the tiled path")
+        if self.options['fast_mask']:
+            raise ValueError("Frame streams do not support fast_mask")
+        palette = convert19.color_lookup if palette is None else palette
+        self.quantizer = convert19.get_quantizer(palette, self.options['metric'], self.options['lut_bits'])
+        reducer = self.options['reducer']
+        self.reduce = convert19.REDUCERS[reducer] if isinstance(reducer, str) else reducer
+        self.previous_frame = None
+        self.previous_masked = None
+        self.blocks = None
+        self.indices = None
+        self.blocks_recomputed = 0
+        self.blocks_seen = 0
+
+    def push(self, frame):
+        # Returns (palette indices, bool mask of blocks recomputed for this frame)
+        if self.previous_frame is not None and np.array_equal(frame, self.previous_frame):
+            changed = np.zeros(self.indices.shape, dtype=bool)
+        else:
+            options = self.options
+            masked, _, _ = convert19.apply_edge_detection_and_masking(frame, options['blur_kernel'], options['canny_thresholds'])
+            if self.previous_masked is None or masked.shape != self.previous_masked.shape:
+                self.blocks = convert19.convert_to_blocks_and_dominate_color(
+                    masked, options['block_size'], self.reduce, options['keep_partial'])
+                self.indices = self.quantizer.indices(self.blocks)
+                changed = np.ones(self.indices.shape, dtype=bool)
+            else:
+                changed = self._changed_blocks(masked)
+                self._update_blocks(masked, changed)
+            self.previous_frame = frame
+            self.previous_masked = masked
+        self.blocks_recomputed += int(changed.sum())
+        self.blocks_seen += changed.size
+        return self.indices, changed
+
+    def _changed_blocks(self, masked):
+        block_size = self.options['block_size']
+        rows, cols = self.blocks.shape[:2]
+        difference = (masked != self.previous_masked).any(axis=2)
+        padded = np.zeros((rows * block_size, cols * block_size), dtype=bool)
+        height, width = min(difference.shape[0], len(padded)), min(difference.shape[1], padded.shape[1])
+        padded[:height, :width] = difference[:height, :width]
+        return padded.reshape(rows, block_size, cols, block_size).any(axis=(1, 3))
+
+    def _update_blocks(self, masked, changed):
+        block_size = self.options['block_size']
+        ys, xs = np.nonzero(changed)
+        if not len(ys):
+            return
+        full_rows, full_cols = masked.shape[0] // block_size, masked.shape[1] // block_size
+        full = (ys < full_rows) & (xs < full_cols)
+        if full.any():
+            region = masked[:full_rows * block_size, :full_cols * block_size]
+            region = region.reshape(full_rows, block_size, full_cols, block_size, 3)
+            pixels = region[ys[full], :, xs[full]].transpose(0, 3, 1, 2)
+            pixels = pixels.reshape(len(pixels), 1, 3, block_size * block_size)
+            self.blocks[ys[full], xs[full]] = self.reduce(pixels)[:, 0]
+        for y, x in zip(ys[~full], xs[~full]):
+            block = masked[y * block_size:(y + 1) * block_size, x * block_size:(x + 1) * block_size]
+            self.blocks[y, x] = convert19.convert_to_blocks_and_dominate_color(block, block_size, self.reduce, True)[0, 0]
+        self.indices[ys, xs] = self.quantizer.indices(self.blocks[ys, xs])
+
+def convert_animation(input_path, destination, palette=None, options=None, keyframe_interval=0, max_frames=None):
+    palette = convert19.color_lookup if palette is None else palette
+    converter = IncrementalBlockConverter(palette, options)
+    writer = None
+    frames = cells_written = 0
+    start = time.perf_counter()
+    try:
+        for frame, duration_ms in iter_frames(input_path, max_frames):
+            indices, _ = converter.push(frame)
+            if writer is None:
+                writer = litegrid.SequenceWriter(destination, indices.shape[1], indices.shape[0], palette, keyframe_interval)
+            cells_written += writer.write(indices, duration_ms)
+            frames += 1
+    finally:
+        if writer is not None:
+            writer.close()
+    elapsed = time.perf_counter() - start
+    return {
+        'frames': frames,
+        'elapsed': elapsed,
+        'frames_per_sec': frames / elapsed if elapsed > 0 else 0.0,
+        'blocks_recomputed': converter.blocks_recomputed,
+        'blocks_seen': converter.blocks_seen,
+        'cells_written': cells_written,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert an animation or video clip into a delta-encoded grid sequence.')
+    parser.add_argument('input', help='animated WebP/GIF or video file')
+    parser.add_argument('output', nargs='?', default=None, help=f'destination {litegrid.EXTENSION} (default: next to the input)')
+    parser.add_argument('--palette', default=None, help='JSON palette file (default: built-in color_lookup)')
+    parser.add_argument('--block-size', type=int, default=convert19.BLOCK_SIZE, help='source pixels per peg')
+    parser.add_argument('--reducer', choices=sorted(convert19.REDUCERS), default='median', help='block colour reducer')
+    parser.add_argument('--metric', choices=convert19.PaletteQuantizer.METRICS, default='l1', help='palette distance')
+    parser.add_argument('--keyframe-interval', type=int, default=0, help='write a full frame every N frames (0: first only)')
+    parser.add_argument('--max-frames', type=int, default=None, help='stop after this many frames')
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.splitext(args.input)[0] + litegrid.EXTENSION
+    palette = convert19.load_palette(args.palette) if args.palette else convert19.color_lookup
+    options = {'block_size': args.block_size, 'reducer': args.reducer, 'metric': args.metric}
+    stats = convert_animation(args.input, output, palette, options, args.keyframe_interval, args.max_frames)
+    share = stats['blocks_recomputed'] / stats['blocks_seen'] if stats['blocks_seen'] else 0.0
+    print(f"Wrote {stats['frames']} frame(s) to {output} in {stats['elapsed']:.2f}s ({stats['frames_per_sec']:.1f} frames/sec), "
+          f"{share:.1%} of blocks recomputed, {stats['cells_written']} cells written")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
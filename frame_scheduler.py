@@ -0,0 +1,274 @@
+import gc
+import time
+
+# Fixed-tick game loop support shared by the Matrix Portal scripts. The simulation
+# advances in fixed `tick` steps regardless of how long a frame took; the display
+# is refreshed only when something marked it dirty, and at most max_fps times a
+# second. clock and sleep are injectable so a virtual clock can drive it off-device;
+# left as None they are looked up on the time module when the object is built, so
+# a patched time module (see host_emulation) is honoured too. Update and refresh
+# durations are measured with `timer` (time.perf_counter where there is one), so
+# they stay real even when a virtual clock drives the ticks.
+
+SLACK = 1e-6  # Seconds; a deadline this close counts as reached, so float rounding cannot stall a virtual clock
+
+class FrameStats:
+    # Running totals only (no per-frame lists), so it is safe to leave on the board
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.ticks = 0
+        self.frames = 0
+        self.skipped_ticks = 0
+        self.update_time = 0.0
+        self.update_max = 0.0
+        self.refresh_time = 0.0
+        self.refresh_max = 0.0
+        self.latency_time = 0.0
+        self.latency_max = 0.0
+
+    def add_update(self, seconds):
+        self.ticks += 1
+        self.update_time += seconds
+        if seconds > self.update_max:
+            self.update_max = seconds
+
+    def add_refresh(self, seconds, latency):
+        # latency: from the first change since the previous refresh to the end of this one
+        self.frames += 1
+        self.refresh_time += seconds
+        if seconds > self.refresh_max:
+            self.refresh_max = seconds
+        self.latency_time += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+
+    def summary(self):
+        ticks = self.ticks or 1
+        frames = self.frames or 1
+        return {
+            'ticks': self.ticks,
+            'frames': self.frames,
+            'skipped_ticks': self.skipped_ticks,
+            'update_ms': 1000 * self.update_time / ticks,
+            'update_max_ms': 1000 * self.update_max,
+            'refresh_ms': 1000 * self.refresh_time / frames,
+            'refresh_max_ms': 1000 * self.refresh_max,
+            'latency_ms': 1000 * self.latency_time / frames,
+            'latency_max_ms': 1000 * self.latency_max,
+        }
+
+    def report(self):
+        s = self.summary()
+        return (f"{s['ticks']} ticks ({s['skipped_ticks']} skipped), {s['frames']} refreshes, "
+                f"update {s['update_ms']:.2f}/{s['update_max_ms']:.2f} ms, "
+                f"refresh {s['refresh_ms']:.2f}/{s['refresh_max_ms']:.2f} ms, "
+                f"change-to-display {s['latency_ms']:.2f}/{s['latency_max_ms']:.2f} ms (mean/max)")
+
+class FrameScheduler:
+    def __init__(self, tick=0.02, max_fps=30, clock=None, sleep=None, max_catch_up=5, timer=None):
+        self.tick = tick
+        self.min_frame = 1 / max_fps
+        self.clock = clock or time.monotonic
+        self.sleep = sleep or time.sleep
+        self.timer = timer or getattr(time, 'perf_counter', None) or self.clock
+        self.max_catch_up = max_catch_up
+        self.stats = FrameStats()
+        self.probe = None  # An AllocationProbe measuring the next ticks, if set
+        self.on_tick = None  # Called with each tick's update duration, if set
+        self.running = False
+        self.start()
+
+    def start(self):
+        # now is the scheduled time of the tick being run, the clock for game logic
+        self.now = self.next_tick = self.clock()
+        self.last_refresh = self.now - self.min_frame
+        self.dirty_since = None
+
+    def mark_dirty(self):
+        if self.dirty_since is None:
+            self.dirty_since = self.clock()
+
+    def ticks_due(self):
+        # Number of simulation ticks to run now; after a long stall (a blocking
+        # animation, say) at most max_catch_up are replayed and the rest dropped
+        now = self.clock() + SLACK
+        if now < self.next_tick:
+            return 0
+        due = int((now - self.next_tick) / self.tick) + 1
+        if due > self.max_catch_up:
+            dropped = due - self.max_catch_up
+            self.stats.skipped_ticks += dropped
+            self.next_tick += dropped * self.tick
+            due = self.max_catch_up
+        return due
+
+    def run_tick(self, update):
+        self.now = self.next_tick
+        self.next_tick += self.tick
+        started = self.timer()
+        if self.probe is not None:
+            self.probe.begin()
+        update()
+        if self.probe is not None:
+            self.probe.end()
+        seconds = self.timer() - started
+        self.stats.add_update(seconds)
+        if self.on_tick is not None:
+            self.on_tick(seconds)
+
+    def refresh_due(self):
+        return self.dirty_since is not None and self.clock() + SLACK - self.last_refresh >= self.min_frame
+
+    def refresh(self, display):
+        started = self.clock()
+        timed = self.timer()
+        display.refresh()
+        seconds = self.timer() - timed
+        self.stats.add_refresh(seconds, self.clock() - self.dirty_since)
+        self.last_refresh = started
+        self.dirty_since = None
+
+    def wait(self):
+        # Sleep until the next tick, or the next allowed refresh if one is pending
+        wake = self.next_tick
+        if self.dirty_since is not None:
+            wake = min(wake, self.last_refresh + self.min_frame)
+        delay = wake - self.clock()
+        if delay > SLACK:
+            self.sleep(delay)
+
+    def run(self, update, display):
+        # The standard loop: catch up on ticks, refresh if dirty and allowed, sleep.
+        # Runs until stop() is called, typically from update.
+        self.running = True
+        while self.running:
+            for _ in range(self.ticks_due()):
+                self.run_tick(update)
+            if self.refresh_due():
+                self.refresh(display)
+            self.wait()
+
+    def stop(self):
+        self.running = False
+
+class Animator:
+    # Cooperative animations. A task is a generator that draws one step and yields
+    # the seconds to wait before its next step; update() (called once per tick)
+    # resumes the tasks that are due, so input and refreshes carry on meanwhile.
+    # speed > 1 compresses every delay; skip runs each task to the end at once.
+    def __init__(self, clock=None, speed=1.0, skip=False):
+        self.clock = clock or time.monotonic
+        self.speed = speed
+        self.skip = skip
+        self.tasks = []  # [wake time, generator]
+
+    @property
+    def busy(self):
+        return bool(self.tasks)
+
+    def start(self, task):
+        # Runs the task up to its first wait straight away
+        entry = [self.clock(), task]
+        if self._advance(entry):
+            self.tasks.append(entry)
+
+    def _advance(self, entry):
+        # Steps a task until it asks to wait; False once it has finished
+        while True:
+            try:
+                delay = next(entry[1])
+            except StopIteration:
+                return False
+            if not self.skip and delay:
+                entry[0] += delay / self.speed
+                return True
+
+    def update(self):
+        # By index from the end, so finished tasks can be dropped without copying the list
+        now = self.clock() + SLACK
+        tasks = self.tasks
+        for i in range(len(tasks) - 1, -1, -1):
+            if tasks[i][0] <= now and not self._advance(tasks[i]):
+                tasks.pop(i)
+
+    def next_wake(self):
+        return min(entry[0] for entry in self.tasks) if self.tasks else None
+
+    def finish(self):
+        # Fast-forwards every running task to its end
+        skip, self.skip = self.skip, True
+        for entry in self.tasks:
+            self._advance(entry)
+        self.tasks = []
+        self.skip = skip
+
+class AllocationProbe:
+    # Heap bytes allocated per tick, from gc.mem_free() around each tick's update
+    # with the collector disabled, so nothing is freed mid-measurement. Needs
+    # CircuitPython/MicroPython; on CPython `available` is False and it finishes
+    # at once without a result.
+    def __init__(self, ticks=100):
+        self.ticks = ticks
+        self.available = hasattr(gc, 'mem_free')
+        self.count = 0
+        self.allocated = 0
+        self.worst = 0
+        self.before = 0
+        self.done = not self.available
+        if self.available:
+            gc.collect()
+            gc.disable()
+
+    def begin(self):
+        if not self.done:
+            self.before = gc.mem_free()
+
+    def end(self):
+        if self.done:
+            return
+        allocated = self.before - gc.mem_free()
+        self.allocated += allocated
+        if allocated > self.worst:
+            self.worst = allocated
+        self.count += 1
+        if self.count >= self.ticks:
+            self.done = True
+            gc.enable()
+
+    def result(self):
+        # Mean bytes per tick, None until done (or when unavailable)
+        return self.allocated / self.count if self.done and self.count else None
+
+    def report(self):
+        if not self.available:
+            return "allocation probe unavailable (no gc.mem_free)"
+        if not self.done:
+            return f"allocation probe running ({self.count}/{self.ticks} ticks)"
+        return f"allocated {self.result():.1f}/{self.worst} bytes per tick (mean/max) over {self.count} ticks"
+
+class VirtualClock:
+    # Drop-in for time.monotonic/time.sleep: sleeping just moves the clock forward
+    def __init__(self, start=0.0):
+        self.time = start
+
+    def monotonic(self):
+        return self.time
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.time += seconds
+
+def run_headless(task, speed=1.0, skip=False):
+    # Plays one animation task against a VirtualClock, e.g. on a drawing that is
+    # just a list; returns (steps, virtual seconds taken)
+    clock = VirtualClock()
+    animator = Animator(clock.monotonic, speed, skip)
+    animator.start(task)
+    steps = 1
+    while animator.busy:
+        clock.sleep(animator.next_wake() - clock.monotonic())
+        animator.update()
+        steps += 1
+    return steps, clock.monotonic()
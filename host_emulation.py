@@ -0,0 +1,463 @@
+import argparse
+import collections
+import os
+import random
+import runpy
+import sys
+import time
+import types
+import numpy as np
+
+from frame_scheduler import VirtualClock
+from tilt_input import ReplaySensor, load_trace, synthetic_trace
+
+# Desktop stand-ins for the CircuitPython modules the Matrix Portal scripts import
+# (board, busio, displayio, bitmaptools, analogio, analogbufio, adafruit_lis3dh
+# and adafruit_matrixportal.matrix), so tetris.py and visualizer.py run, and can be
+# profiled, off the device. Bitmaps and palettes are NumPy arrays; every display
+# refresh composites the group tree into an RGB frame that is kept in a ring
+# buffer and/or written as an image sequence.
+# time.monotonic/time.sleep are replaced by a virtual clock, so a game runs as
+# fast as the host can simulate it and stops after a set number of virtual seconds.
+#
+#   python host_emulation.py --seconds 300 --frames-dir frames/ tetris.py
+#   python host_emulation.py visualizer.py song.wav
+#   python host_emulation.py litebrite_player.py slides.lbg
+#
+# Only single-tile TileGrids are composited, which is all the scripts here use.
+
+STANDARD_GRAVITY = 9.806
+
+class StopEmulation(Exception):
+    # Raised from the virtual clock or a refresh once the run's limit is reached
+    pass
+
+class Bitmap:
+    def __init__(self, width, height, value_count):
+        self.width = width
+        self.height = height
+        self.value_count = value_count
+        self.data = np.zeros((height, width), dtype=np.uint16)
+
+    def _index(self, index):
+        if isinstance(index, tuple):
+            x, y = index
+        else:
+            x, y = index % self.width, index // self.width
+        # NumPy would wrap negative indices; displayio raises
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError(f"pixel ({x}, {y}) outside {self.width}x{self.height} bitmap")
+        return y, x
+
+    def __getitem__(self, index):
+        return int(self.data[self._index(index)])
+
+    def __setitem__(self, index, value):
+        if not 0 <= value < self.value_count:
+            raise ValueError(f"value {value} out of range for {self.value_count} colours")
+        self.data[self._index(index)] = value
+
+    def fill(self, value):
+        self.data[:] = value
+
+class Palette:
+    def __init__(self, color_count):
+        self.colors = np.zeros((color_count, 3), dtype=np.uint8)
+        self.transparent = np.zeros(color_count, dtype=bool)
+
+    def __len__(self):
+        return len(self.colors)
+
+    def __setitem__(self, index, color):
+        if isinstance(color, int):
+            color = ((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF)
+        self.colors[index] = tuple(color)[:3]
+
+    def __getitem__(self, index):
+        red, green, blue = (int(c) for c in self.colors[index])
+        return red << 16 | green << 8 | blue
+
+    def make_transparent(self, index):
+        self.transparent[index] = True
+
+    def make_opaque(self, index):
+        self.transparent[index] = False
+
+class TileGrid:
+    def __init__(self, bitmap, *, pixel_shader, width=1, height=1, tile_width=None, tile_height=None,
+                 default_tile=0, x=0, y=0):
+        if (width, height) != (1, 1) or tile_width not in (None, bitmap.width) or tile_height not in (None, bitmap.height):
+            raise NotImplementedError("only single-tile TileGrids are emulated")
+        self.bitmap = bitmap
+        self.pixel_shader = pixel_shader
+        self.x = x
+        self.y = y
+        self.hidden = False
+
+    def render(self):
+        # (h, w, 3) colours and (h, w) opacity of the bitmap through the palette
+        data = self.bitmap.data
+        return self.pixel_shader.colors[data], ~self.pixel_shader.transparent[data]
+
+class Group:
+    def __init__(self, *, scale=1, x=0, y=0):
+        self.scale = scale
+        self.x = x
+        self.y = y
+        self.hidden = False
+        self.layers = []
+
+    def append(self, layer):
+        self.layers.append(layer)
+
+    def insert(self, index, layer):
+        self.layers.insert(index, layer)
+
+    def remove(self, layer):
+        self.layers.remove(layer)
+
+    def pop(self, index=-1):
+        return self.layers.pop(index)
+
+    def index(self, layer):
+        return self.layers.index(layer)
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __getitem__(self, index):
+        return self.layers[index]
+
+    def __iter__(self):
+        return iter(self.layers)
+
+def fill_region(dest_bitmap, x1, y1, x2, y2, value):
+    # bitmaptools.fill_region: [x1, x2) x [y1, y2), clipped to the bitmap
+    left, right = max(min(x1, x2), 0), min(max(x1, x2), dest_bitmap.width)
+    top, bottom = max(min(y1, y2), 0), min(max(y1, y2), dest_bitmap.height)
+    if left < right and top < bottom:
+        dest_bitmap.data[top:bottom, left:right] = value
+
+def readinto(bitmap, file, bits_per_pixel, element_size=1, reverse_pixels_in_element=False,
+             swap_bytes_in_element=False, reverse_rows=False):
+    # bitmaptools.readinto for 1-byte elements: bitmap.height rows of packed
+    # pixels, each row padded to whole bytes. As on the device, the first pixel of
+    # a byte is in its least significant bits unless reverse_pixels_in_element.
+    if element_size != 1 or swap_bytes_in_element or bits_per_pixel not in (1, 2, 4, 8):
+        raise NotImplementedError("only 1, 2, 4 or 8 bits per pixel in 1-byte elements are emulated")
+    row_bytes = (bitmap.width * bits_per_pixel + 7) // 8
+    data = np.frombuffer(file.read(row_bytes * bitmap.height), dtype=np.uint8).reshape(bitmap.height, row_bytes)
+    planes = np.unpackbits(data, axis=1).reshape(bitmap.height, -1, bits_per_pixel)
+    if not reverse_pixels_in_element:
+        per_byte = 8 // bits_per_pixel
+        planes = planes.reshape(bitmap.height, row_bytes, per_byte, bits_per_pixel)[:, :, ::-1]
+        planes = planes.reshape(bitmap.height, -1, bits_per_pixel)
+    weights = 1 << np.arange(bits_per_pixel - 1, -1, -1)
+    pixels = (planes * weights).sum(axis=2)[:, :bitmap.width]
+    bitmap.data[:] = pixels[::-1] if reverse_rows else pixels
+
+def composite(group, frame, x=0, y=0, scale=1):
+    # Paints group and its children into frame (h, w, 3), back to front, clipped
+    if group.hidden:
+        return
+    x += group.x * scale
+    y += group.y * scale
+    scale *= group.scale
+    for layer in group.layers:
+        if isinstance(layer, Group):
+            composite(layer, frame, x, y, scale)
+        elif not layer.hidden:
+            colors, opaque = layer.render()
+            if scale != 1:
+                colors = colors.repeat(scale, axis=0).repeat(scale, axis=1)
+                opaque = opaque.repeat(scale, axis=0).repeat(scale, axis=1)
+            left, top = x + layer.x * scale, y + layer.y * scale
+            x0, y0 = max(left, 0), max(top, 0)
+            x1 = min(left + colors.shape[1], frame.shape[1])
+            y1 = min(top + colors.shape[0], frame.shape[0])
+            if x0 >= x1 or y0 >= y1:
+                continue
+            region = (slice(y0 - top, y1 - top), slice(x0 - left, x1 - left))
+            target = frame[y0:y1, x0:x1]
+            target[opaque[region]] = colors[region][opaque[region]]
+
+class FrameRecorder:
+    # Keeps the last `ring` frames in memory as (virtual time, RGB array) and/or
+    # writes every frame to `directory` as frame_NNNNN.png, upscaled by `scale`
+    def __init__(self, ring=0, directory=None, scale=1):
+        self.frames = collections.deque(maxlen=ring) if ring else None
+        self.directory = directory
+        self.scale = scale
+        self.count = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def record(self, timestamp, frame):
+        if self.frames is not None:
+            self.frames.append((timestamp, frame))
+        if self.directory:
+            from PIL import Image
+            image = frame.repeat(self.scale, axis=0).repeat(self.scale, axis=1) if self.scale > 1 else frame
+            Image.fromarray(image).save(os.path.join(self.directory, f"frame_{self.count:05d}.png"))
+        self.count += 1
+
+class Display:
+    def __init__(self, emulator, width, height):
+        self.emulator = emulator
+        self.width = width
+        self.height = height
+        self.root_group = None
+        self.auto_refresh = True
+        self.brightness = 1.0
+
+    def show(self, group):
+        self.root_group = group
+
+    def refresh(self, *, target_frames_per_second=None, minimum_frames_per_second=0):
+        started = time.perf_counter()
+        frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        if self.root_group is not None:
+            composite(self.root_group, frame)
+        self.emulator.add_frame(frame, time.perf_counter() - started)
+        return True
+
+class Matrix:
+    # adafruit_matrixportal.matrix.Matrix; the remaining keyword arguments (bit depth,
+    # pins, tiling) only matter to the real hardware
+    emulator = None
+
+    def __init__(self, *, width=64, height=32, **_):
+        self.display = Display(self.emulator, width, height)
+
+class LIS3DH_I2C:
+    # Reports `acceleration` from the emulator's tilt source; there is no _i2c, so
+    # tilt_input.LIS3DHFifo falls back to one read per poll
+    emulator = None
+
+    def __init__(self, i2c, *, address=0x18, int1=None):
+        self.range = 0
+        self.data_rate = 0
+
+    @property
+    def acceleration(self):
+        return self.emulator.acceleration()
+
+class AnalogIn:
+    # analogio.AnalogIn: `value` is the emulated microphone at the current time
+    emulator = None
+
+    def __init__(self, pin):
+        pass
+
+    @property
+    def value(self):
+        return int(self.emulator.microphone(np.array([self.emulator.now()]))[0])
+
+    def deinit(self):
+        pass
+
+class BufferedIn:
+    # analogbufio.BufferedIn: readinto() fills the buffer from the emulated
+    # microphone and, like the hardware, takes the buffer's duration to do it
+    emulator = None
+
+    def __init__(self, pin, *, sample_rate):
+        self.sample_rate = sample_rate
+
+    def readinto(self, buffer):
+        count = len(buffer)
+        times = self.emulator.now() + np.arange(count) / self.sample_rate
+        memoryview(buffer).cast('B')[:] = self.emulator.microphone(times).astype('<u2').tobytes()
+        time.sleep(count / self.sample_rate)
+        return count
+
+    def deinit(self):
+        pass
+
+class I2C:
+    def __init__(self, scl, sda, *, frequency=100000, timeout=255):
+        pass
+
+    def try_lock(self):
+        return True
+
+    def unlock(self):
+        pass
+
+    def deinit(self):
+        pass
+
+class EmulationClock(VirtualClock):
+    # VirtualClock that ends the run once `limit` virtual seconds have passed
+    def __init__(self, limit=None):
+        super().__init__()
+        self.limit = limit
+
+    def sleep(self, seconds):
+        super().sleep(seconds)
+        if self.limit is not None and self.time >= self.limit:
+            raise StopEmulation(f"{self.limit:g} virtual seconds elapsed")
+
+    def monotonic_ns(self):
+        return int(self.time * 1e9)
+
+class Emulator:
+    # install() puts the stand-in modules into sys.modules and the virtual clock
+    # into the time module; uninstall() undoes both. tilt is a list of (x, y, z)
+    # samples at tilt_rate Hz, played on the virtual clock (default: lying flat).
+    # With realtime the time module is left alone and the script keeps wall time.
+    def __init__(self, seconds=None, max_frames=None, ring=0, frames_dir=None, scale=1, tilt=None, tilt_rate=100,
+                 realtime=False):
+        self.realtime = realtime
+        self.clock = EmulationClock(seconds)
+        self.max_frames = max_frames
+        self.recorder = FrameRecorder(ring, frames_dir, scale)
+        self.tilt = ReplaySensor(tilt, tilt_rate, self.now) if tilt else None
+        self.composite_time = 0.0
+        self.saved_modules = {}
+        self.saved_time = None
+
+    def now(self):
+        return time.monotonic() if self.realtime else self.clock.time
+
+    def acceleration(self):
+        return self.tilt.acceleration if self.tilt else (0.0, 0.0, STANDARD_GRAVITY)
+
+    def microphone(self, times):
+        # 16-bit unsigned ADC readings at `times` (s): a tone sweeping from 60 Hz to
+        # 4 kHz every 4 s around mid-scale, as audio_spectrum.SyntheticSource
+        low, ratio, period = 60.0, 4000.0 / 60.0, 4.0
+        elapsed = np.mod(times, period)
+        # Phase of an exponential sweep, integrated in closed form
+        phase = 2 * np.pi * low * period / np.log(ratio) * (ratio ** (elapsed / period) - 1)
+        return (32768 + 16000 * np.sin(phase)).astype(np.uint16)
+
+    def add_frame(self, frame, seconds):
+        self.composite_time += seconds
+        self.recorder.record(self.now(), frame)
+        if self.max_frames is not None and self.recorder.count >= self.max_frames:
+            raise StopEmulation(f"{self.max_frames} frames recorded")
+
+    @property
+    def frames(self):
+        # The ring buffer: (virtual time, RGB array) per refresh, oldest first
+        return list(self.recorder.frames or ())
+
+    def modules(self):
+        matrix = type('Matrix', (Matrix,), {'emulator': self})
+        accelerometer = type('LIS3DH_I2C', (LIS3DH_I2C,), {'emulator': self})
+        analogio = types.ModuleType('analogio')
+        analogio.AnalogIn = type('AnalogIn', (AnalogIn,), {'emulator': self})
+        analogbufio = types.ModuleType('analogbufio')
+        analogbufio.BufferedIn = type('BufferedIn', (BufferedIn,), {'emulator': self})
+        board = types.ModuleType('board')
+        board.__getattr__ = lambda name: name  # Any pin, e.g. board.SCL, is just its name
+        busio = types.ModuleType('busio')
+        busio.I2C = I2C
+        displayio = types.ModuleType('displayio')
+        displayio.Bitmap = Bitmap
+        displayio.Palette = Palette
+        displayio.TileGrid = TileGrid
+        displayio.Group = Group
+        displayio.release_displays = lambda: None
+        bitmaptools = types.ModuleType('bitmaptools')
+        bitmaptools.fill_region = fill_region
+        bitmaptools.readinto = readinto
+        lis3dh = types.ModuleType('adafruit_lis3dh')
+        lis3dh.LIS3DH_I2C = accelerometer
+        lis3dh.RANGE_2_G, lis3dh.RANGE_4_G, lis3dh.RANGE_8_G, lis3dh.RANGE_16_G = 0, 1, 2, 3
+        matrixportal = types.ModuleType('adafruit_matrixportal')
+        matrixportal.__path__ = []
+        matrix_module = types.ModuleType('adafruit_matrixportal.matrix')
+        matrix_module.Matrix = matrix
+        matrixportal.matrix = matrix_module
+        return {'board': board, 'busio': busio, 'displayio': displayio, 'adafruit_lis3dh': lis3dh,
+                'bitmaptools': bitmaptools, 'analogio': analogio, 'analogbufio': analogbufio,
+                'adafruit_matrixportal': matrixportal,
+                'adafruit_matrixportal.matrix': matrix_module}
+
+    def install(self):
+        for name, module in self.modules().items():
+            self.saved_modules[name] = sys.modules.get(name)
+            sys.modules[name] = module
+        if self.realtime:
+            return
+        self.saved_time = (time.monotonic, time.sleep, getattr(time, 'monotonic_ns', None))
+        time.monotonic = self.clock.monotonic
+        time.sleep = self.clock.sleep
+        time.monotonic_ns = self.clock.monotonic_ns
+
+    def uninstall(self):
+        for name, module in self.saved_modules.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        self.saved_modules = {}
+        if self.saved_time:
+            time.monotonic, time.sleep, time.monotonic_ns = self.saved_time
+            self.saved_time = None
+
+    def run(self, main):
+        # Calls main() until it returns or the limit stops it; returns run statistics
+        started = time.perf_counter()
+        stopped = None
+        try:
+            main()
+        except StopEmulation as e:
+            stopped = str(e)
+        elapsed = time.perf_counter() - started
+        frames = self.recorder.count
+        seconds = elapsed if self.realtime else self.clock.time
+        return {
+            'virtual_seconds': seconds,
+            'elapsed': elapsed,
+            'speedup': seconds / elapsed if elapsed > 0 else 0.0,
+            'frames': frames,
+            'composite_ms': 1000 * self.composite_time / frames if frames else 0.0,
+            'stopped': stopped,
+        }
+
+def run_script(path, emulator, args=()):
+    # Runs a device script as __main__ under the emulator, with sys.argv set to
+    # the script and args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    argv = sys.argv
+    sys.argv = [path] + list(args)
+    emulator.install()
+    try:
+        return emulator.run(lambda: runpy.run_path(path, run_name='__main__'))
+    finally:
+        emulator.uninstall()
+        sys.argv = argv
+        sys.path.pop(0)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a Matrix Portal script on the desktop against emulated hardware.')
+    parser.add_argument('script', help='device script, e.g. tetris.py or visualizer.py')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments for the script, e.g. a WAV file for visualizer.py (options for this tool go before the script)')
+    parser.add_argument('--seconds', type=float, default=60.0, help='virtual seconds to run for')
+    parser.add_argument('--max-frames', type=int, default=None, help='stop after this many refreshes')
+    parser.add_argument('--ring', type=int, default=64, help='frames kept in memory (0: none)')
+    parser.add_argument('--frames-dir', default=None, help='write every frame as a PNG into this directory')
+    parser.add_argument('--scale', type=int, default=8, help='upscaling of written frames')
+    parser.add_argument('--tilt', default=None, help='accelerometer trace, one "x,y,z" per line; "synthetic" for a built-in one')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the random module')
+    args = parser.parse_args(argv)
+
+    tilt = None
+    if args.tilt == 'synthetic':
+        tilt = synthetic_trace()
+    elif args.tilt:
+        tilt = load_trace(args.tilt)
+    if args.seed is not None:
+        random.seed(args.seed)
+    emulator = Emulator(args.seconds, args.max_frames, args.ring, args.frames_dir, args.scale, tilt)
+    stats = run_script(args.script, emulator, args.args)
+    print(f"{args.script}: {stats['virtual_seconds']:.1f} virtual seconds in {stats['elapsed']:.2f}s "
+          f"({stats['speedup']:.0f}x real time), {stats['frames']} refreshes, "
+          f"composite {stats['composite_ms']:.3f} ms/frame" + (f" (stopped: {stats['stopped']})" if stats['stopped'] else ""))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import array
+import struct
+import sys
+import time
+import displayio
+from adafruit_matrixportal.matrix import Matrix
+
+try:
+    import bitmaptools  # readinto and blit in C; not on every port
+except ImportError:
+    bitmaptools = None
+
+# Slideshow/animation player for converted Lite-Brite grids. It plays one .lbg
+# file, normally a delta-encoded sequence packed from a directory of converted
+# grids on the host:
+#
+#   python litegrid.py pack output/ slides.lbg
+#
+# Nothing is parsed at runtime. Packs use 1, 2, 4 or 8 bits per peg, so a key
+# frame goes from flash straight into a Bitmap through bitmaptools.readinto. A
+# delta frame's cell positions and values are read into buffers allocated once,
+# and only the changed cells are written. Two Bitmaps take turns on screen: the
+# next frame is built in the hidden one while the current one is shown, so every
+# swap lands on time and never shows a half-drawn frame. The hidden Bitmap is a
+# frame behind, so it first catches up by replaying the changes of the frame on
+# screen (kept from the previous update, or its key frame read again); no frame
+# is ever copied whole.
+#
+#   python host_emulation.py litebrite_player.py slides.lbg
+
+# litegrid's format, repeated here since litegrid needs NumPy
+MAGIC = b'LGRD'
+VERSION = 1
+HEADER = '<4sBBBBHHI'  # magic, version, bits per peg, palette size, flags, width, height, frame count
+FLAG_DELTA = 1
+KEY_FRAME = ord('K')
+
+class LiteBritePlayer:
+    def __init__(self, path, width=32, height=32, fps=None, hold=2.0, loop=True):
+        # width, height: of the matrix; the grid is centred on it
+        # fps: fixed frame rate; by default frames keep the durations they were
+        # packed with, and the frames of a plain (not delta) .lbg show for `hold` s
+        self.file = open(path, 'rb')
+        magic, version, bits, colors, self.flags, grid_width, grid_height, self.frame_count = \
+            struct.unpack(HEADER, self.file.read(struct.calcsize(HEADER)))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} grid file")
+        if bits not in (1, 2, 4, 8) or grid_width * bits % 8 or grid_width * grid_height > 65536:
+            raise ValueError(f"{path} cannot be read directly (pack it with litegrid.py pack)")
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.cells = grid_width * grid_height
+        self.row_bytes = grid_width * bits // 8
+        table = self.file.read(4 * colors)
+        palette = displayio.Palette(colors)
+        for i in range(colors):
+            palette[i] = table[4 * i + 1] << 16 | table[4 * i + 2] << 8 | table[4 * i + 3]
+        self.data_offset = self.file.tell()
+        self.frame_time = 1 / fps if fps else None
+        self.hold = hold
+        self.loop = loop
+        self.frame = 0  # Frames read since the start of the file
+
+        self.matrix = Matrix(width=width, height=height)
+        self.display = self.matrix.display
+        self.display.auto_refresh = False
+        self.bitmaps = [displayio.Bitmap(grid_width, grid_height, colors) for _ in range(2)]
+        self.tile_grids = [displayio.TileGrid(bitmap, pixel_shader=palette, x=(width - grid_width) // 2,
+                                              y=(height - grid_height) // 2) for bitmap in self.bitmaps]
+        self.tile_grids[1].hidden = True
+        self.group = displayio.Group()
+        for tile_grid in self.tile_grids:
+            self.group.append(tile_grid)
+        self.display.root_group = self.group
+        self.front = 0  # Index of the bitmap on screen
+
+        # Read buffers, sized for a delta that changes every cell. There are two
+        # sets of change buffers: the latest delta's, and a spare for the next one.
+        self.record = bytearray(3)  # Kind, duration ms
+        self.count = bytearray(4)
+        self.positions = [array.array('H', [0] * self.cells) for _ in range(2)]
+        self.position_views = [memoryview(positions) for positions in self.positions]
+        self.values = [bytearray((self.cells * bits + 7) // 8) for _ in range(2)]
+        self.value_views = [memoryview(values) for values in self.values]
+        self.counts = [0, 0]
+        self.latest = 0  # Change buffers of the frame on screen, if it was a delta
+        self.key_offset = None  # File offset of the frame on screen, if it was a key frame
+        self.row = bytearray(self.row_bytes)  # Key frames without bitmaptools
+
+        self.frames = 0
+        self.changed = 0
+        self.late = 0
+        self.decode_time = 0.0
+        self.decode_max = 0.0
+
+    def read_key(self, bitmap):
+        if bitmaptools is not None:
+            # Packs put the first peg of a byte in its most significant bits
+            bitmaptools.readinto(bitmap, self.file, self.bits, reverse_pixels_in_element=True)
+            return
+        bits, mask, row = self.bits, self.mask, self.row
+        i = 0
+        for _ in range(bitmap.height):
+            self.file.readinto(row)
+            for x in range(bitmap.width):
+                bit = x * bits
+                bitmap[i] = row[bit >> 3] >> (8 - bits - (bit & 7)) & mask
+                i += 1
+
+    def read_delta(self):
+        # Reads one delta record into the spare change buffers, which become the
+        # latest; returns how many cells it changes
+        latest = 1 - self.latest
+        self.file.readinto(self.count)
+        count = self.count[0] | self.count[1] << 8 | self.count[2] << 16 | self.count[3] << 24
+        self.file.readinto(self.position_views[latest][:count])
+        self.file.readinto(self.value_views[latest][:(count * self.bits + 7) // 8])
+        self.counts[latest] = count
+        self.latest = latest
+        return count
+
+    def apply_delta(self, bitmap, which):
+        # Writes the cells of the delta in change buffers `which` into bitmap
+        count, positions, values = self.counts[which], self.positions[which], self.values[which]
+        if self.bits == 8:
+            for i in range(count):
+                bitmap[positions[i]] = values[i]
+            return
+        bits, mask = self.bits, self.mask
+        for i in range(count):
+            bit = i * bits
+            bitmap[positions[i]] = values[bit >> 3] >> (8 - bits - (bit & 7)) & mask
+
+    def update(self):
+        # Builds the next frame in the hidden bitmap; returns how long it shows for
+        # in seconds, or None after the last frame when not looping
+        if self.frame == self.frame_count:
+            if not self.loop or not self.frame_count:
+                return None
+            self.file.seek(self.data_offset)  # Packs always start on a key frame
+            self.frame = 0
+        started = time.monotonic()
+        back = self.bitmaps[1 - self.front]
+        if self.flags & FLAG_DELTA:
+            self.file.readinto(self.record)
+            duration = (self.record[1] | self.record[2] << 8) / 1000
+            if self.record[0] == KEY_FRAME:
+                self.key_offset = self.file.tell()
+                self.read_key(back)
+                changed = self.cells
+            else:
+                # back still holds the frame before the one on screen: bring it up
+                # to that one, then apply this frame's changes
+                if self.key_offset is not None:
+                    resume = self.file.tell()
+                    self.file.seek(self.key_offset)
+                    self.read_key(back)
+                    self.file.seek(resume)
+                    self.key_offset = None
+                else:
+                    self.apply_delta(back, self.latest)
+                changed = self.read_delta()
+                self.apply_delta(back, self.latest)
+        else:
+            duration = self.hold
+            self.read_key(back)
+            changed = self.cells
+        elapsed = time.monotonic() - started
+        self.frame += 1
+        self.frames += 1
+        self.changed += changed
+        self.decode_time += elapsed
+        if elapsed > self.decode_max:
+            self.decode_max = elapsed
+        return self.frame_time or duration
+
+    def show(self):
+        # Swaps the frame built by update() onto the screen
+        self.tile_grids[1 - self.front].hidden = False
+        self.tile_grids[self.front].hidden = True
+        self.front = 1 - self.front
+        self.display.refresh()
+
+    def report(self):
+        frames = self.frames or 1
+        return (f"{self.frames} frames, {self.changed / frames:.0f} cells changed and "
+                f"{1000 * self.decode_time / frames:.2f}/{1000 * self.decode_max:.2f} ms to build (mean/max), "
+                f"{self.late} late")
+
+    def run(self, stats_interval=None):
+        # stats_interval: print the decode timing every this many seconds
+        duration = self.update()
+        next_frame = last_stats = time.monotonic()
+        while duration is not None:
+            self.show()
+            next_frame += duration
+            duration = self.update()  # While the frame just shown is on screen
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.late += 1
+                next_frame = time.monotonic()  # Fell behind; do not try to catch up
+            if stats_interval and time.monotonic() - last_stats >= stats_interval:
+                print(self.report())
+                last_stats = time.monotonic()
+
+if __name__ == '__main__':
+    # On the board, copy a pack to the CIRCUITPY drive as slides.lbg; on a host
+    # (see host_emulation) pass the pack and optionally a frame rate
+    path = sys.argv[1] if len(sys.argv) > 1 else 'slides.lbg'
+    fps = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    player = LiteBritePlayer(path, 32, 32, fps)
+    player.run(stats_interval=10)
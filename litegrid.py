@@ -0,0 +1,371 @@
+import ast
+import os
+import struct
+import sys
+import numpy as np
+
+# Compact binary Lite-Brite grid (.lbg):
+#   header   <4sBBBBHHI  magic, version, bits per peg, palette size, flags, width, height, frame count
+#   palette  palette size x (key byte, r, g, b)
+#   frames   frame count x ceil(width * height * bits / 8) bytes of MSB-first packed palette indices
+# Frames are fixed-size, so a reader can memory-map the file and slice any frame directly.
+#
+# With FLAG_DELTA set the frames are a delta-encoded stream instead, read sequentially:
+#   key frame    b'K', duration ms <H, full packed frame
+#   delta frame  b'D', duration ms <H, change count <I, count x cell position
+#                (<H, or <I when width * height > 65536), packed indices of those cells
+MAGIC = b'LGRD'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBBHHI')
+EXTENSION = '.lbg'
+FLAG_DELTA = 1
+KEY_FRAME = b'K'
+DELTA_FRAME = b'D'
+RECORD = struct.Struct('<cH')
+CHANGE_COUNT = struct.Struct('<I')
+
+def bits_for(palette_size):
+    return max(1, (palette_size - 1).bit_length())
+
+def device_bits(palette_size):
+    # Smallest of 1, 2, 4 or 8 bits that holds the palette: the pixel sizes
+    # bitmaptools.readinto can read straight into a displayio.Bitmap
+    bits = bits_for(palette_size)
+    for size in (1, 2, 4, 8):
+        if bits <= size:
+            return size
+    raise ValueError("A device grid holds at most 256 colours")
+
+def frame_bytes(width, height, bits):
+    return (width * height * bits + 7) // 8
+
+def pack_indices(indices, bits):
+    # (..., n) uint8 indices -> (..., ceil(n * bits / 8)) packed bytes
+    indices = np.ascontiguousarray(indices, dtype=np.uint8)
+    leading, count = indices.shape[:-1], indices.shape[-1]
+    planes = np.unpackbits(indices[..., None], axis=-1)[..., 8 - bits:]
+    return np.packbits(planes.reshape(leading + (count * bits,)), axis=-1)
+
+def unpack_indices(packed, count, bits):
+    planes = np.unpackbits(packed, axis=-1, count=count * bits)
+    planes = planes.reshape(planes.shape[:-1] + (count, bits))
+    weights = (1 << np.arange(bits - 1, -1, -1)).astype(np.uint8)
+    return (planes * weights).sum(axis=-1, dtype=np.uint8)
+
+def _palette_table(color_lookup):
+    if len(color_lookup) > 255:
+        raise ValueError("A grid palette holds at most 255 colours")
+    table = bytearray()
+    for key, (r, g, b) in color_lookup.items():
+        encoded = key.encode('ascii')
+        if len(encoded) != 1:
+            raise ValueError(f"Palette keys must be single ASCII characters, got {key!r}")
+        table += bytes((encoded[0], r, g, b))
+    return bytes(table)
+
+def write_grid(path, indices, color_lookup):
+    # indices: (height, width) for a single board or (frames, height, width) for a sequence
+    indices = np.asarray(indices, dtype=np.uint8)
+    frames = indices[None] if indices.ndim == 2 else indices
+    count, height, width = frames.shape
+    if count and frames.max(initial=0) >= len(color_lookup):
+        raise ValueError("Grid indices exceed the palette size")
+    bits = bits_for(len(color_lookup))
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, bits, len(color_lookup), 0, width, height, count))
+        file.write(_palette_table(color_lookup))
+        file.write(pack_indices(frames.reshape(count, height * width), bits).tobytes())
+
+class GridFile:
+    # Memory-mapped reader. `packed` is a zero-copy (frames, frame_bytes) view of the
+    # file; frame() and indices() unpack it into palette index arrays.
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError(f"{path} is too short to be a grid file")
+            magic, version, self.bits, palette_size, self.flags, self.width, self.height, self.frame_count = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} grid file")
+            if self.flags & FLAG_DELTA:
+                raise ValueError(f"{path} is a delta-encoded sequence, read it with SequenceReader")
+            table = file.read(palette_size * 4)
+        self.color_lookup = {chr(table[i]): tuple(table[i + 1:i + 4]) for i in range(0, len(table), 4)}
+        self.frame_bytes = frame_bytes(self.width, self.height, self.bits)
+        offset = HEADER.size + len(table)
+        if self.frame_count:
+            self.packed = np.memmap(path, dtype=np.uint8, mode='r', offset=offset,
+                                    shape=(self.frame_count, self.frame_bytes))
+        else:
+            self.packed = np.zeros((0, self.frame_bytes), dtype=np.uint8)
+
+    def __len__(self):
+        return self.frame_count
+
+    def frame(self, index=0):
+        return unpack_indices(self.packed[index], self.width * self.height, self.bits).reshape(self.height, self.width)
+
+    def indices(self):
+        return unpack_indices(self.packed, self.width * self.height, self.bits).reshape(self.frame_count, self.height, self.width)
+
+    def colors(self):
+        return np.array(list(self.color_lookup.values()), dtype=np.uint8)
+
+def _position_dtype(width, height):
+    return np.dtype('<u2') if width * height <= 65536 else np.dtype('<u4')
+
+class SequenceWriter:
+    # Streams a delta-encoded sequence to disk one frame at a time; the frame count in
+    # the header is patched on close(). A delta frame stores only the cells whose
+    # palette index changed; every keyframe_interval frames (0: first only) a full
+    # key frame is written so readers can resynchronise, and any frame whose delta
+    # would be larger than a key frame is written as one.
+    # bits: bits per peg, at least enough for the palette (default: just enough)
+    def __init__(self, path, width, height, color_lookup, keyframe_interval=0, bits=None):
+        self.width, self.height = width, height
+        self.color_lookup = color_lookup
+        self.bits = bits or bits_for(len(color_lookup))
+        if self.bits < bits_for(len(color_lookup)) or self.bits > 8:
+            raise ValueError(f"{self.bits} bits per peg cannot hold {len(color_lookup)} colours")
+        self.keyframe_interval = keyframe_interval
+        self.position_dtype = _position_dtype(width, height)
+        self.frame_count = 0
+        self.previous = None
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.bits, len(color_lookup), FLAG_DELTA, width, height, 0))
+        self.file.write(_palette_table(color_lookup))
+
+    def write(self, indices, duration_ms=100):
+        indices = np.asarray(indices, dtype=np.uint8).reshape(-1)
+        if indices.size != self.width * self.height:
+            raise ValueError(f"Expected a {self.height}x{self.width} grid")
+        duration_ms = min(int(duration_ms), 65535)
+        key = self.previous is None or (self.keyframe_interval and self.frame_count % self.keyframe_interval == 0)
+        if not key:
+            positions = np.flatnonzero(indices != self.previous)
+            delta_bytes = CHANGE_COUNT.size + len(positions) * self.position_dtype.itemsize + frame_bytes(len(positions), 1, self.bits)
+            key = delta_bytes >= frame_bytes(indices.size, 1, self.bits)
+        if key:
+            self.file.write(RECORD.pack(KEY_FRAME, duration_ms))
+            self.file.write(pack_indices(indices, self.bits).tobytes())
+            changed = indices.size
+        else:
+            self.file.write(RECORD.pack(DELTA_FRAME, duration_ms))
+            self.file.write(CHANGE_COUNT.pack(len(positions)))
+            self.file.write(positions.astype(self.position_dtype).tobytes())
+            self.file.write(pack_indices(indices[positions], self.bits).tobytes())
+            changed = len(positions)
+        self.previous = indices.copy()
+        self.frame_count += 1
+        return changed
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.bits, len(self.color_lookup), FLAG_DELTA,
+                                    self.width, self.height, self.frame_count))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class SequenceReader:
+    # Sequential reader for delta-encoded sequences. records() yields the raw
+    # (kind, duration_ms, positions, values) of each frame, where positions is None
+    # for key frames; iterating yields (indices, duration_ms) with the deltas applied.
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            magic, version, self.bits, palette_size, self.flags, self.width, self.height, self.frame_count = \
+                HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION or not self.flags & FLAG_DELTA:
+                raise ValueError(f"{path} is not a delta-encoded grid sequence")
+            table = file.read(palette_size * 4)
+        self.color_lookup = {chr(table[i]): tuple(table[i + 1:i + 4]) for i in range(0, len(table), 4)}
+        self.data_offset = HEADER.size + len(table)
+        self.position_dtype = _position_dtype(self.width, self.height)
+
+    def __len__(self):
+        return self.frame_count
+
+    def records(self):
+        cells = self.width * self.height
+        with open(self.path, 'rb') as file:
+            file.seek(self.data_offset)
+            for _ in range(self.frame_count):
+                kind, duration_ms = RECORD.unpack(file.read(RECORD.size))
+                if kind == KEY_FRAME:
+                    packed = np.frombuffer(file.read(frame_bytes(cells, 1, self.bits)), dtype=np.uint8)
+                    yield kind, duration_ms, None, unpack_indices(packed, cells, self.bits)
+                else:
+                    (count,) = CHANGE_COUNT.unpack(file.read(CHANGE_COUNT.size))
+                    positions = np.frombuffer(file.read(count * self.position_dtype.itemsize), dtype=self.position_dtype)
+                    packed = np.frombuffer(file.read(frame_bytes(count, 1, self.bits)), dtype=np.uint8)
+                    yield kind, duration_ms, positions, unpack_indices(packed, count, self.bits)
+
+    def __iter__(self):
+        current = np.zeros(self.width * self.height, dtype=np.uint8)
+        for _, duration_ms, positions, values in self.records():
+            if positions is None:
+                current[:] = values
+            else:
+                current[positions] = values
+            yield current.reshape(self.height, self.width).copy(), duration_ms
+
+def read_grid(path, frame=0):
+    grid = GridFile(path)
+    return grid.frame(frame), grid.color_lookup
+
+def write_litebrite_txt(path, indices, color_lookup):
+    # Same layout as convert19.save_color_data_to_txt(..., is_litebrite=True)
+    keys = np.array(list(color_lookup.keys()))
+    with open(path, 'w') as file:
+        file.write('# Lite Brite Color Lookup:\n')
+        for key, value in color_lookup.items():
+            file.write(f'{key}: {value}\n')
+        file.write('\n# Grid:\n')
+        for row in keys[np.asarray(indices)]:
+            file.write(''.join(row) + '\n')
+
+def read_litebrite_txt(path):
+    color_lookup = {}
+    rows = []
+    section = None
+    with open(path) as file:
+        for line in file:
+            line = line.rstrip('\n')
+            if line.startswith('#'):
+                section = 'grid' if 'Grid' in line else 'lookup'
+            elif section == 'lookup' and line:
+                key, value = line.split(': ', 1)
+                color_lookup[key] = tuple(int(channel) for channel in ast.literal_eval(value))
+            elif section == 'grid' and line:
+                rows.append(line)
+    positions = np.full(256, 255, dtype=np.uint8)
+    for i, key in enumerate(color_lookup):
+        positions[ord(key)] = i
+    if not rows:
+        return np.zeros((0, 0), dtype=np.uint8), color_lookup
+    codes = np.frombuffer(''.join(rows).encode('ascii'), dtype=np.uint8).reshape(len(rows), len(rows[0]))
+    indices = positions[codes]
+    if (indices == 255).any():
+        raise ValueError(f"{path} uses characters missing from its colour lookup")
+    return indices, color_lookup
+
+def txt_to_grid(txt_path, grid_path):
+    indices, color_lookup = read_litebrite_txt(txt_path)
+    write_grid(grid_path, indices, color_lookup)
+
+def grid_to_txt(grid_path, txt_path, frame=0):
+    indices, color_lookup = read_grid(grid_path, frame)
+    write_litebrite_txt(txt_path, indices, color_lookup)
+
+def grid_frames(path, hold_ms=2000):
+    # (indices, color_lookup, duration_ms) of every frame of a converted grid: a
+    # *_litebrite.txt or .lbg board (shown for hold_ms) or a delta-encoded sequence
+    if not path.endswith(EXTENSION):
+        indices, color_lookup = read_litebrite_txt(path)
+        yield indices, color_lookup, hold_ms
+        return
+    with open(path, 'rb') as file:
+        flags = HEADER.unpack(file.read(HEADER.size))[4]
+    if flags & FLAG_DELTA:
+        sequence = SequenceReader(path)
+        for indices, duration_ms in sequence:
+            yield indices, sequence.color_lookup, duration_ms
+    else:
+        grid = GridFile(path)
+        for frame in range(len(grid)):
+            yield grid.frame(frame), grid.color_lookup, hold_ms
+
+def list_grids(directory):
+    # Converted grids in a directory by name; a *_litebrite.txt is skipped when the
+    # same grid is there as .lbg too, as convert19 writes both by default
+    names = sorted(os.listdir(directory))
+    binary = {os.path.splitext(name)[0] for name in names if name.endswith(EXTENSION)}
+    return [os.path.join(directory, name) for name in names
+            if name.endswith(EXTENSION) or (name.endswith('_litebrite.txt') and name[:-4] not in binary)]
+
+def merge_palettes(lookups):
+    # One colour lookup with every colour of `lookups`, merged by RGB (keys are kept
+    # unless they clash), and for each lookup the remap of its indices into it
+    merged = {}
+    indices = {}
+    remaps = []
+    for lookup in lookups:
+        remap = np.zeros(max(len(lookup), 1), dtype=np.uint8)
+        for i, (key, color) in enumerate(lookup.items()):
+            color = tuple(color)
+            if color not in indices:
+                if key in merged:
+                    key = next((chr(c) for c in range(33, 127) if chr(c) not in merged), None)
+                    if key is None:
+                        raise ValueError("Too many distinct colours to merge into one palette")
+                indices[color] = len(merged)
+                merged[key] = color
+            remap[i] = indices[color]
+        remaps.append(remap)
+    return merged, remaps
+
+def fit_grid(indices, width, height, background):
+    # indices centred on a width x height grid of background, cropped where they overhang
+    fitted = np.full((height, width), background, dtype=np.uint8)
+    rows, cols = indices.shape
+    top, left = (height - rows) // 2, (width - cols) // 2
+    src_y, src_x = max(-top, 0), max(-left, 0)
+    dst_y, dst_x = max(top, 0), max(left, 0)
+    h, w = min(rows - src_y, height - dst_y), min(cols - src_x, width - dst_x)
+    if h > 0 and w > 0:
+        fitted[dst_y:dst_y + h, dst_x:dst_x + w] = indices[src_y:src_y + h, src_x:src_x + w]
+    return fitted
+
+def pack_directory(directory, path, width=32, height=32, hold_ms=2000, keyframe_interval=0):
+    # Packs every converted grid in `directory` into one delta-encoded sequence for
+    # litebrite_player.py: one merged palette, every frame fitted to width x height
+    # (centred, padded with black), still boards shown for hold_ms and at a pixel
+    # size (device_bits) the player reads into a Bitmap directly. Returns the
+    # number of frames written.
+    paths = list_grids(directory)
+    if not paths:
+        raise ValueError(f"No converted grids in {directory}")
+    frames = [frame for grid in paths for frame in grid_frames(grid, hold_ms)]
+    lookups = []
+    for _, lookup, _ in frames:
+        if not lookups or lookup is not lookups[-1]:
+            lookups.append(lookup)
+    padded = any(indices.shape != (height, width) for indices, _, _ in frames)
+    if padded:
+        lookups.append({'K': (0, 0, 0)})  # Merged away if black is already there
+    color_lookup, remaps = merge_palettes(lookups)
+    background = remaps[-1][0] if padded else 0
+    bits = device_bits(len(color_lookup))
+    remap = iter(remaps)
+    current = None
+    with SequenceWriter(path, width, height, color_lookup, keyframe_interval, bits) as writer:
+        for indices, lookup, duration_ms in frames:
+            if lookup is not current:
+                current, table = lookup, next(remap)
+            writer.write(fit_grid(table[indices], width, height, background), duration_ms)
+    return len(frames)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 3 or argv[0] not in ('txt2bin', 'bin2txt', 'pack'):
+        print(f"usage: {os.path.basename(sys.argv[0])} txt2bin|bin2txt|pack SOURCE DESTINATION", file=sys.stderr)
+        return 2
+    command, source, destination = argv
+    if command == 'txt2bin':
+        txt_to_grid(source, destination)
+    elif command == 'pack':
+        frames = pack_directory(source, destination)
+        print(f"Packed {frames} frames from {source} into {destination}")
+    else:
+        grid_to_txt(source, destination)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
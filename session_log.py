@@ -0,0 +1,248 @@
+import struct
+import sys
+
+from tilt_input import MOVE, ROTATE, load_trace, synthetic_trace
+
+# Record and replay of Tetris sessions. A session is the seed the game's random
+# module was given plus every input the game acted on, stamped with the number of
+# the simulation tick that handled it; since the game logic runs on tick counts
+# rather than wall time, feeding the same inputs back on the same ticks rebuilds
+# the same sequence of boards. The log also carries a hash of the board at every
+# spawn, so a replay checks itself as it goes.
+#
+# File layout (little-endian): a header, then 5-byte records of tick delta (u16,
+# since the previous record), record kind (u8) and value (i16). Long quiet spells
+# are bridged with REC_WAIT records; REC_END marks the last tick of the session.
+#
+# Replays run at real time on the device; on a desktop they run under
+# host_emulation, either in real time or as fast as possible, and the update time
+# of every tick is kept so a set of logs doubles as a frame-time benchmark:
+#
+#   python session_log.py record game.tlog --seconds 300 --seed 7 --autoplay
+#   python session_log.py replay game.tlog
+
+MAGIC = b'TLOG'
+VERSION = 1
+HEADER = '<4sBBBBIId'  # magic, version, width, height, flags, seed, tick in us, animation speed
+RECORD = '<HBh'
+RECORD_SIZE = 5
+FLAG_SKIP_ANIMATIONS = 0x01
+
+# Record kinds
+REC_END = 0
+REC_ROTATE = 1  # value: 1
+REC_MOVE = 2  # value: signed columns
+REC_DROP = 3  # value: forward tilt in 0.1 m/s^2, sets the soft-drop speed from this tick
+REC_CHECK = 4  # value: board_hash() of the board after a spawn on this tick
+REC_WAIT = 5  # no value; moves the tick on by its delta only
+
+def board_hash(rows):
+    # 16-bit hash of the board's row masks
+    value = 0
+    for y in range(len(rows)):
+        value = (value * 31 + rows[y]) & 0xFFFF
+    return value - 0x10000 if value >= 0x8000 else value  # Fits the i16 record value
+
+class SessionRecorder:
+    # Writes the inputs of a running game to a binary file object
+    def __init__(self, file, width, height, seed, tick, animation_speed=1.0, skip_animations=False):
+        self.file = file
+        self.buffer = bytearray(RECORD_SIZE)
+        self.last_tick = 0
+        self.records = 0
+        flags = FLAG_SKIP_ANIMATIONS if skip_animations else 0
+        file.write(struct.pack(HEADER, MAGIC, VERSION, width, height, flags, seed,
+                               int(round(tick * 1000000)), animation_speed))
+
+    def event(self, tick, kind, value):
+        # A tilt_input event the game handled on this tick
+        self.write(tick, REC_ROTATE if kind == ROTATE else REC_MOVE, value)
+
+    def drop(self, tick, level):
+        self.write(tick, REC_DROP, level)
+
+    def spawned(self, tick, rows):
+        self.write(tick, REC_CHECK, board_hash(rows))
+
+    def write(self, tick, kind, value=0):
+        delta = tick - self.last_tick
+        while delta > 0xFFFF:
+            self._write(0xFFFF, REC_WAIT, 0)
+            delta -= 0xFFFF
+        self._write(delta, kind, value)
+        self.last_tick = tick
+
+    def _write(self, delta, kind, value):
+        struct.pack_into(RECORD, self.buffer, 0, delta, kind, value)
+        self.file.write(self.buffer)
+        self.records += 1
+
+    def close(self, tick):
+        # tick: the last tick the game ran
+        self.write(tick, REC_END)
+        self.file.close()
+
+class SessionReplay:
+    # A recorded session, read whole. Also stands in for the game's tilt sensor,
+    # one that never produces samples, since replayed input arrives via feed().
+    def __init__(self, data):
+        if isinstance(data, str):
+            with open(data, 'rb') as file:
+                data = file.read()
+        header = struct.calcsize(HEADER)
+        magic, version, self.width, self.height, flags, self.seed, tick_us, self.animation_speed = \
+            struct.unpack_from(HEADER, data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a version 1 session log")
+        self.skip_animations = bool(flags & FLAG_SKIP_ANIMATIONS)
+        self.tick = tick_us / 1000000
+        self.data = data
+        self.position = header
+        self.next_tick = 0
+        self.drop = 0
+        self.expected = None  # Board hash due on this tick, if any
+        self.finished = False
+        self.checks = 0
+        self.mismatches = 0
+        self.first_mismatch = None
+        # Walk the records once for the length, then keep per-tick update times
+        # (10 us units, u16) in a buffer allocated up front
+        tick_count = 0
+        for position in range(header, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+            tick_count += data[position] | data[position + 1] << 8
+        self.ticks = tick_count
+        self.times = bytearray(2 * tick_count)
+        self.timed = 0
+        self._peek()
+
+    def _peek(self):
+        # Tick of the next record, or None past the end
+        if self.position + RECORD_SIZE <= len(self.data):
+            self.next_tick += self.data[self.position] | self.data[self.position + 1] << 8
+        else:
+            self.next_tick = None
+
+    def read(self, callback):
+        pass
+
+    def feed(self, tick, tilt, now):
+        # Applies the records for `tick`: events go onto tilt's ring, to be handled
+        # exactly as live ones were. Decoded by hand, as unpacking builds tuples.
+        if self.expected is not None:
+            # The spawn recorded for the previous tick did not happen
+            self.checks += 1
+            self.mismatch(tick - 1)
+            self.expected = None
+        while self.next_tick == tick:
+            kind = self.data[self.position + 2]
+            value = self.data[self.position + 3] | self.data[self.position + 4] << 8
+            if value >= 0x8000:
+                value -= 0x10000
+            if kind == REC_ROTATE:
+                tilt.push(ROTATE, value, now)
+            elif kind == REC_MOVE:
+                tilt.push(MOVE, value, now)
+            elif kind == REC_DROP:
+                self.drop = value
+            elif kind == REC_CHECK:
+                self.expected = value
+            elif kind == REC_END:
+                self.finished = True
+            self.position += RECORD_SIZE
+            self._peek()
+
+    def spawned(self, tick, rows):
+        self.checks += 1
+        if board_hash(rows) != self.expected:
+            self.mismatch(tick)
+        self.expected = None
+
+    def mismatch(self, tick):
+        self.mismatches += 1
+        if self.first_mismatch is None:
+            self.first_mismatch = tick
+
+    def add_tick_time(self, seconds):
+        if self.timed < self.ticks:
+            struct.pack_into('<H', self.times, 2 * self.timed, min(0xFFFF, int(seconds * 100000)))
+            self.timed += 1
+
+    def tick_times(self):
+        # Update time of every replayed tick in ms
+        return [struct.unpack_from('<H', self.times, 2 * i)[0] / 100 for i in range(self.timed)]
+
+    def report(self):
+        times = sorted(self.tick_times())
+        if times:
+            def percentile(p):
+                return times[min(len(times) - 1, int(p * len(times)))]
+            timing = (f", update {sum(times) / len(times):.2f} ms mean, p50 {percentile(0.5):.2f}, "
+                      f"p95 {percentile(0.95):.2f}, p99 {percentile(0.99):.2f}, max {times[-1]:.2f} ms")
+        else:
+            timing = ""
+        if self.mismatches:
+            verdict = f"{self.mismatches}/{self.checks} board checks FAILED (first on tick {self.first_mismatch})"
+        else:
+            verdict = f"{self.checks} board checks passed"
+        return f"replayed {self.timed}/{self.ticks} ticks, {verdict}{timing}"
+
+def replay_game(replay, **options):
+    # A TetrisGame set up from the log's header and driven by it
+    from tetris import TetrisGame
+    return TetrisGame(replay.width, replay.height, replay.animation_speed, replay.skip_animations,
+                      seed=replay.seed, replay=replay, **options)
+
+def main(argv=None):
+    import argparse
+    import host_emulation
+    parser = argparse.ArgumentParser(description='Record or replay a Tetris session on the desktop.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='play a session under emulation and log it')
+    record.add_argument('log', help='session log to write')
+    record.add_argument('--seconds', type=float, default=300.0, help='virtual seconds to play')
+    record.add_argument('--seed', type=int, default=None, help='seed for the pieces (default: random)')
+    record.add_argument('--tilt', default=None, help='accelerometer trace, or "synthetic"')
+    record.add_argument('--autoplay', action='store_true', help='let the placement search play')
+    replay = commands.add_parser('replay', help='replay a session log')
+    replay.add_argument('log', help='session log to read')
+    replay.add_argument('--realtime', action='store_true', help='keep to the tick rate instead of running flat out')
+    replay.add_argument('--times', default=None, help='write the per-tick update times (ms) to this file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        tilt = None
+        if args.tilt == 'synthetic':
+            tilt = synthetic_trace()
+        elif args.tilt:
+            tilt = load_trace(args.tilt)
+        emulator = host_emulation.Emulator(args.seconds, tilt=tilt)
+        emulator.install()
+        try:
+            from tetris import TetrisGame
+            game = TetrisGame(10, 20, seed=args.seed, autoplay=args.autoplay)
+            game.record(open(args.log, 'wb'))
+            stats = emulator.run(game.game_loop)
+            game.recorder.close(game.ticks)
+        finally:
+            emulator.uninstall()
+        print(f"Recorded {game.ticks} ticks ({stats['virtual_seconds']:.1f}s) of seed {game.seed} to {args.log}: "
+              f"{game.recorder.records} records, {game.engine.pieces} pieces, {game.engine.lines} lines")
+        return 0
+
+    session = SessionReplay(args.log)
+    emulator = host_emulation.Emulator(realtime=args.realtime)
+    emulator.install()
+    try:
+        game = replay_game(session)
+        stats = emulator.run(game.game_loop)
+    finally:
+        emulator.uninstall()
+    print(f"{args.log}: {session.report()}; {stats['elapsed']:.2f}s wall, {stats['frames']} refreshes")
+    if args.times:
+        with open(args.times, 'w') as file:
+            for milliseconds in session.tick_times():
+                file.write(f"{milliseconds:.2f}\n")
+    return 1 if session.mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,84 +1,27 @@
-import time
 import board
 import displayio
 import busio
-import adafruit_lis3dh
 import random
+import adafruit_lis3dh
 from adafruit_matrixportal.matrix import Matrix
+from frame_scheduler import AllocationProbe, Animator, FrameScheduler
+from tetris_engine import FIRST_ROTATION, ROTATIONS, TetrisEngine
+from tilt_input import MOVE, ROTATE, LIS3DHFifo, TiltInput
 
 class ScoreDisplay:
-    DIGITS = {
-        0: [
-            [1, 1, 1],
-            [1, 0, 1],
-            [1, 0, 1],
-            [1, 0, 1],
-            [1, 1, 1],
-        ],
-        1: [
-            [0, 1, 0],
-            [0, 1, 0],
-            [0, 1, 0],
-            [0, 1, 0],
-            [0, 1, 0],
-        ],
-        2: [
-            [1, 1, 1],
-            [0, 0, 1],
-            [1, 1, 1],
-            [1, 0, 0],
-            [1, 1, 1],
-        ],
-        3: [
-            [1, 1, 1],
-            [0, 0, 1],
-            [1, 1, 1],
-            [0, 0, 1],
-            [1, 1, 1],
-        ],
-        4: [
-            [1, 0, 1],
-            [1, 0, 1],
-            [1, 1, 1],
-            [0, 0, 1],
-            [0, 0, 1],
-        ],
-        5: [
-            [1, 1, 1],
-            [1, 0, 0],
-            [1, 1, 1],
-            [0, 0, 1],
-            [1, 1, 1],
-        ],
-        6: [
-            [1, 1, 1],
-            [1, 0, 0],
-            [1, 1, 1],
-            [1, 0, 1],
-            [1, 1, 1],
-        ],
-        7: [
-            [1, 1, 1],
-            [0, 0, 1],
-            [0, 0, 1],
-            [0, 1, 0],
-            [0, 1, 0],
-        ],
-        8: [
-            [1, 1, 1],
-            [1, 0, 1],
-            [1, 1, 1],
-            [1, 0, 1],
-            [1, 1, 1],
-        ],
-        9: [
-            [1, 1, 1],
-            [1, 0, 1],
-            [1, 1, 1],
-            [0, 0, 1],
-            [1, 1, 1],
-        ],
-    }
+    # 3x5 digit glyphs, one byte per row with bit 2 as the left column
+    GLYPHS = bytes((
+        0b111, 0b101, 0b101, 0b101, 0b111,  # 0
+        0b010, 0b010, 0b010, 0b010, 0b010,  # 1
+        0b111, 0b001, 0b111, 0b100, 0b111,  # 2
+        0b111, 0b001, 0b111, 0b001, 0b111,  # 3
+        0b101, 0b101, 0b111, 0b001, 0b001,  # 4
+        0b111, 0b100, 0b111, 0b001, 0b111,  # 5
+        0b111, 0b100, 0b111, 0b101, 0b111,  # 6
+        0b111, 0b001, 0b001, 0b010, 0b010,  # 7
+        0b111, 0b101, 0b111, 0b101, 0b111,  # 8
+        0b111, 0b101, 0b111, 0b001, 0b111,  # 9
+    ))
 
     def __init__(self, display, palette):
         self.bitmap = displayio.Bitmap(7, 5, len(palette))
@@ -92,10 +35,10 @@ class ScoreDisplay:
         self.update_score()
 
     def draw_digit(self, digit, offset):
-        pattern = self.DIGITS[digit]
-        for y, row in enumerate(pattern):
-            for x, pixel in enumerate(row):
-                self.bitmap[offset + x, y] = 3 if pixel else 0
+        for y in range(5):
+            row = self.GLYPHS[digit * 5 + y]
+            for x in range(3):
+                self.bitmap[offset + x, y] = 3 if row >> (2 - x) & 1 else 0
 
     def update_score(self):
         tens = self.score // 10
@@ -126,7 +69,8 @@ class NextUp:
         self.group.x = 1  # Position on the screen
         self.group.y = 5
 
-    def display_piece(self, shape):
+    def display_piece(self, offset):
+        # offset: the rotation to show in tetris_engine.ROTATIONS
         # Clear the grid
         for x in range(self.width):
             for y in range(self.height):
@@ -135,60 +79,51 @@ class NextUp:
         # Draw the piece shape shifted right by 2 columns
         shape_x_offset = (self.width // 2) - 2 + 2  # Shift right by 2
         shape_y_offset = (self.height // 2) - 2
-        for dx, dy in shape:
-            self.bitmap[shape_x_offset + dx, shape_y_offset + dy] = 2  # Draw using third color
-
-
-class Piece:
-    def __init__(self, shapes, x, y, game_width, game_min_x, game_max_x):
-        self.shapes = shapes
-        self.x = x
-        self.y = y
-        self.rotation_index = 0
-        self.game_width = game_width
-        self.game_min_x = game_min_x
-        self.game_max_x = game_max_x
-
-
-    def rotate(self):        
-        self.rotation_index = (self.rotation_index + 1) % len(self.shapes)
-        new_width = self.get_width()        
-
-        # Adjust for width
-        if self.x + new_width > self.game_max_x:
-            self.x = self.game_max_x - new_width
-
-        return self.shapes[self.rotation_index]
-
-
-    def get_current_shape(self):
-        return self.shapes[self.rotation_index]
-
-    def get_width(self):
-        current_shape = self.get_current_shape()
-        min_x = min(x for x, _ in current_shape)
-        max_x = max(x for x, _ in current_shape)        
-        return max_x - min_x + 1
-
-    def get_height(self):
-        current_shape = self.get_current_shape()
-        min_y = min(y for _, y in current_shape)
-        max_y = max(y for _, y in current_shape)
-        return max_y - min_y + 1
+        for dy in range(ROTATIONS[offset + 1]):
+            row = ROTATIONS[offset + 2 + dy]
+            for dx in range(ROTATIONS[offset]):
+                if row >> dx & 1:
+                    self.bitmap[shape_x_offset + dx, shape_y_offset + dy] = 2  # Draw using third color
 
 
 class TetrisGame:
+    TICK = 0.02  # Simulation step: input is sampled and gravity checked once per tick
+    MAX_FPS = 30  # Refresh cap; the display is only refreshed when something changed
+    SAMPLE_RATE = 100  # Accelerometer data rate in Hz, drained from its FIFO every tick
     
-    def __init__(self, width, height):
+    def __init__(self, width, height, animation_speed=1.0, skip_animations=False, sensor=None, autoplay=False,
+                 seed=None, rng=random, replay=None):
+        # sensor: anything with read(callback) (see tilt_input); default is the LIS3DH FIFO
+        # autoplay: attract mode, the placement search feeds moves in as tilt events
+        # seed: seeds rng (anything with seed() and randrange()), a fresh seed if None
+        # replay: a session_log.SessionReplay to take the input from instead of the sensor
+        self.scheduler = FrameScheduler(self.TICK, self.MAX_FPS)
+        # Game logic runs on the tick count, not the clock, so a replay lands on the
+        # same ticks; line clears and game over play as cooperative tasks on it too
+        self.ticks = 0
+        self.animator = Animator(lambda: self.ticks * self.TICK, animation_speed, skip_animations)
+        self.seed = rng.getrandbits(32) if seed is None else seed
+        rng.seed(self.seed)
+        self.replay = replay
+        self.recorder = None
+        self.drop_level = 0  # Forward tilt in 0.1 m/s^2 steps, so that logs replay it exactly
+        self.tilt_downwards = 0.0
+        # Rotation offset and bitmap position of the piece as drawn, offset None when none is
+        self.drawn_offset = None
+        self.drawn_left = 0
+        self.drawn_top = 0
         self.setup_palette()
         self.setup_display(width, height)
         self.setup_game_board(width, height)
-        self.setup_controls()
-        self.pieces = self.load_pieces()
+        self.setup_controls(replay if replay is not None else sensor)
+        self.engine = TetrisEngine(width, height, rng)  # Board model; the bitmap is drawn from it
+        self.autoplayer = None
+        if autoplay and replay is None:
+            from tetris_bot import AutoPlayer  # Only compiled onto the heap when used
+            self.autoplayer = AutoPlayer(self)
+        self.shown_rows = [0] * height  # Board rows as last drawn into the bitmap
         self.next_piece_preview = NextUp(8, 8, self.palette)  # Initialize the NextUp display
         self.display.root_group.append(self.next_piece_preview.group)  # Add NextUp display to the main group
-        self.next_piece = self.get_random_piece()  # Initialize the next piece
-        self.current_piece = self.new_piece()  # Initialize the current piece
         self.update_next_piece_display()  # Display the next piece
         self.score_display = ScoreDisplay(self.display, self.palette)
 
@@ -218,197 +153,116 @@ class TetrisGame:
         self.end_y = self.start_y + height
         self.draw_border()
 
-    def setup_controls(self):
-        self.i2c = busio.I2C(board.SCL, board.SDA)
-        self.accelerometer = adafruit_lis3dh.LIS3DH_I2C(self.i2c, address=0x19)
-        self.accelerometer.range = adafruit_lis3dh.RANGE_2_G
+    def setup_controls(self, sensor=None):
+        if sensor is None:
+            self.i2c = busio.I2C(board.SCL, board.SDA)
+            self.accelerometer = adafruit_lis3dh.LIS3DH_I2C(self.i2c, address=0x19)
+            self.accelerometer.range = adafruit_lis3dh.RANGE_2_G
+            sensor = LIS3DHFifo(self.accelerometer, self.SAMPLE_RATE)
+        self.tilt = TiltInput(sensor, self.SAMPLE_RATE)
 
-    def draw_border(self):
-        for y in range(self.start_y - 1, self.end_y + 1):
-            for x in range(self.game_min_x - 1, self.game_max_x + 1):
-                if x < self.game_min_x or x >= self.game_max_x or y < self.start_y or y >= self.end_y:
-                    self.bitmap[x, y] = 1  # Set border cells to blue
-
-
-    def load_pieces(self):
-        return {
-            'I': [[(0, 0), (0, 1), (0, 2), (0, 3)], [(0, 0), (1, 0), (2, 0), (3, 0)]],
-            'O': [[(0, 0), (1, 0), (0, 1), (1, 1)]],
-            'S': [[(1, 0), (2, 0), (0, 1), (1, 1)], [(0, 0), (0, 1), (1, 1), (1, 2)]],
-            'Z': [[(0, 0), (1, 0), (1, 1), (2, 1)], [(1, 0), (0, 1), (1, 1), (0, 2)]],
-            'J': [[(0, 0), (0, 1), (1, 1), (2, 1)], [(0, 0), (1, 0), (0, 1), (0, 2)], [(0, 0), (1, 0), (2, 0), (2, 1)], [(1, 0), (1, 1), (0, 2), (1, 2)]],
-            'L': [[(2, 0), (0, 1), (1, 1), (2, 1)], [(0, 0), (0, 1), (0, 2), (1, 2)], [(0, 0), (1, 0), (2, 0), (0, 1)], [(0, 0), (1, 0), (1, 1), (1, 2)]],
-            'T': [[(0, 1), (1, 1), (2, 1), (1, 0)], [(0, 0), (0, 1), (0, 2), (1, 1)], [(0, 0), (1, 0), (2, 0), (1, 1)], [(1, 0), (0, 1), (1, 1), (1, 2)]]
-        }
-    
     def draw_border(self):
         for y in range(self.start_y - 1, self.end_y + 1):  # Includes border thickness
             for x in range(self.game_min_x - 1, self.game_max_x + 1):  # Includes border thickness
                 if x < self.game_min_x or x >= self.game_max_x or y < self.start_y or y >= self.end_y:
                     self.bitmap[x, y] = 1  # Blue border
 
-    def get_random_piece(self):
-        return random.choice(list(self.pieces.keys()))
-
-    def new_piece(self):
-        # Set current piece to next piece and generate a new next piece
-        piece_shape = self.next_piece
-        self.next_piece = self.get_random_piece()  # Update the next piece
-        self.update_next_piece_display()  # Update the display of the next piece
-        return Piece(self.pieces[piece_shape], self.game_min_x + self.width // 2 - 2, self.start_y, self.width, self.game_min_x, self.game_max_x)
-
     def update_next_piece_display(self):
         # Update the next piece preview display
-        shape = self.pieces[self.next_piece][0]  # Get the first rotation of the next piece
-        self.next_piece_preview.display_piece(shape)
-
-    def draw_piece(self, erase=False):
-        shape = self.current_piece.get_current_shape()        
-        color_index = 0 if erase else 2        
-        
-        for dx, dy in shape:                       
-            x, y = self.current_piece.x + dx, self.current_piece.y + dy
-            if self.game_min_x <= x < self.game_max_x and self.start_y <= y < self.end_y:
-                self.bitmap[x, y] = color_index if not erase else 0
-
-    def check_collision(self, dx=0, dy=0):
-        #Check for collisions when the piece is moved by dx, dy.
-        shape = self.current_piece.get_current_shape()
-        for offset_x, offset_y in shape:
-            # Calculate new position with the given delta x (dx) and delta y (dy)
-            new_x = self.current_piece.x + offset_x + dx
-            new_y = self.current_piece.y + offset_y + dy
-
-            # Check for collisions with the boundaries
-            if new_x < self.game_min_x or new_x >= self.game_max_x or new_y >= self.end_y:
-                return True
-
-            # Check for collisions with other blocks
-            if new_y >= 0 and self.bitmap[new_x, new_y] != 0:  # Ensure the y-index is within the grid
-                return True
-
-        return False
-
-    def clear_full_lines(self):
-        full_lines = []
-        for y in range(self.start_y, self.end_y):
-            if all(self.bitmap[x, y] == 3 for x in range(self.game_min_x, self.game_max_x)):
-                full_lines.append(y)
-
-        num_lines_cleared = len(full_lines)
-        
-        if num_lines_cleared > 0:
-            self.score_display.increment_score(num_lines_cleared)  # Move score increment here
+        self.next_piece_preview.display_piece(FIRST_ROTATION[self.engine.next_kind])
+        self.scheduler.mark_dirty()
+
+    def render_board(self):
+        # Copy the frozen cells of the model into the bitmap, touching only rows that changed
+        for y in range(self.height):
+            row = self.engine.board.rows[y]
+            if row == self.shown_rows[y]:
+                continue
+            for x in range(self.width):
+                self.bitmap[self.game_min_x + x, self.start_y + y] = 3 if row >> x & 1 else 0
+            self.shown_rows[y] = row
+            self.scheduler.mark_dirty()
+
+    def paint_piece(self, offset, left, top, color):
+        # Straight from the rotation's row masks, so drawing builds no cell lists
+        for dy in range(ROTATIONS[offset + 1]):
+            row = ROTATIONS[offset + 2 + dy]
+            for dx in range(ROTATIONS[offset]):
+                if row >> dx & 1:
+                    self.bitmap[left + dx, top + dy] = color
+        self.scheduler.mark_dirty()
+
+    def draw_piece(self):
+        self.drawn_offset = self.engine.offset
+        self.drawn_left = self.game_min_x + self.engine.x
+        self.drawn_top = self.start_y + self.engine.y
+        self.paint_piece(self.drawn_offset, self.drawn_left, self.drawn_top, 2)
+
+    def erase_piece(self):
+        if self.drawn_offset is None:
+            return
+        self.paint_piece(self.drawn_offset, self.drawn_left, self.drawn_top, 0)
+        self.drawn_offset = None
+
+    def sync_piece(self):
+        # Redraw the falling piece only if it moved, rotated or was replaced
+        if (self.drawn_offset != self.engine.offset or self.drawn_left != self.game_min_x + self.engine.x
+                or self.drawn_top != self.start_y + self.engine.y):
+            self.erase_piece()
+            self.draw_piece()
 
-        for _ in range(num_lines_cleared):
+    def clear_full_lines(self, full_lines):
+        # Animation task: flash the full rows, then collapse them
+        for _ in range(len(full_lines)):
             for color in [1, 0]:
                 for y in full_lines:
                     for x in range(self.game_min_x, self.game_max_x):
-                        self.bitmap[x, y] = color
-                self.display.refresh()
-                time.sleep(0.25)
-        
-        if full_lines:
-            lowest_full_line = min(full_lines)
-            highest_full_line = max(full_lines)
-
-            for y in range(highest_full_line, self.start_y - 1, -1):
-                source_y = y - num_lines_cleared
-                if source_y >= self.start_y:
-                    for x in range(self.game_min_x, self.game_max_x):
-                        self.bitmap[x, y] = self.bitmap[x, source_y]
-                else:
-                    for x in range(self.game_min_x, self.game_max_x):
-                        self.bitmap[x, y] = 0
-
-            self.display.refresh()
-
+                        self.bitmap[x, self.start_y + y] = color
+                self.scheduler.mark_dirty()
+                yield 0.25
+        self.engine.collapse(full_lines)
+        self.render_board()
 
     def freeze_piece(self):
-        shape = self.current_piece.get_current_shape()
-        for dx, dy in shape:
-            x, y = self.current_piece.x + dx, self.current_piece.y + dy
-            if self.game_min_x <= x < self.game_max_x and self.start_y <= y < self.end_y:
-                self.bitmap[x, y] = 3  # Change to green when frozen
-        self.clear_full_lines()
+        # Animation task covering everything from locking the piece to spawning the next
+        self.erase_piece()
+        full_lines = self.engine.lock()
+        self.render_board()  # Frozen cells turn white
+        if full_lines:
+            self.score_display.increment_score(len(full_lines))
+            self.scheduler.mark_dirty()
+            yield from self.clear_full_lines(full_lines)
+        if self.check_game_over():
+            yield from self.game_over()
+        self.engine.spawn()
+        if self.recorder is not None:
+            self.recorder.spawned(self.ticks, self.engine.board.rows)
+        elif self.replay is not None:
+            self.replay.spawned(self.ticks, self.engine.board.rows)
+        self.update_next_piece_display()
 
     def move_down(self):
-        if not self.check_collision(dy=1):
-            self.current_piece.y += 1
-        else:
-            self.freeze_piece()
-            if self.check_game_over():
-                self.game_over_animation()
-                return  # Optionally restart the game or end the game session
-            self.current_piece = self.new_piece()
+        if not self.engine.fall():
+            self.animator.start(self.freeze_piece())
 
     def check_game_over(self):
-        # Check if any block in the top row is filled (excluding the borders if any)
-        for x in range(self.game_min_x, self.game_max_x):
-            if self.bitmap[x, self.start_y] != 0:  # Assuming start_y is the first playable row
-                self.game_over()
-                break
+        # Check if any block in the top row is filled
+        return self.engine.board.top_out()
 
     def game_over(self):
-        # Go through each cell from top to bottom, erasing only colored cells
+        # Animation task: go through each cell from top to bottom, erasing only colored cells
         for y in range(self.start_y, self.end_y):
             for x in range(self.game_min_x, self.game_max_x):
                 if self.bitmap[x, y] != 0:  # Check if the cell is filled
                     self.bitmap[x, y] = 0  # Erase the block
-                    self.display.refresh()
-                    time.sleep(0.1)  # Faster erasure time
-        # Optionally, reset the game or end the game session here
-
-    def game_over_animation(self):
-        for y in range(self.end_y - 1, self.start_y - 1, -1):  # From bottom to top
-            for x in range(self.game_min_x, self.game_max_x):
-                self.bitmap[x, y] = 0  # Clear the cell
-                self.display.refresh()
-                time.sleep(0.1)  # Delay to visualize the clearing process
-
-
-    def move_piece(self, x):
-        current_time = time.monotonic()
-        if current_time - self.last_move_time <= self.rotate_interval:
-            return
-        
-        #move = int(x / 2)
-        move = int((x / 2)**2) * (1 if x > 0 else -1)
-        new_x = self.current_piece.x + move
-
-        if move > 0:  # Moving right
-            self.move_right(new_x)
-        elif move < 0:  # Moving left
-            self.move_left(new_x)
-        self.last_move_time = current_time
-
-    def move_left(self, new_x): 
-        if not self.check_collision(dx=-1):
-            self.current_piece.x = max(new_x, self.game_min_x)
-
-    def move_right(self, new_x):  
-        if not self.check_collision(dx=1):      
-            right_bound = self.game_max_x - self.get_piece_width()
-            self.current_piece.x = min(new_x, right_bound)
+                    self.scheduler.mark_dirty()
+                    yield 0.1  # Faster erasure time
+        self.engine.board.clear()
+        self.engine.games += 1
+        self.render_board()
 
     def rotate_piece(self):
-        original_rotation = self.current_piece.rotation_index
-        self.current_piece.rotate()
-        if self.check_collision():  # Check collision after rotation with no dx, dy
-            self.current_piece.rotation_index = original_rotation  # Revert rotation if collision
-
-    def get_piece_width(self):
-        shape = self.current_piece.get_current_shape()
-        # Calculate the piece's span from the leftmost to the rightmost points
-        min_x = min(dx for dx, _ in shape)
-        max_x = max(dx for dx, _ in shape)
-        return max_x - min_x + 1  # Plus one to include the starting block
-
-    def try_rotate(self):
-        current_time = time.monotonic()
-        if current_time - self.last_rotate_time > self.rotate_interval:
-            self.rotate_piece()
-            self.last_rotate_time = current_time
+        self.engine.rotate()  # Kept only if the rotated piece fits
 
     def process_down_movement(self):        
         if self.tilt_downwards > 5:            
@@ -416,40 +270,90 @@ class TetrisGame:
         else:
             speed = self.base_speed
                 
-        current_time = time.monotonic()
-        
-        if current_time - self.last_down_time > speed:
+        if (self.ticks - self.last_down_tick) * self.TICK > speed:
             self.move_down()
-            self.last_down_time = current_time
+            self.last_down_tick = self.ticks
+
+    def record(self, file):
+        # Logs this game's seed and every input it handles from here on to a binary
+        # file object; see session_log
+        from session_log import SessionRecorder  # Only compiled onto the heap when used
+        self.recorder = SessionRecorder(file, self.width, self.height, self.seed, self.TICK,
+                                        self.animator.speed, self.animator.skip)
+
+    def update(self):
+        # One simulation tick
+        self.ticks += 1
+        now = self.scheduler.clock()
+        if self.replay is not None:
+            self.replay.feed(self.ticks, self.tilt, now)
+            level = self.replay.drop
+        else:
+            self.tilt.poll()
+            level = int(self.tilt.tilt_y * 10)
+        if level != self.drop_level:
+            # Filtered tilt sets the downward speed
+            self.drop_level = level
+            self.tilt_downwards = level / 10
+            if self.recorder is not None:
+                self.recorder.drop(self.ticks, level)
+
+        # There is no falling piece while a lock, line clear or game over animation
+        # plays, so events arriving meanwhile are dropped
+        self.animator.update()
+        busy = self.animator.busy
+        if self.autoplayer is not None and not busy:
+            self.autoplayer.update(now)
+        kind = self.tilt.next_event(now)
+        while kind is not None:
+            if self.recorder is not None:
+                self.recorder.event(self.ticks, kind, self.tilt.value)
+            if not busy:
+                if kind == ROTATE:
+                    self.rotate_piece()
+                elif kind == MOVE:
+                    self.engine.shift(self.tilt.value)
+            kind = self.tilt.next_event(now)
+
+        if not busy:
+            # Handle downward movement
+            self.process_down_movement()
 
-    def game_loop(self):
-        self.rotate_interval = 0.5  # Interval for rotation to prevent too frequent rotation
-        self.move_interval = 0.02 
-        self.tilt_coefficient = 0.1 
-        self.base_speed = 1.0
-        
-        self.last_down_time = time.monotonic()
-        self.last_rotate_time = time.monotonic()
-        self.last_move_time = time.monotonic()
+            self.sync_piece()
 
-        while True:
-            self.draw_piece(erase=True)
-            x, y, _ = self.accelerometer.acceleration
-            self.tilt_downwards = y  # Save the tilt value for downward movement speed adjustment
+        if self.stats_interval and self.scheduler.now - self.last_stats_time >= self.stats_interval:
+            print(self.scheduler.stats.report())
+            print(self.tilt.report())
+            self.scheduler.stats.reset()
+            self.last_stats_time = self.scheduler.now
 
-            # Check if it's time to rotate
-            if y < -3:
-                self.try_rotate()
+        probe = self.scheduler.probe
+        if probe is not None and probe.done:
+            print(probe.report())
+            self.scheduler.probe = None
 
-            # Handle left/right movement based on x-tilt
-            if abs(x) > 1.5:
-                self.move_piece(x)
+        if self.replay is not None and self.replay.finished:
+            self.scheduler.stop()
 
-            # Handle downward movement
-            self.process_down_movement()
+    def game_loop(self, stats_interval=None, alloc_probe=None):
+        # stats_interval: print frame-time statistics every this many seconds
+        # alloc_probe: measure heap allocation over this many ticks (CircuitPython only)
+        self.tilt_coefficient = 0.1 
+        self.base_speed = 1.0
+        self.stats_interval = stats_interval
+        if alloc_probe:
+            self.scheduler.probe = AllocationProbe(alloc_probe)
 
-            self.draw_piece()
-            self.display.refresh()
+        if self.replay is not None:
+            self.scheduler.on_tick = self.replay.add_tick_time
+
+        self.scheduler.start()
+        self.last_down_tick = self.ticks
+        self.last_stats_time = self.scheduler.now
+
+        self.draw_piece()
+        self.scheduler.run(self.update, self.display)
             
-game = TetrisGame(10, 20)
-game.game_loop()
+if __name__ == '__main__':
+    game = TetrisGame(10, 20)
+    game.game_loop()
@@ -0,0 +1,255 @@
+import random
+
+from tetris_engine import FELL, FIRST_ROTATION, ROTATION_COUNT, ROTATION_SIZE, ROTATIONS, Board, TetrisEngine, _clock
+from tilt_input import MOVE, ROTATE
+
+# Placement search for self-play: attract mode on the display and soak tests of the
+# engine. For the falling piece (and, with lookahead, the next one) it tries every
+# final position reachable the way a player gets there -- rotate at the spawn row,
+# slide sideways, let it drop -- and scores the settled board with the usual
+# linear heuristic over aggregate height, cleared lines, holes and bumpiness. The
+# search works on the engine's row bitmasks in preallocated scratch boards, so it
+# runs unchanged (and without allocating per placement) on CircuitPython.
+
+WEIGHTS = {'height': -0.51, 'lines': 0.76, 'holes': -0.36, 'bumpiness': -0.18}
+TOPPED_OUT_SCORE = -1e9
+
+def popcounts(bits):
+    # Set bits of every value below 1 << bits, for counting holes a row at a time
+    table = bytearray(1 << bits)
+    for value in range(1, len(table)):
+        table[value] = table[value >> 1] + (value & 1)
+    return bytes(table)
+
+class PlacementSearch:
+    def __init__(self, width=10, height=20, weights=None, lookahead=True):
+        weights = dict(WEIGHTS, **(weights or {}))
+        self.height_weight = weights['height']
+        self.lines_weight = weights['lines']
+        self.holes_weight = weights['holes']
+        self.bumpiness_weight = weights['bumpiness']
+        self.depth = 2 if lookahead else 1
+        self.spawn_x = width // 2 - 2  # As TetrisEngine.spawn()
+        self.scratch = [Board(width, height) for _ in range(self.depth)]
+        self.heights = [0] * width
+        self.popcount = popcounts(width)
+        self.evaluated = 0
+        # Enumeration cursor per depth: kind, rotation index, its offset in
+        # ROTATIONS, column after rotating, column tried now and slide direction
+        self.kinds = [0] * self.depth
+        self.rotation_at = [0] * self.depth
+        self.offsets = [0] * self.depth
+        self.rotated_at = [0] * self.depth
+        self.targets = [0] * self.depth
+        self.steps = [0] * self.depth
+        self.board = None  # Search in progress for begin()/resume()
+        self.next_kind = None
+        self.pending = False
+        # Best move of the last best_move() call: rotate presses, column after
+        # rotating (before sliding), target column
+        self.rotations = 0
+        self.rotated_x = 0
+        self.x = 0
+        self.score = 0.0
+
+    def best_move(self, board, kind, next_kind=None):
+        # Sets rotations (presses of rotate from the spawn rotation), x and score for
+        # the best placement of `kind` on `board`; False if the spawn is blocked
+        self.score = None
+        self.search(board, kind, next_kind, 0, 0)
+        return self.score is not None
+
+    def begin(self, board, kind, next_kind=None):
+        # best_move() in instalments: starts the search, which resume() then runs a
+        # few placements at a time; False if the spawn is blocked
+        self.score = None
+        self.board = board
+        self.next_kind = next_kind
+        self.pending = self.start(board, kind, 0)
+        return self.pending
+
+    def resume(self, budget):
+        # Scores up to `budget` more placements of the search begun by begin() (each
+        # with its whole search of the next piece); True once it has finished, with
+        # the move set as by best_move()
+        while self.pending and budget > 0:
+            score = self.try_placement(self.board, self.offsets[0], self.targets[0], self.next_kind, 0, 0)
+            if self.score is None or score > self.score:
+                self.rotations, self.rotated_x, self.x = self.rotation_at[0], self.rotated_at[0], self.targets[0]
+                self.score = score
+            self.pending = self.advance(self.board, 0)
+            budget -= 1
+        return not self.pending
+
+    def start(self, board, kind, depth):
+        # Puts the cursor of `depth` on the first placement of `kind` reachable the
+        # way a player gets there; False if the spawn is blocked
+        offset = FIRST_ROTATION[kind]
+        x = min(self.spawn_x, board.width - ROTATIONS[offset])  # As TetrisEngine.rotate()
+        if board.collides(offset, x, 0):
+            return False
+        self.kinds[depth] = kind
+        self.rotation_at[depth] = 0
+        self.offsets[depth] = offset
+        self.rotated_at[depth] = x
+        self.targets[depth] = x
+        self.steps[depth] = -1
+        return True
+
+    def advance(self, board, depth):
+        # Moves the cursor of `depth` on: slide left, then right, until the piece
+        # hits something, then the next rotation; False after the last placement
+        offset = self.offsets[depth]
+        x = self.rotated_at[depth]
+        target = self.targets[depth] + self.steps[depth]
+        if not board.collides(offset, target, 0):
+            self.targets[depth] = target
+            return True
+        if self.steps[depth] < 0 and not board.collides(offset, x + 1, 0):
+            self.targets[depth] = x + 1
+            self.steps[depth] = 1
+            return True
+        kind = self.kinds[depth]
+        rotation = self.rotation_at[depth] + 1
+        if rotation >= ROTATION_COUNT[kind]:
+            return False
+        offset = FIRST_ROTATION[kind] + rotation * ROTATION_SIZE
+        x = min(x, board.width - ROTATIONS[offset])
+        if board.collides(offset, x, 0):
+            return False  # This and every later rotation are out of reach
+        self.rotation_at[depth] = rotation
+        self.offsets[depth] = offset
+        self.rotated_at[depth] = x
+        self.targets[depth] = x
+        self.steps[depth] = -1
+        return True
+
+    def search(self, board, kind, next_kind, depth, lines):
+        # Best score of any placement of `kind`; at depth 0 also records the move
+        if not self.start(board, kind, depth):
+            return None
+        best = None
+        while True:
+            score = self.try_placement(board, self.offsets[depth], self.targets[depth], next_kind, depth, lines)
+            if best is None or score > best:
+                best = score
+                if depth == 0:
+                    self.rotations, self.rotated_x, self.x = self.rotation_at[0], self.rotated_at[0], self.targets[0]
+                    self.score = score
+            if not self.advance(board, depth):
+                return best
+
+    def try_placement(self, board, offset, x, next_kind, depth, lines):
+        scratch = self.scratch[depth]
+        for y in range(board.height):
+            scratch.rows[y] = board.rows[y]
+        y = 0
+        while not scratch.collides(offset, x, y + 1):
+            y += 1
+        scratch.place(offset, x, y)
+        lines += self.settle(scratch)
+        if scratch.rows[0]:
+            return TOPPED_OUT_SCORE
+        if next_kind is not None and depth + 1 < self.depth:
+            score = self.search(scratch, next_kind, None, depth + 1, lines)
+            return TOPPED_OUT_SCORE if score is None else score
+        return self.evaluate(scratch, lines)
+
+    def settle(self, board):
+        # Removes full rows in place, dropping the rows above; returns how many
+        rows = board.rows
+        write = board.height - 1
+        for read in range(board.height - 1, -1, -1):
+            if rows[read] != board.full:
+                rows[write] = rows[read]
+                write -= 1
+        cleared = write + 1
+        while write >= 0:
+            rows[write] = 0
+            write -= 1
+        return cleared
+
+    def evaluate(self, board, lines):
+        self.evaluated += 1
+        heights = self.heights
+        for x in range(board.width):
+            heights[x] = 0
+        covered = 0
+        holes = 0
+        for y in range(board.height):
+            row = board.rows[y]
+            holes += self.popcount[covered & ~row & board.full]
+            new = row & ~covered
+            if new:
+                for x in range(board.width):
+                    if new >> x & 1:
+                        heights[x] = board.height - y
+                covered |= row
+        aggregate = heights[0]
+        bumpiness = 0
+        for x in range(1, board.width):
+            aggregate += heights[x]
+            bumpiness += abs(heights[x] - heights[x - 1])
+        return (self.height_weight * aggregate + self.lines_weight * lines
+                + self.holes_weight * holes + self.bumpiness_weight * bumpiness)
+
+class AutoPlayer:
+    # Plays TetrisGame by queueing the same tilt events a player would produce:
+    # once per spawned piece it searches, then pushes ROTATE presses and one MOVE
+    # onto the game's TiltInput ring, where update() handles them like real input.
+    # The search is spread over ticks, `budget` placements per update(), so a spawn
+    # never stalls a frame; lookahead multiplies the work per placement by the
+    # placements of the next piece (about 24), too much for a tick on the board.
+    def __init__(self, game, lookahead=False, budget=4):
+        self.game = game
+        self.search = PlacementSearch(game.width, game.height, lookahead=lookahead)
+        self.budget = budget
+        self.planned = -1  # engine.pieces when the current piece was planned
+        self.searching = False
+
+    def update(self, now):
+        engine = self.game.engine
+        if engine.pieces != self.planned:
+            self.planned = engine.pieces
+            self.searching = self.search.begin(engine.board, engine.kind, engine.next_kind)
+        if not self.searching or not self.search.resume(self.budget):
+            return
+        self.searching = False
+        tilt = self.game.tilt
+        for _ in range(self.search.rotations):
+            tilt.push(ROTATE, 1, now)
+        if self.search.x != self.search.rotated_x:
+            tilt.push(MOVE, self.search.x - self.search.rotated_x, now)
+
+def play(engine, search, pieces):
+    # Headless self-play through the engine's own rotate/shift/step; returns the
+    # number of pieces placed before `pieces` ran out or the spawn was blocked
+    for placed in range(pieces):
+        if not search.best_move(engine.board, engine.kind, engine.next_kind):
+            return placed
+        for _ in range(search.rotations):
+            engine.rotate()
+        engine.shift(search.x - engine.x)
+        while engine.step() == FELL:
+            pass
+    return pieces
+
+def benchmark(pieces=200, seed=0):
+    # Placements evaluated per second with and without lookahead, on a seeded game
+    # so runs are comparable between CPython and the board
+    rates = []
+    for lookahead in (False, True):
+        random.seed(seed)
+        engine = TetrisEngine()
+        search = PlacementSearch(lookahead=lookahead)
+        start = _clock()
+        placed = play(engine, search, pieces)
+        elapsed = _clock() - start
+        rate = search.evaluated / elapsed if elapsed > 0 else 0.0
+        print(f"lookahead {'on' if lookahead else 'off'}: {placed} pieces, {engine.lines} lines, "
+              f"{engine.games} top-outs, {search.evaluated} placements in {elapsed:.3f}s ({rate:.0f} placements/sec)")
+        rates.append(rate)
+    return rates
+
+if __name__ == '__main__':
+    benchmark()
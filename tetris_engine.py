@@ -0,0 +1,196 @@
+import random
+import time
+
+# Headless Tetris model used by tetris.py. The board is a list of row bitmasks
+# (bit x set = column x filled, row 0 at the top) and every piece rotation is a
+# slice of one packed bytes table of row masks, so collision checks, locking and
+# line clears cost a few integer operations per row instead of one displayio read
+# per cell. Plain Python only, so the same module runs on CircuitPython and on a
+# desktop. Nothing in the per-tick paths (collides, shift, rotate, fall) allocates.
+_SHAPES = {
+    'I': [[(0, 0), (0, 1), (0, 2), (0, 3)], [(0, 0), (1, 0), (2, 0), (3, 0)]],
+    'O': [[(0, 0), (1, 0), (0, 1), (1, 1)]],
+    'S': [[(1, 0), (2, 0), (0, 1), (1, 1)], [(0, 0), (0, 1), (1, 1), (1, 2)]],
+    'Z': [[(0, 0), (1, 0), (1, 1), (2, 1)], [(1, 0), (0, 1), (1, 1), (0, 2)]],
+    'J': [[(0, 0), (0, 1), (1, 1), (2, 1)], [(0, 0), (1, 0), (0, 1), (0, 2)], [(0, 0), (1, 0), (2, 0), (2, 1)], [(1, 0), (1, 1), (0, 2), (1, 2)]],
+    'L': [[(2, 0), (0, 1), (1, 1), (2, 1)], [(0, 0), (0, 1), (0, 2), (1, 2)], [(0, 0), (1, 0), (2, 0), (0, 1)], [(0, 0), (1, 0), (1, 1), (1, 2)]],
+    'T': [[(0, 1), (1, 1), (2, 1), (1, 0)], [(0, 0), (0, 1), (0, 2), (1, 1)], [(0, 0), (1, 0), (2, 0), (1, 1)], [(1, 0), (0, 1), (1, 1), (1, 2)]]
+}
+KINDS = ('I', 'O', 'S', 'Z', 'J', 'L', 'T')
+ROTATION_SIZE = 6  # Bytes per rotation in ROTATIONS: width, height, four row masks
+
+# step() results
+FELL = 'fell'
+LOCKED = 'locked'
+TOPPED_OUT = 'topped_out'
+
+def pack_rotations(shapes):
+    # (dx, dy) cell lists -> (packed rotation table, offset of each kind's first
+    # rotation, rotations per kind). A rotation is ROTATION_SIZE bytes: width,
+    # height, then a mask per row (bit x = column x, top row first, unused rows 0).
+    table = bytearray()
+    first = []
+    counts = []
+    for kind in KINDS:
+        first.append(len(table))
+        counts.append(len(shapes[kind]))
+        for cells in shapes[kind]:
+            masks = bytearray(ROTATION_SIZE - 2)
+            for dx, dy in cells:
+                masks[dy] |= 1 << dx
+            table.append(max(dx for dx, _ in cells) + 1)
+            table.append(max(dy for _, dy in cells) + 1)
+            table.extend(masks)
+    return bytes(table), tuple(first), tuple(counts)
+
+ROTATIONS, FIRST_ROTATION, ROTATION_COUNT = pack_rotations(_SHAPES)
+del _SHAPES  # Only the packed table stays on the heap
+
+def rotation_cells(offset):
+    # (dx, dy) cells of the rotation at `offset` in ROTATIONS; for drawing previews
+    # and host tools, not the game loop
+    return [(dx, dy) for dy in range(ROTATIONS[offset + 1]) for dx in range(ROTATIONS[offset])
+            if ROTATIONS[offset + 2 + dy] >> dx & 1]
+
+class Board:
+    def __init__(self, width=10, height=20):
+        self.width = width
+        self.height = height
+        self.full = (1 << width) - 1
+        self.rows = [0] * height
+
+    def collides(self, offset, x, y):
+        # offset: a rotation in ROTATIONS
+        if x < 0 or x + ROTATIONS[offset] > self.width or y + ROTATIONS[offset + 1] > self.height:
+            return True
+        rows = self.rows
+        for i in range(ROTATIONS[offset + 1]):
+            if y + i >= 0 and rows[y + i] & (ROTATIONS[offset + 2 + i] << x):
+                return True
+        return False
+
+    def place(self, offset, x, y):
+        for i in range(ROTATIONS[offset + 1]):
+            if y + i >= 0:
+                self.rows[y + i] |= ROTATIONS[offset + 2 + i] << x
+
+    def full_rows(self):
+        return [y for y in range(self.height) if self.rows[y] == self.full]
+
+    def remove_rows(self, full_rows):
+        # Ascending order keeps the indices of the rows still to be removed valid
+        for y in sorted(full_rows):
+            del self.rows[y]
+            self.rows.insert(0, 0)
+
+    def top_out(self):
+        return self.rows[0] != 0
+
+    def clear(self):
+        for y in range(self.height):
+            self.rows[y] = 0
+
+class TetrisEngine:
+    # Game state without any display: the board, the falling piece (kind index into
+    # KINDS, rotation index, its offset in ROTATIONS, x, y in board coordinates) and
+    # the next kind. rng is anything with randrange(), the random module by default.
+    def __init__(self, width=10, height=20, rng=random):
+        self.board = Board(width, height)
+        self.rng = rng
+        self.lines = 0
+        self.pieces = 0
+        self.games = 0
+        self.next_kind = self.random_kind()
+        self.spawn()
+
+    def random_kind(self):
+        return self.rng.randrange(len(KINDS))
+
+    def spawn(self):
+        self.kind = self.next_kind
+        self.next_kind = self.random_kind()
+        self.rotation_index = 0
+        self.offset = FIRST_ROTATION[self.kind]
+        self.x = self.board.width // 2 - 2
+        self.y = 0
+
+    def collides(self, dx=0, dy=0):
+        return self.board.collides(self.offset, self.x + dx, self.y + dy)
+
+    def shift(self, dx):
+        # Moves up to |dx| columns, stopping at the first collision; returns the columns moved
+        step = 1 if dx > 0 else -1
+        moved = 0
+        while moved != dx and not self.collides(step):
+            self.x += step
+            moved += step
+        return moved
+
+    def rotate(self):
+        # Next rotation, pushed left if it would overhang the right wall; kept only if it fits
+        index = (self.rotation_index + 1) % ROTATION_COUNT[self.kind]
+        offset = FIRST_ROTATION[self.kind] + index * ROTATION_SIZE
+        x = min(self.x, self.board.width - ROTATIONS[offset])
+        if self.board.collides(offset, x, self.y):
+            return False
+        self.rotation_index = index
+        self.offset = offset
+        self.x = x
+        return True
+
+    def fall(self):
+        if self.collides(dy=1):
+            return False
+        self.y += 1
+        return True
+
+    def lock(self):
+        # Freezes the piece into the board; returns the full rows, not yet removed
+        self.board.place(self.offset, self.x, self.y)
+        self.pieces += 1
+        return self.board.full_rows()
+
+    def collapse(self, full_rows):
+        self.board.remove_rows(full_rows)
+        self.lines += len(full_rows)
+
+    def step(self):
+        # One gravity tick with no animations: fall, or lock, clear, check for a
+        # top-out (which empties the board) and spawn the next piece
+        if self.fall():
+            return FELL
+        self.collapse(self.lock())
+        topped_out = self.board.top_out()
+        if topped_out:
+            self.board.clear()
+            self.games += 1
+        self.spawn()
+        return TOPPED_OUT if topped_out else LOCKED
+
+def _clock():
+    return time.perf_counter() if hasattr(time, 'perf_counter') else time.monotonic()
+
+def benchmark(moves=20000, seed=0):
+    # Simulated moves per second: a seeded random mix of shifts, rotations and
+    # gravity steps, so runs are comparable between CPython and the board
+    random.seed(seed)
+    engine = TetrisEngine()
+    start = _clock()
+    for _ in range(moves):
+        action = random.randrange(4)
+        if action == 0:
+            engine.shift(-1)
+        elif action == 1:
+            engine.shift(1)
+        elif action == 2:
+            engine.rotate()
+        else:
+            engine.step()
+    elapsed = _clock() - start
+    rate = moves / elapsed if elapsed > 0 else 0.0
+    print(f"{moves} moves in {elapsed:.3f}s ({rate:.0f} moves/sec), {engine.pieces} pieces, "
+          f"{engine.lines} lines, {engine.games} top-outs")
+    return rate
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,257 @@
+import sys
+import time
+
+# Tilt controls for the Matrix Portal games. A sensor passes every accelerometer
+# sample taken since the previous poll, stamped with the time it was taken, to a
+# callback; TiltInput low-pass filters them, debounces the thresholds and turns
+# tilt into discrete events on a fixed ring the game empties once per tick. The
+# polling path allocates nothing, so it does not feed the garbage collector. LIS3DHFifo reads
+# the LIS3DH's 32-sample FIFO in one I2C burst; ReplaySensor plays a recorded
+# trace instead, so the event stream and its latency can be checked on a desktop.
+
+# Event kinds
+MOVE = 'move'  # value: signed number of columns
+ROTATE = 'rotate'  # value: 1
+
+_REG_CTRL5 = 0x24
+_REG_OUT_X_L = 0x28
+_REG_FIFO_CTRL = 0x2E
+_REG_FIFO_SRC = 0x2F
+_FIFO_ENABLE = 0x40
+_FIFO_STREAM_MODE = 0x80
+_FIFO_DEPTH = 32
+_AUTO_INCREMENT = 0x80
+_STANDARD_GRAVITY = 9.806
+_DIVIDERS = (16380, 8190, 4096, 1365)  # By range register value: 2, 4, 8, 16 g
+
+class LIS3DHFifo:
+    # Puts an adafruit_lis3dh.LIS3DH_I2C into FIFO stream mode at `rate` Hz. In that
+    # mode the output registers roll over after OUT_Z_H, so the whole FIFO comes out
+    # in a single burst read into a preallocated buffer. Sample times are estimated
+    # from the read time and the data rate. Without direct I2C access (the SPI
+    # driver) it falls back to one `acceleration` read per poll.
+    RATES = {1: 0b0001, 10: 0b0010, 25: 0b0011, 50: 0b0100, 100: 0b0101, 200: 0b0110, 400: 0b0111}
+
+    def __init__(self, accelerometer, rate=100, clock=None):
+        self.accelerometer = accelerometer
+        self.rate = rate
+        self.clock = clock or time.monotonic
+        self.device = getattr(accelerometer, '_i2c', None)
+        self.buffer = bytearray(6 * _FIFO_DEPTH)
+        self.command = bytearray(1)
+        accelerometer.data_rate = self.RATES[rate]
+        self.scale = _STANDARD_GRAVITY / _DIVIDERS[accelerometer.range]
+        if self.device is not None:
+            ctrl5 = accelerometer._read_register_byte(_REG_CTRL5)
+            accelerometer._write_register_byte(_REG_CTRL5, ctrl5 | _FIFO_ENABLE)
+            accelerometer._write_register_byte(_REG_FIFO_CTRL, _FIFO_STREAM_MODE)
+
+    def read(self, callback):
+        # Calls callback(sample time, x, y, z) for each sample, oldest first
+        now = self.clock()
+        if self.device is None:
+            x, y, z = self.accelerometer.acceleration
+            callback(now, x, y, z)
+            return
+        count = self.accelerometer._read_register_byte(_REG_FIFO_SRC) & 0x1F
+        if not count:
+            return
+        self.command[0] = _REG_OUT_X_L | _AUTO_INCREMENT
+        with self.device as i2c:
+            i2c.write_then_readinto(self.command, self.buffer, in_end=6 * count)
+        for i in range(count):
+            callback(now - (count - 1 - i) / self.rate,
+                     self.axis(6 * i), self.axis(6 * i + 2), self.axis(6 * i + 4))
+
+    def axis(self, index):
+        # Little-endian int16 at index, decoded by hand since struct.unpack_from builds a tuple
+        value = self.buffer[index] | self.buffer[index + 1] << 8
+        if value >= 0x8000:
+            value -= 0x10000
+        return value * self.scale
+
+class ReplaySensor:
+    # Plays back (x, y, z) samples recorded at `rate` Hz, releasing each one once the
+    # clock passes its timestamp. Also answers `acceleration` like the driver does.
+    def __init__(self, samples, rate=100, clock=None):
+        self.samples = samples
+        self.rate = rate
+        self.clock = clock or time.monotonic
+        self.start = self.clock()
+        self.position = 0
+
+    def finished(self):
+        return self.position >= len(self.samples)
+
+    def read(self, callback):
+        available = min(len(self.samples), int((self.clock() - self.start) * self.rate) + 1)
+        while self.position < available:
+            sample = self.samples[self.position]
+            callback(self.start + self.position / self.rate, sample[0], sample[1], sample[2])
+            self.position += 1
+
+    @property
+    def acceleration(self):
+        index = min(len(self.samples) - 1, int((self.clock() - self.start) * self.rate))
+        return self.samples[index]
+
+def load_trace(path):
+    # One "x,y,z" sample per line; blank lines and lines starting with # are skipped
+    samples = []
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                x, y, z = line.split(',')
+                samples.append((float(x), float(y), float(z)))
+    return samples
+
+class TiltInput:
+    # Thresholds are in m/s^2 on the filtered signal, matching the original controls:
+    # x beyond +-1.5 moves int((x / 2) ** 2) columns, y below -3 rotates. A control
+    # must hold for `hold` consecutive samples to fire and releases only once back
+    # inside its `release` band; while held it repeats every `repeat` seconds.
+    # tilt_y is the filtered forward tilt, which drives the soft drop. Events wait
+    # on a ring of `capacity` slots; when it is full the oldest one is dropped.
+    def __init__(self, sensor, rate=100, cutoff=5.0, hold=3, repeat=0.5,
+                 move_threshold=1.5, move_release=1.0, rotate_threshold=-3.0, rotate_release=-2.0,
+                 capacity=16):
+        self.sensor = sensor
+        self.on_sample = self.add_sample  # Bound once; binding it in poll() would allocate every tick
+        dt = 1 / rate
+        rc = 1 / (2 * 3.14159 * cutoff)
+        self.alpha = dt / (rc + dt)
+        self.hold = hold
+        self.repeat = repeat
+        self.move_threshold = move_threshold
+        self.move_release = move_release
+        self.rotate_threshold = rotate_threshold
+        self.rotate_release = rotate_release
+        self.tilt_x = 0.0
+        self.tilt_y = 0.0
+        self.primed = False
+        self.move_count = 0
+        self.move_next = None  # time the held move fires next, None when released
+        self.rotate_count = 0
+        self.rotate_next = None
+        # Event ring as parallel lists, filled in place
+        self.kinds = [None] * capacity
+        self.values = [0] * capacity
+        self.times = [0.0] * capacity
+        self.head = 0
+        self.size = 0
+        self.value = 0  # Of the event last returned by next_event()
+        self.sample_time = 0.0
+        self.events = 0
+        self.dropped = 0
+        self.latency_time = 0.0
+        self.latency_max = 0.0
+
+    def poll(self):
+        self.sensor.read(self.on_sample)
+
+    def push(self, kind, value, sample_time):
+        capacity = len(self.kinds)
+        if self.size == capacity:
+            self.head = (self.head + 1) % capacity
+            self.size -= 1
+            self.dropped += 1
+        index = (self.head + self.size) % capacity
+        self.kinds[index] = kind
+        self.values[index] = value
+        self.times[index] = sample_time
+        self.size += 1
+
+    def add_sample(self, sample_time, x, y, z=0.0):
+        if self.primed:
+            self.tilt_x += self.alpha * (x - self.tilt_x)
+            self.tilt_y += self.alpha * (y - self.tilt_y)
+        else:
+            self.tilt_x, self.tilt_y, self.primed = x, y, True
+
+        # Rotation
+        if self.tilt_y < self.rotate_threshold:
+            self.rotate_count += 1
+            if self.rotate_next is None and self.rotate_count >= self.hold:
+                self.rotate_next = sample_time
+            if self.rotate_next is not None and sample_time >= self.rotate_next:
+                self.push(ROTATE, 1, sample_time)
+                self.rotate_next = sample_time + self.repeat
+        elif self.tilt_y > self.rotate_release:
+            self.rotate_count = 0
+            self.rotate_next = None
+
+        # Sideways moves
+        magnitude = abs(self.tilt_x)
+        if magnitude > self.move_threshold:
+            self.move_count += 1
+            if self.move_next is None and self.move_count >= self.hold:
+                self.move_next = sample_time
+            if self.move_next is not None and sample_time >= self.move_next:
+                columns = int((self.tilt_x / 2) ** 2)
+                if columns:
+                    self.push(MOVE, columns if self.tilt_x > 0 else -columns, sample_time)
+                self.move_next = sample_time + self.repeat
+        elif magnitude < self.move_release:
+            self.move_count = 0
+            self.move_next = None
+
+    def next_event(self, now):
+        # Oldest queued event kind, or None once the ring is empty; its value and
+        # sample time are left in self.value and self.sample_time. Records the
+        # sample-to-handling latency.
+        if not self.size:
+            return None
+        kind = self.kinds[self.head]
+        self.value = self.values[self.head]
+        self.sample_time = self.times[self.head]
+        self.kinds[self.head] = None
+        self.head = (self.head + 1) % len(self.kinds)
+        self.size -= 1
+        latency = now - self.sample_time
+        self.events += 1
+        self.latency_time += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+        return kind
+
+    def report(self):
+        mean = self.latency_time / self.events if self.events else 0.0
+        return (f"{self.events} events ({self.dropped} dropped), sample-to-handling latency "
+                f"{1000 * mean:.1f}/{1000 * self.latency_max:.1f} ms (mean/max)")
+
+def synthetic_trace(rate=100):
+    # Rest, tilt right, rest, tip back to rotate, rest, tilt left, with sensor noise
+    # from a generator of its own, so the trace is always the same and the random
+    # module's state is left alone
+    import random
+    noise = random.Random(0)
+    segments = ((0.5, 0.0, 0.0), (1.2, 3.2, 0.0), (0.5, 0.0, 0.0), (0.8, 0.0, -4.5), (0.5, 0.0, 0.0), (1.2, -2.5, 0.0))
+    samples = []
+    for seconds, x, y in segments:
+        for _ in range(int(seconds * rate)):
+            samples.append((x + noise.gauss(0, 0.3), y + noise.gauss(0, 0.3), 9.8))
+    return samples
+
+def main(argv=None):
+    # Host check: replay a trace (or a synthetic one) through TiltInput on a virtual
+    # clock at the game's tick rate and print the resulting events and latency
+    from frame_scheduler import VirtualClock
+    argv = sys.argv[1:] if argv is None else argv
+    rate, tick = 100, 0.02
+    samples = load_trace(argv[0]) if argv else synthetic_trace(rate)
+    clock = VirtualClock()
+    sensor = ReplaySensor(samples, rate, clock.monotonic)
+    tilt = TiltInput(sensor, rate)
+    while not sensor.finished():
+        clock.sleep(tick)
+        tilt.poll()
+        kind = tilt.next_event(clock.monotonic())
+        while kind is not None:
+            print(f"{clock.monotonic():7.3f}s {kind} {tilt.value:+d} (sampled at {tilt.sample_time:.3f}s)")
+            kind = tilt.next_event(clock.monotonic())
+    print(tilt.report())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
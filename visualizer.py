@@ -1,20 +1,46 @@
+import sys
 import time
 import board
 import displayio
-import random
 from adafruit_matrixportal.matrix import Matrix
+from audio_spectrum import FPS, ADCSource, SpectrumAnalyzer, SyntheticSource, WavSource
+
+try:
+    import bitmaptools  # Bulk fills in C; not on every port
+except ImportError:
+    bitmaptools = None
 
 class AudioVisualizer:
-    def __init__(self, width, height):
-        self.matrix = Matrix(width=32, height=32)
+    def __init__(self, width, height, source=None, columns=12, column_width=2, bar_height=None, fps=FPS):
+        # width, height: of the matrix (chained panels included)
+        # source: anything with read(buffer), sample_rate and typecode (see
+        # audio_spectrum); default is an analog microphone on A1
+        # bar_height: tallest bar in pixels, 3/8 of the height by default
+        self.matrix = Matrix(width=width, height=height)
         self.display = self.matrix.display
         self.display.auto_refresh = False
-        self.bitmap = displayio.Bitmap(32, 32, 5)  # Adjusted to 5 colors
+        self.bitmap = displayio.Bitmap(width, height, 5)  # Adjusted to 5 colors
         self.tile_grid = displayio.TileGrid(self.bitmap, pixel_shader=self.setup_palette())
         self.group = displayio.Group()
         self.group.append(self.tile_grid)
         self.display.root_group = self.group
-        self.columns = [6] * 12  # Initial values for the 12 channels
+        self.setup_columns(width, height, columns, column_width, bar_height or height * 3 // 8)
+        self.source = source if source is not None else ADCSource(board.A1)
+        # One block of audio per frame, folded into one band per column
+        self.spectrum = SpectrumAnalyzer(self.source.sample_rate, fps, bands=columns,
+                                         typecode=self.source.typecode)
+        self.frames = 0
+        self.render_time = 0.0
+
+    def setup_columns(self, width, height, columns, column_width, bar_height):
+        self.columns = [0] * columns  # Bar heights as drawn; nothing is drawn yet
+        self.column_width = column_width
+        self.bar_height = bar_height
+        self.left = (width - columns * column_width) // 2  # Bars centred, standing on the bottom row
+        self.bottom = height
+        # Colour of each bar row counted from the bottom: blue, green, yellow, then red
+        # in four equal zones
+        self.row_colors = bytes(1 + 4 * level // bar_height for level in range(bar_height))
 
     def setup_palette(self):
         palette = displayio.Palette(5)
@@ -25,50 +51,72 @@ class AudioVisualizer:
         palette[4] = 0xFF0000  # Red
         return palette
 
-    def clear_visualizer(self):
-        for x in range(4, 28):
-            for y in range(20, 32):
-                self.bitmap[x, y] = 0
+    def fill_rows(self, x, low, high, color):
+        # Bar rows low..high-1 (counted from the bottom) of the column starting at x
+        if bitmaptools is not None:
+            bitmaptools.fill_region(self.bitmap, x, self.bottom - high, x + self.column_width,
+                                    self.bottom - low, color)
+            return
+        for y in range(self.bottom - high, self.bottom - low):
+            for dx in range(self.column_width):
+                self.bitmap[x + dx, y] = color
 
-    def weighted_random_change(self):
-        changes = [-3, -2, -1, 0, 1, 2, 3]
-        weights = [1, 2, 4, 8, 4, 2, 1]
-        total_weight = sum(weights)
-        rand_value = random.uniform(0, total_weight)
-        cumulative_weight = 0
-        for change, weight in zip(changes, weights):
-            cumulative_weight += weight
-            if rand_value < cumulative_weight:
-                return change
+    def draw_column(self, i, old, new):
+        # Touches only the rows between the old and the new height
+        x = self.left + i * self.column_width
+        if new < old:
+            self.fill_rows(x, new, old, 0)
+            return
+        # Growing: one fill per colour zone crossed
+        low = old
+        while low < new:
+            color = self.row_colors[low]
+            high = low + 1
+            while high < new and self.row_colors[high] == color:
+                high += 1
+            self.fill_rows(x, low, high, color)
+            low = high
 
     def update_visualizer(self):
-        self.clear_visualizer()
-        for i in range(12):
-            prev_value = self.columns[i]
-            change = self.weighted_random_change()
-            new_value = prev_value + change
-            new_value = max(1, min(12, new_value))
-            self.columns[i] = new_value
-            x1 = i * 2 + 4
-            x2 = x1 + 1
-            for y in range(32 - new_value, 32):
-                color = 0  # Default to black
-                if y >= 29:
-                    color = 1  # Blue
-                elif 26 <= y < 29:
-                    color = 2  # Green
-                elif 23 <= y < 26:
-                    color = 3  # Yellow
-                elif 20 <= y < 23:
-                    color = 4  # Red
-                self.bitmap[x1, y] = color
-                self.bitmap[x2, y] = color
+        # Returns False once the audio source has run dry
+        if not self.spectrum.update(self.source):
+            return False
+        timer = getattr(time, 'perf_counter', time.monotonic)
+        started = timer()
+        levels = self.spectrum.levels
+        for i in range(len(self.columns)):
+            new_value = 1 + int(levels[i] * (self.bar_height - 1) + 0.5)  # Band level 0..1 -> 1..bar_height pixels
+            if new_value != self.columns[i]:
+                self.draw_column(i, self.columns[i], new_value)
+                self.columns[i] = new_value
+        self.render_time += timer() - started
+        self.frames += 1
+        return True
 
-    def run(self):
-        while True:
-            self.update_visualizer()
+    def run(self, stats_interval=None):
+        # Fixed frame rate of one audio block per frame. A live source blocks in its
+        # read for about a frame, so this mostly paces file playback on a host.
+        # stats_interval: print per-block timing every this many seconds
+        frame = self.spectrum.block_size / self.spectrum.sample_rate
+        next_frame = last_stats = time.monotonic()
+        while self.update_visualizer():
             self.display.refresh()
-            time.sleep(0.1)  # Update frequency
+            next_frame += frame
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_frame = time.monotonic()  # Fell behind; do not try to catch up
+            if stats_interval and time.monotonic() - last_stats >= stats_interval:
+                print(self.spectrum.report())
+                print(f"render {1000 * self.render_time / (self.frames or 1):.2f} ms/frame over {self.frames} frames")
+                last_stats = time.monotonic()
 
-visualizer = AudioVisualizer(32, 32)
-visualizer.run()
\ No newline at end of file
+if __name__ == '__main__':
+    # On a host (see host_emulation) pass a WAV file, or "synthetic" for a test
+    # sweep; with neither it hears host_emulation's microphone on the ADC
+    source = None
+    if len(sys.argv) > 1:
+        source = SyntheticSource(loop=True) if sys.argv[1] == 'synthetic' else WavSource(sys.argv[1], loop=True)
+    visualizer = AudioVisualizer(32, 32, source)
+    visualizer.run()